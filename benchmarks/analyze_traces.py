@@ -0,0 +1,119 @@
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+# Reconstructs the traced requests from the span files the services write to TRACE_DIR and reports where their time
+# went. The critical path of a request is the chain of hops and steps that determined its latency: walking back from
+# the end of a span, the child that finished last is on it, then the one that finished last before that child
+# started, and so on. The gaps in between are the span's own time. Components are ranked by the critical path time
+# they account for over all the analyzed requests, and the slowest requests are printed with their critical path.
+
+
+def load_spans(trace_dir):
+    spans = []
+    for path in glob.glob(os.path.join(trace_dir, "*.jsonl")):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                # the last line of a file may be torn if its service was killed while writing
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                span["end"] = span["start"] + span["duration"]
+                span["component"] = f"{span['service']} {span['name']}"
+                spans.append(span)
+    return spans
+
+
+def build_traces(spans):
+    # trace id -> (root span, span id -> children)
+    by_trace = defaultdict(list)
+    for span in spans:
+        by_trace[span["trace_id"]].append(span)
+    traces = {}
+    for trace_id, trace_spans in by_trace.items():
+        ids = {span["span_id"] for span in trace_spans}
+        roots = [span for span in trace_spans if span["parent_id"] not in ids]
+        children = defaultdict(list)
+        for span in trace_spans:
+            if span["parent_id"] in ids:
+                children[span["parent_id"]].append(span)
+        # the request that started the trace is the earliest span without a parent
+        root = min(roots, key=lambda span: span["start"])
+        traces[trace_id] = (root, children)
+    return traces
+
+
+def critical_path(span, children, start, end, depth=0):
+    # the [depth, component, own seconds, span seconds] entries of span and of its children on the critical path, in
+    # the order they ran, within the [start, end] window of its parent
+    entry = [depth, span["component"], 0.0, min(span["end"], end) - max(span["start"], start)]
+    cursor = min(span["end"], end)
+    floor = max(span["start"], start)
+    own = 0.0
+    # walking back from the end, so the child paths are found latest first
+    child_paths = []
+    for child in sorted(children.get(span["span_id"], ()), key=lambda child: child["end"], reverse=True):
+        if child["start"] >= cursor or child["end"] <= floor:
+            continue
+        own += max(0.0, cursor - min(child["end"], cursor))
+        child_paths.append(critical_path(child, children, floor, cursor, depth + 1))
+        cursor = max(child["start"], floor)
+    own += max(0.0, cursor - floor)
+    entry[2] = own
+    path = [entry]
+    for child_path in reversed(child_paths):
+        path.extend(child_path)
+    return path
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace_dir", help="Directory the services wrote their spans to (TRACE_DIR)")
+    parser.add_argument("--root", help="Only analyze the requests whose root span has this name, e.g. 'POST /orders'")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest requests to print")
+    args = parser.parse_args()
+
+    traces = build_traces(load_spans(args.trace_dir))
+    if args.root:
+        traces = {trace_id: trace for trace_id, trace in traces.items() if trace[0]["name"] == args.root}
+    if not traces:
+        raise SystemExit(f"no traces found in {args.trace_dir}")
+
+    # latency of the requests per root span
+    durations = defaultdict(list)
+    for root, _ in traces.values():
+        durations[root["component"]].append(root["duration"])
+    print(f"{len(traces)} requests")
+    print(f"{'request':<40} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for component, values in sorted(durations.items(), key=lambda item: -len(item[1])):
+        print(f"{component:<40} {len(values):>7} {sum(values) / len(values) * 1000:>9.2f} "
+              f"{percentile(values, 0.5) * 1000:>9.2f} {percentile(values, 0.99) * 1000:>9.2f}")
+
+    # own time on the critical paths per component, over all the requests
+    critical = defaultdict(float)
+    total = 0.0
+    paths = {}
+    for trace_id, (root, children) in traces.items():
+        path = critical_path(root, children, root["start"], root["end"])
+        paths[trace_id] = path
+        for _, component, own, _ in path:
+            critical[component] += own
+        total += root["duration"]
+    print()
+    print(f"{'component (own time on the critical path)':<56} {'total s':>9} {'share':>7} {'per request ms':>15}")
+    for component, seconds in sorted(critical.items(), key=lambda item: -item[1]):
+        print(f"{component:<56} {seconds:>9.3f} {seconds / total * 100:>6.1f}% {seconds / len(traces) * 1000:>15.3f}")
+
+    print()
+    for trace_id, (root, _) in sorted(traces.items(), key=lambda item: -item[1][0]["duration"])[:args.top]:
+        print(f"trace {trace_id}: {root['component']} {root['duration'] * 1000:.2f} ms")
+        for depth, component, own, seconds in paths[trace_id]:
+            print(f"    {'  ' * depth}{component:<{52 - 2 * depth}} {seconds * 1000:>9.2f} ms (own {own * 1000:.2f} ms)")
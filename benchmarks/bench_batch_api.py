@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import STOCK_NAMES, Topology
+
+# Compares looking up and trading N stocks with N single requests against one batch request
+# (GET /stocks?names=... and POST /orders/batch). The cache is off so that every lookup reaches the catalog.
+
+
+def single_lookups(session, url, names):
+    for name in names:
+        session.get(url + "/stocks/" + name)
+
+
+def batch_lookup(session, url, names):
+    session.get(url + "/stocks?names=" + ",".join(names))
+
+
+def single_trades(session, url, orders):
+    for order in orders:
+        session.post(url + "/orders", json=order)
+
+
+def batch_trade(session, url, orders):
+    session.post(url + "/orders/batch", json={"orders": orders})
+
+
+def measure(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--items", type=int, nargs="+", default=[1, 10, 50], help="Stocks per batch")
+    parser.add_argument("--repeats", type=int, default=20, help="Repetitions per measurement, the median is reported")
+    args = parser.parse_args()
+
+    with Topology(env={"ENABLE_CACHE": "False"}) as topology:
+        url = topology.frontend_url
+        session = requests.Session()
+        print(f"{'items':>5} {'single lookups ms':>18} {'batch lookup ms':>16} {'single trades ms':>17} {'batch trade ms':>15}")
+        for items in args.items:
+            names = [STOCK_NAMES[i % len(STOCK_NAMES)] for i in range(items)]
+            # every buy is followed by a sell of the same stock, which keeps the quantities stable over the repetitions
+            buys = [{"name": name, "type": "buy", "quantity": 1} for name in names]
+            sells = [dict(order, type="sell") for order in buys]
+            results = (
+                measure(lambda: single_lookups(session, url, names), args.repeats),
+                measure(lambda: batch_lookup(session, url, names), args.repeats),
+                measure(lambda: (single_trades(session, url, buys), single_trades(session, url, sells)), args.repeats) / 2,
+                measure(lambda: (batch_trade(session, url, buys), batch_trade(session, url, sells)), args.repeats) / 2,
+            )
+            print(f"{items:>5} " + " ".join(f"{result * 1000:>{width}.2f}" for result, width in zip(results, (18, 16, 17, 15))))
@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import STOCK_NAMES, Topology
+
+# Opens many concurrent keep-alive client sessions against the front-end in its threaded and asyncio
+# server modes and reports the lookup throughput, the failed sessions and the front-end's peak memory.
+
+
+async def session(port, requests_per_session, index, results):
+    try:
+        reader, writer = await asyncio.open_connection("localhost", port)
+    except OSError:
+        results["failed"] += 1
+        return
+    try:
+        for i in range(requests_per_session):
+            name = STOCK_NAMES[(index + i) % len(STOCK_NAMES)]
+            writer.write(f"GET /stocks/{name} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            results["requests"] += 1
+    except (OSError, asyncio.IncompleteReadError):
+        results["failed"] += 1
+    finally:
+        writer.close()
+
+
+async def drive(port, sessions, requests_per_session):
+    results = {"requests": 0, "failed": 0}
+    start = time.monotonic()
+    await asyncio.gather(*(session(port, requests_per_session, i, results) for i in range(sessions)))
+    return results, time.monotonic() - start
+
+
+def peak_rss_kb(pid):
+    # linux only, VmHWM is the peak resident set size of the process
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--sessions", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("-n", "--requests", type=int, default=20, help="Lookups per session")
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'sessions':>8} {'lookups/sec':>12} {'failed':>7} {'peak rss (MB)':>14}")
+    for mode in ("threaded", "asyncio"):
+        for sessions in args.sessions:
+            with Topology(order_instances=1, env={"FRONTEND_SERVER_MODE": mode}) as topology:
+                frontend_pid = topology.processes[-1][0].pid
+                results, elapsed = asyncio.run(drive(topology.frontend_port, sessions, args.requests))
+                rss = peak_rss_kb(frontend_pid) / 1024
+            print(f"{mode:<10} {sessions:>8} {results['requests'] / elapsed:>12.1f} {results['failed']:>7} {rss:>14.1f}")
@@ -0,0 +1,29 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import Topology, run_trades
+from common.group_commit import POLICIES
+
+# Measures trades/sec through an order instance and the catalog under each FSYNC_POLICY.
+# Every trade persists one change log record in the catalog and one order in the order log.
+
+
+def run_policy(policy, clients, duration):
+    env = {"FSYNC_POLICY": policy, "ENABLE_CACHE": "False"}
+    with Topology(order_instances=1, frontend=False, env=env) as topology:
+        return run_trades(topology.order_url(1) + "/trade", clients, duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--clients", type=int, default=16, help="Number of concurrent trading clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run each policy")
+    parser.add_argument("-p", "--policies", nargs="+", default=list(POLICIES), choices=POLICIES)
+    args = parser.parse_args()
+
+    print(f"{'policy':<10} {'trades':>8} {'trades/sec':>12}")
+    for policy in args.policies:
+        trades, elapsed = run_policy(policy, args.clients, args.duration)
+        print(f"{policy:<10} {trades:>8} {trades / elapsed:>12.1f}")
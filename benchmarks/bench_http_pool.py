@@ -0,0 +1,65 @@
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+from statistics import mean
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import REPO_ROOT, Topology
+
+# Compares the client.py latencies with fresh connections per inter-service call (HTTP_POOLING=False, the
+# behaviour before pooling) against the pooled keep-alive connections. Both runs boot the same topology
+# on free ports and run the same number of concurrent client.py sessions.
+
+OPERATIONS = ["lookup_latency", "trade_buy_latency", "trade_sell_latency", "query_latency"]
+PROBABILITIES = [0.2, 0.4, 0.6, 0.8]
+
+
+def run_clients(topology, clients, rounds):
+    # runs client.py like visualization_generator.sh does and returns the per client latency pickles
+    results = []
+    with tempfile.TemporaryDirectory() as pickle_dir:
+        for round_num in range(rounds):
+            processes = []
+            for client_num in range(clients):
+                pickle_file = os.path.join(pickle_dir, f"latencies_{round_num}_{client_num}.pkl")
+                process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "client.py"), "-c", pickle_file],
+                                           env=topology.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                processes.append((process, pickle_file))
+            for process, pickle_file in processes:
+                process.wait()
+                if os.path.exists(pickle_file):
+                    with open(pickle_file, "rb") as f:
+                        results.append(pickle.load(f))
+    return results
+
+
+def mean_latencies(results):
+    # averages every operation over the clients and probabilities that made at least one such request
+    latencies = {}
+    for operation in OPERATIONS:
+        values = [result[f"{operation}_{p}"] for result in results for p in PROBABILITIES
+                  if result.get(f"{operation}_{p}")]
+        latencies[operation] = mean(values) if values else 0
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--clients", type=int, default=5, help="Concurrent client.py sessions per round")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="Rounds of client sessions per mode")
+    args = parser.parse_args()
+
+    table = {}
+    for label, pooling in (("before", "False"), ("after", "True")):
+        with Topology(env={"HTTP_POOLING": pooling}) as topology:
+            table[label] = mean_latencies(run_clients(topology, args.clients, args.rounds))
+
+    print(f"{'operation':<20} {'before (ms)':>12} {'after (ms)':>12} {'change':>8}")
+    for operation in OPERATIONS:
+        before = table["before"][operation] * 1000
+        after = table["after"][operation] * 1000
+        change = f"{(after - before) / before:+.0%}" if before else "n/a"
+        print(f"{operation:<20} {before:>12.2f} {after:>12.2f} {change:>8}")
@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import Topology, run_trades
+from common import log
+
+# Measures what the messages on the hot paths cost. In-process, threads append to a list under a lock and emit one
+# message per append the way the order service did: with a print to a line buffered file (the services run with
+# PYTHONUNBUFFERED, so every print is a write of its own), with a disabled debug message and with an enabled one that
+# the background writer appends to a file. Then trades/sec through an order instance and the catalog are measured
+# with LOG_LEVEL=debug and LOG_LEVEL=info.
+
+
+def hot_path(emit, threads, iterations):
+    lock = threading.Lock()
+    data = []
+
+    def worker():
+        for i in range(iterations):
+            emit(i)
+            with lock:
+                data.append(i)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * iterations / (time.perf_counter() - start)
+
+
+def in_process(threads, iterations, directory):
+    results = {"no message": hot_path(lambda i: None, threads, iterations)}
+
+    with open(os.path.join(directory, "print.out"), "w", buffering=1) as output, contextlib.redirect_stdout(output):
+        results["print"] = hot_path(lambda i: print(f"Transaction number: {i}"), threads, iterations)
+
+    disabled = log.Logger("bench", log.INFO)
+    results["debug disabled"] = hot_path(lambda i: disabled.debug("Transaction number: %s", i), threads, iterations)
+
+    # the writer opens its file with the first message
+    log.log_file = os.path.join(directory, "log.out")
+    enabled = log.Logger("bench", log.DEBUG)
+    results["debug enabled"] = hot_path(lambda i: enabled.debug("Transaction number: %s", i), threads, iterations)
+    log.writer.flush()
+    return results
+
+
+def trades_per_sec(level, clients, duration):
+    with Topology(order_instances=1, frontend=False, env={"LOG_LEVEL": level, "ENABLE_CACHE": "False"}) as topology:
+        trades, elapsed = run_trades(topology.order_url(1) + "/trade", clients, duration)
+        return trades / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--threads", type=int, default=8, help="Threads of the in-process hot path")
+    parser.add_argument("-n", "--iterations", type=int, default=50000, help="Messages per thread in-process")
+    parser.add_argument("-c", "--clients", type=int, default=16, help="Number of concurrent trading clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to trade at each level")
+    parser.add_argument("--in-process-only", action="store_true", help="Skip the run against the services")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = in_process(args.threads, args.iterations, directory)
+    print(f"{'hot path':<16} {'appends/sec':>12} {'ns per message':>15}")
+    for name, rate in results.items():
+        overhead = (1 / rate - 1 / results["no message"]) * 1e9
+        print(f"{name:<16} {rate:>12.0f} {overhead:>15.0f}")
+
+    if not args.in_process_only:
+        print()
+        print(f"{'LOG_LEVEL':<10} {'trades/sec':>12}")
+        for level in ("debug", "info"):
+            print(f"{level:<10} {trades_per_sec(level, args.clients, args.duration):>12.1f}")
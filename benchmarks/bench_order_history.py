@@ -0,0 +1,120 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "purchase_app"))
+from benchmarks.topology import STOCK_NAMES, Topology
+from order_log import OrderLog
+
+# Measures the memory and the /query/ latency of an order instance holding a long order history, once with every
+# order in memory (HOT_WINDOW_ORDERS=0) and once with a bounded hot window. The order log is generated once per size
+# and copied into each run. For comparison it also estimates what the same history took as the list of dicts the
+# service kept before.
+
+
+def generate_log(directory, orders, segment_records):
+    log = OrderLog(directory, segment_records)
+    batch = 100000
+    for start in range(1, orders + 1, batch):
+        log.append([
+            {'Transaction number' : txn, 'name' : STOCK_NAMES[txn % len(STOCK_NAMES)],
+             'order type' : "buy" if txn % 2 else "sell", 'quantity' : txn % 100 + 1}
+            for txn in range(start, min(orders, start + batch - 1) + 1)
+        ])
+    log.close()
+
+
+def dict_list_estimate(orders):
+    # memory of the old representation, measured on a sample and scaled up
+    sample = min(orders, 200000)
+    tracemalloc.start()
+    rows = [
+        {'Transaction number' : str(txn), 'name' : STOCK_NAMES[txn % len(STOCK_NAMES)],
+         'order type' : "buy" if txn % 2 else "sell", 'quantity' : str(txn % 100 + 1)}
+        for txn in range(1, sample + 1)
+    ]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return size * orders / sample
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def query_latencies(url, txns):
+    session = requests.Session()
+    latencies = []
+    for txn in txns:
+        start = time.perf_counter()
+        response = session.get(f"{url}/query/{txn}")
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"query {txn} failed: {response.status_code}")
+    session.close()
+    return sorted(latencies)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(log_directory, orders, hot_window, queries):
+    topology = Topology(order_instances=1, frontend=False, env={"HOT_WINDOW_ORDERS": hot_window}, startup_timeout=600)
+    shutil.copytree(log_directory, os.path.join(topology.workdir, "purchase_app", "resources", "order_log_id1"))
+    start = time.monotonic()
+    try:
+        topology.start()
+        startup = time.monotonic() - start
+        url = topology.order_url(1)
+        process = topology.processes[1][0]
+
+        window = hot_window or orders
+        patterns = {
+            # the newest orders, the ones still in the hot window
+            "recent": [random.randint(orders - window + 1, orders) for _ in range(queries)],
+            # any order of the history
+            "uniform": [random.randint(1, orders) for _ in range(queries)],
+            # runs of neighbouring old orders, like a client paging through its history
+            "scan": [base + i for base in random.sample(range(1, orders - 64), queries // 64 or 1) for i in range(64)],
+        }
+        results = {name: query_latencies(url, txns) for name, txns in patterns.items()}
+        return startup, rss_mb(process.pid), results
+    finally:
+        topology.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--orders", type=int, nargs="+", default=[1000000, 10000000], help="History sizes")
+    parser.add_argument("-w", "--hot-window", type=int, default=100000, help="HOT_WINDOW_ORDERS of the bounded run")
+    parser.add_argument("-q", "--queries", type=int, default=2000, help="Queries per access pattern")
+    parser.add_argument("--segment-records", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'orders':>9} {'window':>8} {'startup s':>9} {'rss MB':>8} {'pattern':<8} {'p50 ms':>7} {'p99 ms':>7}")
+    for orders in args.orders:
+        log_directory = tempfile.mkdtemp(prefix="order-history-")
+        try:
+            generate_log(log_directory, orders, args.segment_records)
+            print(f"{orders:>9} {'dicts':>8} {'':>9} {dict_list_estimate(orders) / 2**20:>8.0f}  (estimated, before)")
+            for hot_window in (0, args.hot_window):
+                startup, rss, results = run(log_directory, orders, hot_window, args.queries)
+                for pattern, latencies in results.items():
+                    print(f"{orders:>9} {hot_window or 'all':>8} {startup:>9.1f} {rss:>8.0f} {pattern:<8} "
+                          f"{percentile(latencies, 0.5) * 1000:>7.2f} {percentile(latencies, 0.99) * 1000:>7.2f}")
+        finally:
+            shutil.rmtree(log_directory, ignore_errors=True)
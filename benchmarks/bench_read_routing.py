@@ -0,0 +1,105 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_replication import percentile
+from benchmarks.topology import STOCK_NAMES, Topology
+
+# Compares ORDER_READ_ROUTING=leader with ORDER_READ_ROUTING=replicas: query clients read random existing orders
+# through the front-end while trade clients keep the leader busy and read back every order they just placed,
+# which exercises the guard that forwards a query to the leader when a follower has not received the order yet.
+# Reports the query throughput and latency and how the reads were spread over the instances.
+
+ROUTING_MODES = ("leader", "replicas")
+
+
+def trade_worker(url, deadline, txns, index, errors):
+    session = requests.Session()
+    i = 0
+    while time.monotonic() < deadline:
+        trade_type = "buy" if i % 2 == 0 else "sell"
+        name = STOCK_NAMES[(index + i // 2) % len(STOCK_NAMES)]
+        response = session.post(url + "/orders", json={"name": name, "type": trade_type, "quantity": 1})
+        if response.status_code == 200:
+            txn = response.json()["data"]["transaction number"]
+            txns.append(txn)
+            # reading the own write right away, replication to the followers may still be in flight
+            if session.get(url + f"/orders/{txn}").status_code != 200:
+                errors.append(txn)
+        i += 1
+    session.close()
+
+
+def query_worker(url, deadline, txns, latencies, errors):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        txn = random.choice(txns)
+        start = time.perf_counter()
+        response = session.get(url + f"/orders/{txn}")
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(txn)
+    session.close()
+
+
+def run(routing, replicas, query_clients, trade_clients, duration, seed_orders):
+    env = {"ORDER_READ_ROUTING": routing, "REPLICATION_ACK": "async", "ENABLE_CACHE": "False"}
+    with Topology(order_instances=replicas, env=env) as topology:
+        url = topology.frontend_url
+        txns, errors, latencies = [], [], []
+        deadline = time.monotonic() + duration + 60
+        # seeding orders to read, one client so that it finishes quickly
+        session = requests.Session()
+        for i in range(seed_orders):
+            response = session.post(url + "/orders", json={"name": STOCK_NAMES[i % len(STOCK_NAMES)],
+                                                           "type": "buy" if i % 2 == 0 else "sell", "quantity": 1})
+            txns.append(response.json()["data"]["transaction number"])
+        session.close()
+        # the followers receive the seed asynchronously, give them a moment before the reads start
+        time.sleep(1)
+        base_stats = requests.get(url + "/read_stats").json()["data"]["served"]
+
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=query_worker, args=(url, deadline, txns, latencies, errors))
+                   for _ in range(query_clients)]
+        threads += [threading.Thread(target=trade_worker, args=(url, deadline, txns, i, errors))
+                    for i in range(trade_clients)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        stats = requests.get(url + "/read_stats").json()["data"]
+        served = {instance_id: count - base_stats.get(instance_id, 0) for instance_id, count in stats["served"].items()}
+    return latencies, errors, served, stats["forwarded_to_leader"], elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--modes", nargs="+", default=list(ROUTING_MODES), choices=ROUTING_MODES)
+    parser.add_argument("-r", "--replicas", type=int, default=3, help="Number of order replicas")
+    parser.add_argument("-c", "--clients", type=int, default=16, help="Number of concurrent query clients")
+    parser.add_argument("-t", "--trade-clients", type=int, default=2, help="Number of concurrent trading clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run each mode")
+    parser.add_argument("-s", "--seed-orders", type=int, default=500, help="Orders placed before the reads start")
+    args = parser.parse_args()
+
+    for routing in args.modes:
+        latencies, errors, served, forwarded, elapsed = run(routing, args.replicas, args.clients, args.trade_clients,
+                                                            args.duration, args.seed_orders)
+        print(f"routing={routing}: {len(latencies) / elapsed:.1f} queries/sec, "
+              f"mean {statistics.mean(latencies) * 1000:.2f} ms, p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms, failed reads {len(errors)}, "
+              f"forwarded to the leader {forwarded}")
+        for instance_id in sorted(served):
+            print(f"    {instance_id:>6} {served[instance_id] / elapsed:>9.1f} reads/sec")
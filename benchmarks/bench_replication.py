@@ -0,0 +1,60 @@
+import argparse
+import os
+import signal
+import statistics
+import sys
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import Topology, run_trades
+
+# Measures the latency of trades through the front-end for a growing number of order replicas under each
+# REPLICATION_ACK policy. With --stall one follower is paused (SIGSTOP) for the whole run to show how a slow
+# follower affects the trades under each policy.
+
+ACK_POLICIES = ("async", "quorum", "all")
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(replicas, policy, clients, duration, stall):
+    env = {"REPLICATION_ACK": policy, "ENABLE_CACHE": "False"}
+    with Topology(order_instances=replicas, env=env) as topology:
+        url = topology.frontend_url + "/orders"
+        # warm up, the front-end elects the leader on the first trade
+        requests.post(url, json={"name": "GameStart", "type": "buy", "quantity": 1})
+        stalled = None
+        if stall:
+            # the highest numbered instance is the leader, instance 1 is always a follower
+            stalled = topology.processes[1][0]
+            stalled.send_signal(signal.SIGSTOP)
+
+        latencies = []
+        _, elapsed = run_trades(url, clients, duration, latencies)
+        if stalled is not None:
+            stalled.send_signal(signal.SIGCONT)
+    return latencies, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--replicas", type=int, nargs="+", default=[3, 5, 7, 9], help="Order replica counts")
+    parser.add_argument("-p", "--policies", nargs="+", default=list(ACK_POLICIES), choices=ACK_POLICIES)
+    parser.add_argument("-c", "--clients", type=int, default=8, help="Number of concurrent trading clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run each configuration")
+    parser.add_argument("--stall", action="store_true", help="Pause one follower for the whole run")
+    args = parser.parse_args()
+
+    print(f"{'replicas':>8} {'policy':<8} {'trades/sec':>11} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for replicas in args.replicas:
+        for policy in args.policies:
+            latencies, elapsed = run(replicas, policy, args.clients, args.duration, args.stall)
+            if not latencies:
+                print(f"{replicas:>8} {policy:<8} no successful trades")
+                continue
+            print(f"{replicas:>8} {policy:<8} {len(latencies) / elapsed:>11.1f} "
+                  f"{statistics.mean(latencies) * 1000:>8.2f} {percentile(latencies, 0.5) * 1000:>8.2f} "
+                  f"{percentile(latencies, 0.95) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
@@ -0,0 +1,302 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import Topology, REPO_ROOT
+
+# Runs a performance sweep unattended: for every combination of client count, ENABLE_CACHE, order replica count and
+# trade probability it boots the catalog, the order replicas and the front-end on free local ports from a fresh copy
+# of the resources, drives the front-end with load_generator.py (closed loop, one session per client) and records the
+# throughput and the p50/p95/p99 latencies per operation.
+#
+# The results go to a directory named after the time and the commit: results.json (with the commit, the machine and
+# the service settings, so runs of different commits can be compared), results.csv, report.md and, when matplotlib
+# is installed, plots of throughput and latency against the client count. --baseline compares the run with the
+# results.json of an earlier one, configuration by configuration.
+
+RESULTS_ROOT = os.path.join(REPO_ROOT, "benchmarks", "results")
+LOAD_GENERATOR = os.path.join(REPO_ROOT, "load_generator.py")
+# the fields identifying a configuration of the sweep, in the order of the tables
+CONFIG_FIELDS = ("cache", "replicas", "clients", "trade_probability")
+PERCENTILES = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata(args):
+    # what a run has to be compared on: the code, the machine and the settings of the services
+    setting_names = []
+    with open(os.path.join(REPO_ROOT, "env_setup.sh")) as env_setup:
+        for line in env_setup:
+            if line.startswith("export "):
+                setting_names.append(line[len("export "):].split("=", 1)[0])
+    extra_env = dict(args.env)
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "think_time": args.think_time,
+        "query_share": args.query_share,
+        "seed": args.seed,
+        # the service settings that were not left to their defaults, the ports excepted
+        "settings": {name: extra_env.get(name, os.environ.get(name)) for name in setting_names
+                     if (name in extra_env or name in os.environ) and not name.endswith(("_PORT", "_HOSTNAME"))},
+    }
+
+
+def mix(trade_probability, query_share):
+    # the trades are split evenly between buys and sells, the rest of the requests are lookups
+    lookup = 1 - trade_probability - query_share
+    if lookup < 0:
+        raise ValueError(f"trade probability {trade_probability} and query share {query_share} add up to more than 1")
+    return f"lookup={lookup},buy={trade_probability / 2},sell={trade_probability / 2},query={query_share}"
+
+
+def run_point(config, args, output_dir):
+    # boots a fresh topology for one configuration and returns the load generator's summary
+    env = {"ENABLE_CACHE": str(config["cache"])}
+    env.update(dict(args.env))
+    name = "-".join(f"{field}_{config[field]}" for field in CONFIG_FIELDS)
+    summary_file = os.path.join(output_dir, "points", f"{name}.json")
+    with Topology(order_instances=config["replicas"], frontend=True, env=env) as topology:
+        command = [sys.executable, LOAD_GENERATOR, "--host", "localhost", "--port", str(topology.frontend_port),
+                   "--mode", "closed", "--sessions", str(config["clients"]),
+                   "--mix", mix(config["trade_probability"], args.query_share),
+                   "--duration", str(args.duration), "--warmup", str(args.warmup),
+                   "--ramp-up", str(min(1.0, args.warmup)), "--think-time", str(args.think_time),
+                   "--seed", str(args.seed), "--summary", summary_file]
+        if args.keep_latencies:
+            command += ["--latencies", os.path.join(output_dir, "points", f"{name}.csv")]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                       timeout=args.warmup + args.duration + 120)
+    with open(summary_file) as file:
+        return json.load(file)
+
+
+def row(result):
+    # the flat table row of a result: its configuration and the totals over all the operations
+    values = {field: result["config"][field] for field in CONFIG_FIELDS}
+    total = result.get("operations", {}).get("total")
+    if total is None:
+        values.update({"throughput": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "failed": None,
+                       "error": result.get("error")})
+    else:
+        values.update({"throughput": round(total["throughput"], 1), "failed": total["failed"],
+                       **{key: round(total[key], 2) for key in PERCENTILES}, "error": None})
+    return values
+
+
+def format_table(rows, columns):
+    # a markdown table
+    lines = ["| " + " | ".join(columns) + " |", "|" + "|".join("---:" for _ in columns) + "|"]
+    for values in rows:
+        lines.append("| " + " | ".join("-" if values[column] is None else str(values[column])
+                                       for column in columns) + " |")
+    return "\n".join(lines)
+
+
+def metadata_differences(metadata, baseline_metadata):
+    # the measurement conditions two runs differ in, besides the code
+    keys = ("duration", "warmup", "think_time", "query_share", "seed", "cpus", "python", "settings")
+    return [f"{key}: {baseline_metadata.get(key)} before, {metadata.get(key)} now" for key in keys
+            if metadata.get(key) != baseline_metadata.get(key)]
+
+
+def config_key(config):
+    return tuple(config[field] for field in CONFIG_FIELDS)
+
+
+def load_baseline(path):
+    # the results.json of an earlier run, checked to hold what compare() and the report read from it
+    try:
+        with open(path) as file:
+            baseline = json.load(file)
+    except (OSError, ValueError) as error:
+        raise ValueError(f"cannot read the baseline {path}: {error}") from None
+    if not isinstance(baseline, dict) or not isinstance(baseline.get("meta"), dict) \
+            or not isinstance(baseline.get("results"), list) \
+            or not all(isinstance(result, dict) and isinstance(result.get("config"), dict)
+                       and all(field in result["config"] for field in CONFIG_FIELDS) for result in baseline["results"]):
+        raise ValueError(f"the baseline {path} is not the results.json of a run_benchmarks.py run")
+    return baseline
+
+
+def compare(results, baseline):
+    # the change of throughput and p99 latency of every configuration measured in both runs
+    baseline_rows = {config_key(result["config"]): row(result) for result in baseline["results"]}
+    rows = []
+    for result in results:
+        current = row(result)
+        previous = baseline_rows.get(config_key(result["config"]))
+        if previous is None or current["throughput"] is None or previous["throughput"] is None:
+            continue
+        change = {field: current[field] for field in CONFIG_FIELDS}
+        for key in ("throughput", "p99_ms"):
+            change[f"{key} before"] = previous[key]
+            change[f"{key} after"] = current[key]
+            change[f"{key} change"] = (f"{(current[key] - previous[key]) / previous[key] * 100:+.1f}%"
+                                       if previous[key] else "-")
+        rows.append(change)
+    return rows
+
+
+def plot(rows, output_dir):
+    # throughput and latency percentiles against the client count, one line per cache, replicas and trade probability
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, the plots are skipped")
+        return []
+    figure, axes = plt.subplots(2, 2, figsize=(14, 10))
+    series = {}
+    for values in rows:
+        if values["throughput"] is not None:
+            label = f"cache={values['cache']} replicas={values['replicas']} trade p={values['trade_probability']}"
+            series.setdefault(label, []).append(values)
+    for axis, (key, title) in zip(axes.flat, (("throughput", "Throughput (requests/sec)"), ("p50_ms", "p50 latency (ms)"),
+                                              ("p95_ms", "p95 latency (ms)"), ("p99_ms", "p99 latency (ms)"))):
+        for label, points in series.items():
+            points.sort(key=lambda values: values["clients"])
+            axis.plot([values["clients"] for values in points], [values[key] for values in points], marker="o",
+                      label=label)
+        axis.set_xlabel("Clients")
+        axis.set_title(title)
+        axis.grid(True)
+    axes.flat[0].legend(fontsize="small")
+    figure.tight_layout()
+    path = os.path.join(output_dir, "latency_throughput.png")
+    figure.savefig(path)
+    plt.close(figure)
+    return [path]
+
+
+def parse_bool(value):
+    if value not in ("True", "False"):
+        raise argparse.ArgumentTypeError("expected True or False")
+    return value == "True"
+
+
+def parse_env(value):
+    name, separator, setting = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE")
+    return name, setting
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--clients", type=int, nargs="+", default=[1, 10, 50], help="Concurrent client sessions")
+    parser.add_argument("--cache", type=parse_bool, nargs="+", default=[True, False], help="ENABLE_CACHE values")
+    parser.add_argument("-r", "--replicas", type=int, nargs="+", default=[1, 3], help="Order service replicas")
+    parser.add_argument("-p", "--trade-probability", type=float, nargs="+", default=[0.2, 0.8],
+                        help="Share of the requests that are trades, split evenly between buys and sells")
+    parser.add_argument("--query-share", type=float, default=0.1, help="Share of the requests that are order queries")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Measured seconds per configuration")
+    parser.add_argument("-w", "--warmup", type=float, default=2, help="Seconds of load before the measurement")
+    parser.add_argument("--think-time", type=float, default=0, help="Mean pause in ms between a client's requests")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the request mix, the same for every run")
+    parser.add_argument("--env", type=parse_env, action="append", default=[],
+                        help="NAME=VALUE setting of the services, e.g. --env FRONTEND_SERVER_MODE=asyncio")
+    parser.add_argument("-o", "--output-dir", help="Directory of the results, by default benchmarks/results/<time>-<commit>")
+    parser.add_argument("--baseline", help="results.json of an earlier run to compare with")
+    parser.add_argument("--keep-latencies", action="store_true", help="Also keep every request of every configuration")
+    args = parser.parse_args()
+    # the whole sweep is checked before the first topology boots, it runs unattended
+    for trade_probability in args.trade_probability:
+        try:
+            mix(trade_probability, args.query_share)
+        except ValueError as error:
+            parser.error(str(error))
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_baseline(args.baseline)
+        except ValueError as error:
+            parser.error(str(error))
+
+    metadata = run_metadata(args)
+    output_dir = args.output_dir or os.path.join(
+        RESULTS_ROOT, time.strftime("%Y%m%d-%H%M%S") + "-" + ((metadata["commit"] or "unknown")[:10]
+                                                             + ("-dirty" if metadata["dirty"] else "")))
+    os.makedirs(os.path.join(output_dir, "points"), exist_ok=True)
+
+    columns = list(CONFIG_FIELDS) + ["throughput", "p50_ms", "p95_ms", "p99_ms", "failed"]
+    print(" ".join(f"{column:>17}" for column in columns))
+    results = []
+    for cache, replicas, clients, trade_probability in itertools.product(args.cache, args.replicas, args.clients,
+                                                                         args.trade_probability):
+        config = {"cache": cache, "replicas": replicas, "clients": clients, "trade_probability": trade_probability}
+        try:
+            result = run_point(config, args, output_dir)
+        except (OSError, RuntimeError, ValueError, subprocess.SubprocessError) as error:
+            # a failed configuration is reported and the sweep goes on
+            result = {"error": repr(error)}
+        result["config"] = config
+        results.append(result)
+        values = row(result)
+        print(" ".join(f"{'-' if values[column] is None else str(values[column]):>17}" for column in columns)
+              + (f"  {values['error']}" if values["error"] else ""), flush=True)
+
+    rows = [row(result) for result in results]
+    with open(os.path.join(output_dir, "results.json"), "w") as file:
+        json.dump({"meta": metadata, "results": results}, file, indent=2)
+    with open(os.path.join(output_dir, "results.csv"), "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    report = [f"# Benchmark {metadata['started']}", "",
+              f"Commit {metadata['commit']}{' (with uncommitted changes)' if metadata['dirty'] else ''}, "
+              f"Python {metadata['python']} on {metadata['platform']} with {metadata['cpus']} CPUs.",
+              f"{args.duration}s measured after {args.warmup}s of warm-up per configuration, closed-loop clients, "
+              f"{args.query_share} of the requests are order queries.", "",
+              "## Totals over all operations", "", format_table(rows, columns), ""]
+    report.append("## Per operation")
+    for result in results:
+        operations = result.get("operations")
+        if not operations:
+            continue
+        report += ["", ", ".join(f"{field}={result['config'][field]}" for field in CONFIG_FIELDS), "",
+                   format_table([{"operation": operation, "count": stats["count"],
+                                  "throughput": round(stats["throughput"], 1),
+                                  **{key: round(stats[key], 2) for key in PERCENTILES}}
+                                 for operation, stats in operations.items()],
+                                ["operation", "count", "throughput", *PERCENTILES])]
+    if baseline is not None:
+        changes = compare(results, baseline)
+        report += ["", f"## Compared with {baseline['meta'].get('commit')}", ""]
+        differences = metadata_differences(metadata, baseline["meta"])
+        if differences:
+            report += ["The runs were not measured the same way:", ""] + [f"* {line}" for line in differences] + [""]
+            print("\nthe runs were not measured the same way: " + "; ".join(differences))
+        if changes:
+            report.append(format_table(changes, list(changes[0])))
+            print()
+            for change in changes:
+                print(", ".join(f"{key}={value}" for key, value in change.items()))
+        else:
+            report.append("No configuration was measured in both runs.")
+    for path in plot(rows, output_dir):
+        report += ["", f"![{os.path.basename(path)}]({os.path.basename(path)})"]
+    with open(os.path.join(output_dir, "report.md"), "w") as file:
+        file.write("\n".join(report) + "\n")
+    print(f"\nresults written to {output_dir}")
@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.topology import Topology, wait_for_port, REPO_ROOT
+
+# Concurrency stress test of the catalog locking: many clients send single and batched buys and sells of random
+# stocks straight to the catalog while it compacts its change log every few trades. Every acknowledged trade is
+# counted, and at the end (and again after the catalog was killed and restarted) every stock must hold exactly its
+# initial quantity plus the acknowledged sells minus the acknowledged buys. Runs once per CATALOG_LOCK_STRIPES value.
+
+
+def trade_worker(url, deadline, names, batch_size, deltas, lock, counts):
+    session = requests.Session()
+    local = {name: 0 for name in names}
+    trades = 0
+    while time.monotonic() < deadline:
+        orders = [{"name": random.choice(names), "type": random.choice(("buy", "sell")), "quantity": random.randint(1, 3)}
+                  for _ in range(batch_size)]
+        if batch_size == 1:
+            results = [{"status": session.post(url + "/trade", json=orders[0]).status_code}]
+        else:
+            results = session.post(url + "/trade_batch", json={"trades": orders}).json()["data"]
+        for order, result in zip(orders, results):
+            if result["status"] == 200:
+                local[order["name"]] += order["quantity"] if order["type"] == "sell" else -order["quantity"]
+                trades += 1
+    session.close()
+    with lock:
+        for name, delta in local.items():
+            deltas[name] += delta
+        counts.append(trades)
+
+
+def quantities(url, names):
+    response = requests.get(url + "/lookup?names=" + ",".join(names))
+    return {item["name"]: item["quantity"] for item in response.json()["data"]}
+
+
+def check(label, expected, actual):
+    lost = {name: (expected[name], actual[name]) for name in expected if expected[name] != actual[name]}
+    if lost:
+        print(f"    {label}: MISMATCH (expected, actual) {lost}")
+    else:
+        print(f"    {label}: all {len(expected)} quantities match")
+    return not lost
+
+
+def run(stripes, clients, batch_size, duration, compact_every):
+    env = {"ENABLE_CACHE": "False", "CATALOG_LOCK_STRIPES": stripes, "CATALOG_COMPACT_EVERY": compact_every}
+    with Topology(order_instances=0, frontend=False, env=env) as topology:
+        url = topology.catalog_url
+        with open(os.path.join(REPO_ROOT, "product_app", "resources", "catalog.csv")) as catalog:
+            names = [line.split(",")[0] for line in catalog.read().splitlines()[1:] if line]
+        initial = quantities(url, names)
+
+        deltas = {name: 0 for name in names}
+        lock = threading.Lock()
+        counts = []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=trade_worker, args=(url, deadline, names, batch_size if i % 2 else 1,
+                                                               deltas, lock, counts))
+                   for i in range(clients)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        expected = {name: initial[name] + deltas[name] for name in names}
+        print(f"stripes={stripes}: {sum(counts) / elapsed:.1f} trades/sec from {clients} clients")
+        ok = check("after the run", expected, quantities(url, names))
+
+        # the catalog is killed without a clean shutdown and recovers from its snapshot and change logs
+        catalog_process = topology.processes[0][0]
+        catalog_process.kill()
+        catalog_process.wait()
+        topology.spawn("catalog_restarted", os.path.join(REPO_ROOT, "product_app", "product_app.py"))
+        wait_for_port(topology.catalog_port)
+        ok = check("after a restart", expected, quantities(url, names)) and ok
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--stripes", type=int, nargs="+", default=[1, 64], help="CATALOG_LOCK_STRIPES values")
+    parser.add_argument("-c", "--clients", type=int, default=32, help="Number of concurrent trading clients")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="Trades per batch of the batching clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run each configuration")
+    parser.add_argument("--compact-every", type=int, default=50, help="CATALOG_COMPACT_EVERY during the run")
+    args = parser.parse_args()
+
+    results = [run(stripes, args.clients, args.batch_size, args.duration, args.compact_every) for stripes in args.stripes]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,167 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+# root of the project, the services are started from a scratch copy of its resources
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the stocks of the catalog csv, the benchmarks trade and look up these
+STOCK_NAMES = ["GameStart", "FishCo", "BoarCo", "MenhirCo", "Google", "Apple", "Meta", "Amazon", "Netflix", "Microsoft"]
+
+
+def free_port():
+    # asks the OS for a currently unused local port
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    # waits until a service accepts connections on the given local port
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("localhost", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"service on port {port} did not come up within {timeout}s")
+
+
+def trade_worker(url, deadline, counts, index, latencies=None):
+    # posts trades of one share to url until the deadline and stores the number of successful ones in counts[index],
+    # and their latencies in latencies if given
+    session = requests.Session()
+    done = 0
+    i = 0
+    while time.monotonic() < deadline:
+        # alternating buys and sells keeps the quantities stable for the whole run
+        trade_type = "buy" if i % 2 == 0 else "sell"
+        name = STOCK_NAMES[(index + i // 2) % len(STOCK_NAMES)]
+        start = time.perf_counter()
+        response = session.post(url, json={"name": name, "type": trade_type, "quantity": 1})
+        if response.status_code == 200:
+            done += 1
+            if latencies is not None:
+                latencies.append(time.perf_counter() - start)
+        i += 1
+    counts[index] = done
+    session.close()
+
+
+def run_trades(url, clients, duration, latencies=None):
+    # trades from concurrent clients for duration seconds, returns the number of successful trades and the seconds
+    # the clients took
+    counts = [0] * clients
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=trade_worker, args=(url, deadline, counts, i, latencies))
+               for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts), time.monotonic() - start
+
+
+class Topology:
+    """Boots the catalog, order replicas and (optionally) the front-end on free local ports.
+
+    The services run with a scratch working directory holding a copy of the catalog csv and empty order logs,
+    so benchmarks never touch the tracked resource files and every run starts from the same state.
+    """
+
+    def __init__(self, order_instances=3, frontend=True, env=None, startup_timeout=15):
+        self.order_instances = order_instances
+        self.startup_timeout = startup_timeout
+        self.frontend = frontend
+        self.workdir = tempfile.mkdtemp(prefix="stock-bench-")
+        self.processes = []
+
+        self.catalog_port = free_port()
+        self.frontend_port = free_port()
+        self.order_ports = [free_port() for _ in range(order_instances)]
+
+        self.env = dict(os.environ)
+        self.env.update({
+            "CATALOG_HOSTNAME": "localhost",
+            "CATALOG_PORT": str(self.catalog_port),
+            "FRONTEND_HOSTNAME": "localhost",
+            "FRONTEND_PORT": str(self.frontend_port),
+            "TOTAL_ORDER_INSTANCES": str(order_instances),
+            "PYTHONUNBUFFERED": "1",
+        })
+        for i, port in enumerate(self.order_ports, start=1):
+            self.env[f"ORDER_{i}_HOSTNAME"] = "localhost"
+            self.env[f"ORDER_{i}_PORT"] = str(port)
+            self.env[f"ORDER_{i}_INSTANCE_ID"] = f"id{i}"
+        if env:
+            self.env.update({key: str(value) for key, value in env.items()})
+
+    @property
+    def frontend_url(self):
+        return f"http://localhost:{self.frontend_port}"
+
+    @property
+    def catalog_url(self):
+        return f"http://localhost:{self.catalog_port}"
+
+    def order_url(self, instance_num):
+        return f"http://localhost:{self.order_ports[instance_num - 1]}"
+
+    def spawn(self, name, *args):
+        log = open(os.path.join(self.workdir, f"{name}.out"), "w")
+        process = subprocess.Popen([sys.executable, *args], cwd=self.workdir, env=self.env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append((process, log))
+        return process
+
+    def start(self):
+        # a benchmark may have seeded the resources (an order log for example) before starting the services
+        os.makedirs(os.path.join(self.workdir, "product_app", "resources"), exist_ok=True)
+        os.makedirs(os.path.join(self.workdir, "purchase_app", "resources"), exist_ok=True)
+        shutil.copy(os.path.join(REPO_ROOT, "product_app", "resources", "catalog.csv"),
+                    os.path.join(self.workdir, "product_app", "resources", "catalog.csv"))
+
+        self.spawn("catalog", os.path.join(REPO_ROOT, "product_app", "product_app.py"))
+        for i, port in enumerate(self.order_ports, start=1):
+            self.spawn(f"order_id{i}", os.path.join(REPO_ROOT, "purchase_app", "purchase_app.py"),
+                       "-i", f"id{i}", "-n", "localhost", "-p", str(port))
+        wait_for_port(self.catalog_port, self.startup_timeout)
+        for port in self.order_ports:
+            wait_for_port(port, self.startup_timeout)
+
+        if self.frontend:
+            self.spawn("frontend", os.path.join(REPO_ROOT, "frontend_app", "front_end.py"))
+            wait_for_port(self.frontend_port, self.startup_timeout)
+        return self
+
+    def stop(self):
+        for process, log in self.processes:
+            process.terminate()
+        for process, log in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        self.processes = []
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        # __exit__ only runs once __enter__ returned, a failed start stops what it already spawned itself
+        try:
+            return self.start()
+        except BaseException:
+            self.stop()
+            raise
+
+    def __exit__(self, *exc):
+        self.stop()
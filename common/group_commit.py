@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+from common.metrics import persistence_flush
+
+# every write is fsynced before the request is acknowledged: the waiter fsyncs once it released its lock, and
+# requests waiting at the same time share that fsync
+POLICY_REQUEST = "request"
+# writes arriving within a short window (or up to a batch size) share one flush and fsync,
+# each request is acknowledged only once its batch is durable
+POLICY_BATCH = "batch"
+# writes are handed to the OS straight away and fsynced in the background on a fixed interval,
+# requests are acknowledged without waiting for the fsync
+POLICY_INTERVAL = "interval"
+
+POLICIES = (POLICY_REQUEST, POLICY_BATCH, POLICY_INTERVAL)
+
+
+def policy_from_env():
+    # reads the fsync policy and its tuning knobs from the environment, see env_setup.sh
+    policy = os.getenv("FSYNC_POLICY", POLICY_REQUEST)
+    if policy not in POLICIES:
+        raise ValueError(f"FSYNC_POLICY must be one of {POLICIES}, got {policy!r}")
+    return {
+        "policy": policy,
+        "window": float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2")) / 1000,
+        "max_batch": int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64")),
+        "interval": float(os.getenv("FSYNC_INTERVAL_MS", "100")) / 1000,
+    }
+
+
+class GroupCommitter:
+    """Serializes the writes of a persisted log and makes them durable according to an fsync policy.
+
+    write_fn(records) writes a list of records to the log and sync_fn() fsyncs it. Callers submit a record
+    while holding whatever lock orders their in-memory change, then wait for the returned ticket after
+    releasing that lock, so the log order always matches the memory order without holding the lock for the fsync.
+    Under the request policy sync_fn runs while other records are written, so it has to be safe to call concurrently
+    with write_fn.
+    The time of every write and fsync is recorded in persistence_flush_seconds under the name of the log.
+    """
+
+    def __init__(self, write_fn, sync_fn, policy=POLICY_REQUEST, window=0.002, max_batch=64, interval=0.1, name="log"):
+        self.write_fn = write_fn
+        self.sync_fn = sync_fn
+        self.write_time = persistence_flush.labels(name, "write")
+        self.sync_time = persistence_flush.labels(name, "sync")
+        self.policy = policy
+        self.window = window
+        self.max_batch = max_batch
+        self.interval = interval
+
+        # io_lock serializes the actual writes and fsyncs, sync_lock the fsyncs of the request policy waiters which
+        # leave the writes going, cond protects the pending batch and the counters
+        self.io_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.pending = []
+        self.submitted = 0
+        self.durable = 0
+        self.dirty = False
+
+        if policy == POLICY_BATCH:
+            threading.Thread(target=self.batch_flusher, daemon=True).start()
+        elif policy == POLICY_INTERVAL:
+            threading.Thread(target=self.interval_syncer, daemon=True).start()
+
+    def write(self, records):
+        start = time.perf_counter()
+        self.write_fn(records)
+        self.write_time.observe(time.perf_counter() - start)
+
+    def sync(self):
+        start = time.perf_counter()
+        self.sync_fn()
+        self.sync_time.observe(time.perf_counter() - start)
+
+    def submit(self, record):
+        # queues (or writes) a record and returns the ticket to wait for
+        if self.policy == POLICY_BATCH:
+            with self.cond:
+                self.pending.append(record)
+                self.submitted += 1
+                # wakes the flusher for the first record of a batch and again once the batch is full
+                if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                    self.cond.notify_all()
+                return self.submitted
+
+        # the write keeps the log in submission order, the fsync of the request policy is left to wait() so that it
+        # does not happen under the caller's lock
+        with self.io_lock:
+            self.write([record])
+            with self.cond:
+                self.submitted += 1
+                ticket = self.submitted
+                if self.policy == POLICY_INTERVAL:
+                    self.dirty = True
+                    self.durable = ticket
+        return ticket
+
+    def wait(self, ticket):
+        # blocks until the record behind the ticket is durable under the configured policy
+        if ticket is None:
+            return
+        if self.policy == POLICY_REQUEST:
+            with self.sync_lock:
+                # an fsync of another waiter made it durable meanwhile, otherwise one fsync covers every record
+                # written so far
+                with self.cond:
+                    if self.durable >= ticket:
+                        return
+                    written = self.submitted
+                self.sync()
+                with self.cond:
+                    self.durable = max(self.durable, written)
+                    self.cond.notify_all()
+            return
+        with self.cond:
+            while self.durable < ticket:
+                self.cond.wait()
+
+    def commit(self, record):
+        self.wait(self.submit(record))
+
+    def flush(self):
+        # forces every record submitted so far to disk, used before compacting and on shutdown
+        with self.cond:
+            ticket = self.submitted
+        if self.policy == POLICY_BATCH:
+            with self.cond:
+                self.cond.notify_all()
+            self.wait(ticket)
+        with self.io_lock:
+            self.sync()
+            self.dirty = False
+            # the log may be swapped after the flush, the records written before it must not be synced again
+            with self.cond:
+                self.durable = max(self.durable, ticket)
+                self.cond.notify_all()
+
+    def batch_flusher(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                # give other writers a short window to join the batch
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = self.pending
+                self.pending = []
+                last_ticket = self.submitted
+
+            with self.io_lock:
+                self.write(batch)
+                self.sync()
+
+            with self.cond:
+                self.durable = last_ticket
+                self.cond.notify_all()
+
+    def interval_syncer(self):
+        while True:
+            time.sleep(self.interval)
+            with self.io_lock:
+                if self.dirty:
+                    self.sync()
+                    self.dirty = False
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from common import tracing
+from common.metrics import upstream_duration, upstream_errors
+
+# set HTTP_POOLING=False to open a fresh connection for every call, the behaviour before pooling
+pooling_enabled = os.getenv("HTTP_POOLING", "True") == "True"
+# default number of keep-alive connections per upstream, HTTP_POOL_SIZE_<NAME> overrides it for one upstream
+default_pool_size = int(os.getenv("HTTP_POOL_SIZE", "32"))
+connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "1"))
+read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+
+
+class UpstreamPool:
+    """Thread-safe pool of keep-alive HTTP connections to one upstream service.
+
+    Calls block while all pool_size connections are busy instead of opening more, so a service never holds
+    more than pool_size sockets to an upstream. Every call gets the configured connect and read timeouts
+    unless the caller passes its own.
+    """
+
+    def __init__(self, name, host, port, pool_size):
+        self.name = name
+        self.base_url = f"http://{host}:{port}"
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", (connect_timeout, read_timeout))
+        # a traced request passes its trace on to the upstream in the headers of the call
+        call_span = tracing.span(f"{self.name} {method} {tracing.path_name(path)}")
+        if call_span is not tracing.NO_SPAN:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **call_span.headers()}
+        start = time.perf_counter()
+        try:
+            if not pooling_enabled:
+                headers = dict(kwargs.pop("headers", None) or {})
+                headers["Connection"] = "close"
+                return requests.request(method, self.base_url + path, headers=headers, **kwargs)
+            return self.session.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException:
+            upstream_errors.labels(self.name, method).inc()
+            call_span.tag("error", True)
+            raise
+        finally:
+            upstream_duration.labels(self.name, method).observe(time.perf_counter() - start)
+            call_span.end()
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+
+def is_connect_error(error):
+    # True when a request failed before it reached the upstream: the connection was refused or could not be opened in
+    # time. After any other failure (a reset, a disconnect, a read timeout) the upstream may have processed it
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # a refused connection arrives as a MaxRetryError whose reason is a NewConnectionError (a ConnectTimeoutError)
+        return isinstance(getattr(error.args[0], "reason", None), ConnectTimeoutError)
+    return False
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(name, host, port):
+    # returns the shared pool for an upstream, creating it on first use. name is a label such as "catalog" or "order"
+    # that picks up the HTTP_POOL_SIZE_<NAME> override
+    key = (host, int(port))
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool_size = int(os.getenv(f"HTTP_POOL_SIZE_{name.upper()}", default_pool_size))
+            pool = pools[key] = UpstreamPool(name, host, port, pool_size)
+        return pool
@@ -0,0 +1,178 @@
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+
+# the levels, a logger writes the messages at or above its level
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_LABELS = {level: name.upper() for name, level in LEVEL_NAMES.items()}
+
+
+def parse_level(value):
+    try:
+        return LEVEL_NAMES[value.strip().lower()]
+    except KeyError:
+        raise ValueError(f"unknown log level {value!r}, expected one of {', '.join(LEVEL_NAMES)}") from None
+
+
+def parse_module_levels(value):
+    # "purchase_app=debug,front_end=warning" -> {"purchase_app": DEBUG, "front_end": WARNING}
+    levels = {}
+    for item in value.split(","):
+        if item.strip():
+            name, _, level = item.partition("=")
+            levels[name.strip()] = parse_level(level)
+    return levels
+
+
+# level of every module without its own level in LOG_LEVELS
+default_level = parse_level(os.getenv("LOG_LEVEL", "info"))
+# per module levels, e.g. LOG_LEVELS=purchase_app=debug,http_pool=warning
+module_levels = parse_module_levels(os.getenv("LOG_LEVELS", ""))
+# file the messages are appended to, empty writes them to stdout like the prints did
+log_file = os.getenv("LOG_FILE", "")
+# messages waiting for the writer at most, a caller never blocks on a full queue, its message is dropped and counted
+log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+class Logger:
+    """The logger of one module. A message below its level costs one comparison, the arguments are not even formatted.
+
+    Messages are formatted by the caller %-style, so the values logged are those of the moment of the call, and
+    written by the background writer. A caller building an expensive message checks debug_enabled first.
+    """
+
+    __slots__ = ("name", "level")
+
+    def __init__(self, name, level):
+        self.name = name
+        self.level = level
+
+    @property
+    def debug_enabled(self):
+        return self.level <= DEBUG
+
+    def log(self, level, message, *args):
+        if level >= self.level:
+            writer.write(time.time(), level, self.name, message % args if args else message)
+
+    def debug(self, message, *args):
+        if self.level <= DEBUG:
+            writer.write(time.time(), DEBUG, self.name, message % args if args else message)
+
+    def info(self, message, *args):
+        if self.level <= INFO:
+            writer.write(time.time(), INFO, self.name, message % args if args else message)
+
+    def warning(self, message, *args):
+        if self.level <= WARNING:
+            writer.write(time.time(), WARNING, self.name, message % args if args else message)
+
+    def error(self, message, *args):
+        if self.level <= ERROR:
+            writer.write(time.time(), ERROR, self.name, message % args if args else message)
+
+
+loggers = {}
+
+
+def get_logger(name):
+    # the logger of a module, named explicitly since the services run as scripts (their __name__ is __main__)
+    logger = loggers.get(name)
+    if logger is None:
+        logger = loggers.setdefault(name, Logger(name, module_levels.get(name, default_level)))
+    return logger
+
+
+def set_level(name, level):
+    # changes the level of a module's logger at runtime
+    get_logger(name).level = level
+
+
+def format_record(created, level, name, message):
+    seconds = int(created)
+    return (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))}.{int((created - seconds) * 1000):03d} "
+            f"{LEVEL_LABELS[level]} {name}: {message}\n")
+
+
+class LogWriter:
+    """Writes the logged messages from a background thread, so the callers never wait on the output.
+
+    The thread starts with the first message and writes whatever was queued meanwhile in one write.
+    """
+
+    def __init__(self, size):
+        self.queue = queue.SimpleQueue()
+        self.size = size
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def write(self, created, level, name, message):
+        if self.thread is None:
+            self.start()
+        # the bound is checked without a lock, the queue may briefly hold a few messages more
+        if self.queue.qsize() < self.size:
+            self.queue.put((created, level, name, message))
+        else:
+            # counted without a lock, an occasional lost increment only makes the reported number low
+            self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        output = open(log_file, "a", encoding="utf-8") if log_file else sys.stdout
+        while True:
+            records = [self.queue.get()]
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [format_record(*record) for record in records if record is not None]
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(format_record(time.time(), WARNING, "log", f"{dropped} messages dropped, the queue was full"))
+            output.write("".join(lines))
+            output.flush()
+            if None in records:
+                # the process is exiting, everything logged before was written
+                return
+
+    def flush(self, timeout=2):
+        # waits for the queued messages to be written, at process exit
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+writer = LogWriter(log_queue_size)
+atexit.register(writer.flush)
+
+
+class LoggingHandlerMixIn:
+    """Sends the messages of a BaseHTTPRequestHandler through the logger instead of writing them to stderr.
+
+    The line logged for every request is a debug message, the errors of the handler are warnings. The handler class
+    sets logger to the logger of its module.
+    """
+
+    logger = None
+
+    def log_request(self, code="-", size="-"):
+        if self.logger.debug_enabled:
+            self.logger.debug('%s - "%s" %s %s', self.address_string(), self.requestline, code, size)
+
+    def log_message(self, format, *args):
+        self.logger.warning("%s - %s", self.address_string(), format % args)
@@ -0,0 +1,239 @@
+import bisect
+import threading
+import time
+
+# upper bounds (in seconds) of the latency histogram buckets, the same for every service so their histograms
+# can be compared and aggregated
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A family of metrics of one type, with one child per combination of label values.
+
+    Children are created on first use and can be kept by the caller, so a hot path only pays for updating its child.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, label_names, values):
+        return [f"{name}{format_labels(label_names, values)} {self.value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, label_names, values):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{name}_bucket{format_labels(label_names, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(label_names, values)} {total}")
+        lines.append(f"{name}_count{format_labels(label_names, values)} {cumulative}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+
+# every metric of the process, in creation order
+registry = []
+
+
+def render():
+    # the whole registry in the Prometheus text exposition format
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter("http_requests_total", "HTTP requests served, by route, method and status code",
+                        ("route", "method", "status"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served, by route", ("route",))
+http_duration = Histogram("http_request_duration_seconds", "Time to serve an HTTP request, by route and method",
+                          ("route", "method"))
+upstream_duration = Histogram("upstream_request_duration_seconds",
+                              "Time of the calls to other services, by upstream and method", ("upstream", "method"))
+upstream_errors = Counter("upstream_request_errors_total", "Calls to other services that failed without a response",
+                          ("upstream", "method"))
+lock_wait = Histogram("lock_wait_seconds", "Time spent waiting to acquire a lock", ("lock",))
+persistence_flush = Histogram("persistence_flush_seconds",
+                              "Time of the writes and fsyncs of the persisted logs, by log and operation", ("log", "op"))
+
+
+def route_label(path, routes):
+    # the label of a request path: the first of the service's routes (listed most specific first) that matches it, so
+    # that stock names and transaction numbers never become label values. Unknown paths share one label
+    path = path.split("?", 1)[0]
+    for route in routes:
+        if path == route or (route.endswith("*") and path.startswith(route[:-1])):
+            return route
+    return "other"
+
+
+class TimedLock:
+    """Wraps a lock and records how long every acquisition waited for it in lock_wait_seconds."""
+
+    def __init__(self, name, lock=None):
+        self.lock = lock if lock is not None else threading.Lock()
+        self.wait = lock_wait.labels(name)
+
+    def acquire(self, blocking=True, timeout=-1):
+        # an uncontended acquisition is not timed, it costs no more than the plain lock
+        if self.lock.acquire(False):
+            self.wait.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.wait.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MetricsHandlerMixIn:
+    """Records the count, in-flight number and latency of every request of a BaseHTTPRequestHandler.
+
+    The handler class lists its routes in metric_routes, a trailing * matching any suffix. The timing starts once
+    the request line was parsed, so the idle time of a keep-alive connection is not counted.
+    """
+
+    metric_routes = ()
+
+    def handle_one_request(self):
+        self.metric_started = None
+        self.metric_status = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.metric_started is not None:
+                self.metric_in_flight.dec()
+                http_duration.labels(self.metric_route, self.command).observe(time.perf_counter() - self.metric_started)
+                http_requests.labels(self.metric_route, self.command, str(self.metric_status)).inc()
+
+    def parse_request(self):
+        parsed = super().parse_request()
+        if parsed:
+            self.metric_started = time.perf_counter()
+            self.metric_route = route_label(self.path, self.metric_routes)
+            self.metric_in_flight = http_in_flight.labels(self.metric_route)
+            self.metric_in_flight.inc()
+        return parsed
+
+    def send_response(self, code, message=None):
+        self.metric_status = code
+        super().send_response(code, message)
+
+    def send_metrics(self):
+        # answers GET /metrics in the Prometheus text format
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.send_header("Content-length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,179 @@
+import json
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+
+# threaded (a thread per connection, the default) or pool (a fixed set of workers behind a bounded queue)
+server_mode = os.getenv("SERVER_MODE", "threaded")
+pool_workers = int(os.getenv("SERVER_WORKERS", "16"))
+pool_queue_size = int(os.getenv("SERVER_QUEUE_SIZE", "64"))
+# seconds a parked keep-alive connection may stay idle before it is closed
+pool_idle_timeout = float(os.getenv("SERVER_IDLE_TIMEOUT", "30"))
+# seconds a worker waits on a slow client in the middle of a request before dropping the connection
+pool_request_timeout = float(os.getenv("SERVER_REQUEST_TIMEOUT", "10"))
+# seconds the clients are told to wait before retrying an overloaded service
+pool_retry_after = int(os.getenv("SERVER_RETRY_AFTER", "1"))
+
+
+class PooledRequestHandlerMixIn:
+    """Lets a BaseHTTPRequestHandler serve one request per dispatch when its server is a WorkerPoolMixIn.
+
+    Between requests a keep-alive connection is parked by the server instead of holding a worker while idle, and a
+    client stalling in the middle of a request only holds its worker for SERVER_REQUEST_TIMEOUT seconds.
+    """
+
+    def setup(self):
+        if getattr(self.server, "dispatches_single_requests", False):
+            self.timeout = pool_request_timeout
+        super().setup()
+
+    def handle(self):
+        if not getattr(self.server, "dispatches_single_requests", False):
+            return super().handle()
+        self.close_connection = True
+        self.handle_one_request()
+
+
+class WorkerPoolMixIn:
+    """Serves connections with a fixed number of worker threads fed from a bounded queue.
+
+    A connection with a pending request is queued for the workers, a new connection and an idle keep-alive one are
+    parked in a selector until their next request arrives, so clients that connect and send nothing never hold a
+    worker. When the queue is full the connection gets an immediate 503 with a Retry-After header instead of another
+    thread, so a burst degrades gracefully.
+    """
+
+    dispatches_single_requests = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, *args, workers=pool_workers, queue_size=pool_queue_size, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.stats_lock = threading.Lock()
+        self.busy_workers = 0
+        self.max_queue_depth = 0
+        self.dispatched = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        # new and idle keep-alive connections wait in the selector, they are handed over through parked and the wakeup
+        # socket
+        self.selector = selectors.DefaultSelector()
+        self.parked = queue.SimpleQueue()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+        threading.Thread(target=self.watch_parked_connections, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        # called by serve_forever for every accepted connection, it waits in the selector for its first request
+        self.park(request, client_address)
+
+    def park(self, request, client_address):
+        self.parked.put((request, client_address))
+        self.wakeup_writer.send(b"\0")
+
+    def dispatch(self, request, client_address):
+        try:
+            self.work_queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            self.reject(request)
+            return
+        depth = self.work_queue.qsize()
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def reject(self, request):
+        # tells the client to come back later and closes the connection without occupying a worker
+        with self.stats_lock:
+            self.rejected += 1
+        body = json.dumps({"error" : {"code" : 503, "message" : "service overloaded"}}).encode("utf-8")
+        response = (f"HTTP/1.1 503 Service Unavailable\r\nRetry-After: {pool_retry_after}\r\n"
+                    f"Content-type: application/json\r\nContent-length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            request.setblocking(False)
+            try:
+                # drain what already arrived so that closing does not reset the connection before the 503 is read
+                request.recv(65536)
+            except OSError:
+                pass
+            request.setblocking(True)
+            request.sendall(response.encode("latin-1") + body)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def worker(self):
+        while True:
+            request, client_address, queued_at = self.work_queue.get()
+            waited = time.monotonic() - queued_at
+            with self.stats_lock:
+                self.busy_workers += 1
+                self.dispatched += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+            keep_alive = False
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(request, client_address)
+
+            with self.stats_lock:
+                self.busy_workers -= 1
+            if keep_alive:
+                self.park(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+    def watch_parked_connections(self):
+        idle_since = {}
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                if key.fileobj is self.wakeup_reader:
+                    try:
+                        self.wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                # the next request of a parked connection arrived (or the client closed it), it goes to the workers
+                self.selector.unregister(key.fileobj)
+                idle_since.pop(key.fileobj, None)
+                self.dispatch(key.fileobj, key.data)
+
+            while not self.parked.empty():
+                request, client_address = self.parked.get()
+                self.selector.register(request, selectors.EVENT_READ, client_address)
+                idle_since[request] = time.monotonic()
+
+            now = time.monotonic()
+            for request, since in list(idle_since.items()):
+                if now - since > pool_idle_timeout:
+                    self.selector.unregister(request)
+                    del idle_since[request]
+                    self.shutdown_request(request)
+
+    def pool_stats(self):
+        with self.stats_lock:
+            return {
+                "workers" : self.workers,
+                "busy_workers" : self.busy_workers,
+                "queue_depth" : self.work_queue.qsize(),
+                "queue_capacity" : self.work_queue.maxsize,
+                "max_queue_depth" : self.max_queue_depth,
+                "dispatched" : self.dispatched,
+                "rejected" : self.rejected,
+                "mean_wait_ms" : self.total_wait / self.dispatched * 1000 if self.dispatched else 0.0,
+                "max_wait_ms" : self.max_wait * 1000,
+            }
@@ -0,0 +1,196 @@
+import contextvars
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from common.metrics import route_label
+
+# directory the spans are written to, one file of json lines per process. Tracing is off when it is empty
+trace_dir = os.getenv("TRACE_DIR", "")
+# fraction of the requests arriving without a trace id that start a new trace
+trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+
+# headers that carry the trace from one hop to the next
+TRACE_HEADER = "X-Trace-Id"
+PARENT_HEADER = "X-Parent-Span-Id"
+
+# the name of this process in the spans, set by every service at startup
+service_name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+
+# the span the running request (thread or coroutine) is in, None when it is not traced
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def new_id():
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    """One timed hop or step of a traced request. Spans are written when they end."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "started", "tags", "token")
+
+    def __init__(self, trace_id, parent_id, name):
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.tags = None
+        self.token = None
+
+    def tag(self, key, value):
+        if self.tags is None:
+            self.tags = {}
+        self.tags[key] = value
+
+    def headers(self):
+        # the headers that make the callee's spans children of this one
+        return {TRACE_HEADER: self.trace_id, PARENT_HEADER: self.span_id}
+
+    def end(self):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": service_name,
+            "name": self.name,
+            "start": self.start,
+            "duration": time.perf_counter() - self.started,
+        }
+        if self.tags:
+            record["tags"] = self.tags
+        writer.write(record)
+
+    # a span used as a context manager is the current span of its block
+    def __enter__(self):
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        current_span.reset(self.token)
+        self.end()
+
+
+class NoSpan:
+    """Stands in for a span when the request is not traced, so that callers don't need to check."""
+
+    __slots__ = ()
+
+    def tag(self, key, value):
+        pass
+
+    def headers(self):
+        return {}
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name):
+    # a child span of the current one, or NO_SPAN when the request is not traced
+    parent = current_span.get()
+    if parent is None:
+        return NO_SPAN
+    return Span(parent.trace_id, parent.span_id, name)
+
+
+def server_span(name, headers, root=False):
+    # the span of a request received by a service: it continues the caller's trace from the request headers,
+    # or starts a sampled new trace when the request has none and root is set
+    if not trace_dir:
+        return NO_SPAN
+    # the asyncio front-end passes its headers with lower case names
+    trace_id = headers.get(TRACE_HEADER) or headers.get(TRACE_HEADER.lower())
+    if trace_id:
+        return Span(trace_id, headers.get(PARENT_HEADER) or headers.get(PARENT_HEADER.lower()), name)
+    if root and random.random() < trace_sample_rate:
+        return Span(new_id(), None, name)
+    return NO_SPAN
+
+
+def path_name(path):
+    # the first segment of a path, so that stock names and transaction numbers don't end up in span names
+    return "/" + path.split("?", 1)[0].lstrip("/").split("/", 1)[0]
+
+
+class SpanWriter:
+    """Appends the ended spans to the trace file of the process from a background thread."""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+        self.queue.put(record)
+
+    def run(self):
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{service_name}-{os.getpid()}.jsonl")
+        with open(path, "a", encoding="utf-8") as file:
+            while True:
+                records = [self.queue.get()]
+                # whatever ended meanwhile goes out in the same write
+                while True:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                file.write("".join(json.dumps(record) + "\n" for record in records))
+                file.flush()
+
+
+writer = SpanWriter()
+
+
+class TracingHandlerMixIn:
+    """Wraps every request of a BaseHTTPRequestHandler in a server span named after its route.
+
+    The route is picked from the handler's metric_routes, like the request metrics. Only the routes listed in
+    trace_roots start new traces, the others are traced when their caller is.
+    """
+
+    trace_roots = ()
+
+    def handle_one_request(self):
+        self.trace_span = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.trace_span is not None:
+                self.trace_span.tag("status", self.trace_status)
+                self.trace_span.__exit__(None, None, None)
+
+    def parse_request(self):
+        parsed = super().parse_request()
+        if parsed and trace_dir:
+            route = route_label(self.path, self.metric_routes)
+            request_span = server_span(f"{self.command} {route}", self.headers, route in self.trace_roots)
+            if request_span is not NO_SPAN:
+                self.trace_status = None
+                self.trace_span = request_span.__enter__()
+        return parsed
+
+    def send_response(self, code, message=None):
+        self.trace_status = code
+        super().send_response(code, message)
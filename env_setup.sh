@@ -8,6 +8,86 @@ export FRONTEND_PORT=8516
 
 unset ENABLE_CACHE
 
+# Front-end server: threaded (a thread per client session) or asyncio (a single event loop)
+export FRONTEND_SERVER_MODE=threaded
+
+# Front-end cache size and the TTL (in seconds, 0 disables it) that guards against lost invalidations
+export CACHE_MAX_ENTRIES=1024
+export CACHE_TTL_SECONDS=30
+
+# Keep-alive connection pools between the services: connections per upstream (HTTP_POOL_SIZE_<NAME> overrides
+# it for the catalog, order or frontend upstream) and the timeouts in seconds of every inter-service call
+export HTTP_POOLING=True
+export HTTP_POOL_SIZE=32
+export HTTP_CONNECT_TIMEOUT=1
+export HTTP_READ_TIMEOUT=10
+
+# Catalog and order servers: threaded (a thread per connection) or pool (SERVER_WORKERS threads behind a queue of
+# SERVER_QUEUE_SIZE connections, a full queue answers 503 with Retry-After). In pool mode idle connections are closed
+# after SERVER_IDLE_TIMEOUT seconds and a client stalling mid-request after SERVER_REQUEST_TIMEOUT seconds
+export SERVER_MODE=threaded
+export SERVER_WORKERS=16
+export SERVER_QUEUE_SIZE=64
+export SERVER_IDLE_TIMEOUT=30
+export SERVER_REQUEST_TIMEOUT=10
+
+# Durability of the catalog change log and the order logs: request (fsync per write), batch (group commit) or interval
+export FSYNC_POLICY=request
+# batch policy: writes arriving within this window, up to this many, share one fsync
+export GROUP_COMMIT_WINDOW_MS=2
+export GROUP_COMMIT_MAX_BATCH=64
+# interval policy: how often the background fsync runs
+export FSYNC_INTERVAL_MS=100
+
+# Number of locks the catalog spreads its stocks over, trades on stocks of different stripes run in parallel
+export CATALOG_LOCK_STRIPES=64
+
+# Orders per segment file of the append-only order logs
+export ORDER_LOG_SEGMENT_RECORDS=100000
+# Newest orders kept in memory (0 keeps all), older ones are read from the indexed segments through a cache of
+# ORDER_READ_CACHE_BLOCKS blocks of ORDER_INDEX_STRIDE orders
+export HOT_WINDOW_ORDERS=100000
+export ORDER_INDEX_STRIDE=256
+export ORDER_READ_CACHE_BLOCKS=64
+
+# When the order leader replies to a trade: async (without waiting for the followers), quorum (a majority of the
+# instances has the order) or all (every follower acknowledged), and how long a follower gets to acknowledge
+export REPLICATION_ACK=all
+export REPLICATION_TIMEOUT_MS=1000
+# Most orders the leader sends to a follower in one request (1 replicates every order on its own)
+export REPLICATION_BATCH_MAX=64
+# Most orders a recovering follower fetches from the leader per /syncOrderData chunk
+export SYNC_CHUNK_SIZE=1000
+# The order leader snapshots its log after every SNAPSHOT_EVERY orders (0 only on demand). A follower at least
+# SNAPSHOT_BOOTSTRAP_GAP orders behind downloads the snapshot, waiting up to SNAPSHOT_TIMEOUT seconds, then fetches the tail
+export SNAPSHOT_EVERY=100000
+export SNAPSHOT_BOOTSTRAP_GAP=10000
+export SNAPSHOT_TIMEOUT=300
+# The front-end probes the order instances every ORDER_PROBE_INTERVAL_MS, a probe fails after ORDER_PROBE_TIMEOUT_MS and the
+# leader is replaced after ORDER_PROBE_FAILURES failed probes in a row. A request waits at most FAILOVER_TIMEOUT_MS for a leader
+export ORDER_PROBE_INTERVAL_MS=250
+export ORDER_PROBE_TIMEOUT_MS=200
+export ORDER_PROBE_FAILURES=2
+export FAILOVER_TIMEOUT_MS=3000
+# Where the front-end sends order queries: leader, or replicas (round robin over the healthy instances, a follower that
+# has not received the order yet has the query forwarded to the leader)
+export ORDER_READ_ROUTING=leader
+# Most stocks (GET /stocks?names=a,b) or orders (POST /orders/batch) the front-end accepts in one batch request
+export BATCH_MAX_ITEMS=100
+
+# Request tracing: every service appends its spans to a file in TRACE_DIR (empty disables tracing), and
+# TRACE_SAMPLE_RATE of the client requests start a trace. benchmarks/analyze_traces.py reports their critical paths
+export TRACE_DIR=
+export TRACE_SAMPLE_RATE=1
+
+# Logging: the level of every module (debug, info, warning or error), per module overrides such as
+# LOG_LEVELS=purchase_app=debug,front_end=warning, the file the messages go to (empty writes them to stdout) and the
+# number of messages queued for the background writer before new ones are dropped
+export LOG_LEVEL=info
+export LOG_LEVELS=
+export LOG_FILE=
+export LOG_QUEUE_SIZE=10000
+
 # Create 3 (or more) order service env variables
 export TOTAL_ORDER_INSTANCES=3
 
@@ -0,0 +1,398 @@
+import asyncio
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs, quote, urlsplit
+
+import front_end
+from front_end import cache, hostName, PORT, log, public_stock
+from common import metrics, tracing
+
+# Event-loop variant of the front-end gateway, selected with FRONTEND_SERVER_MODE=asyncio.
+# It serves the same routes as FrontEnd, but every client session is a coroutine instead of an OS thread
+# and the calls to the catalog and order services never block the loop.
+
+connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "1"))
+read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+default_pool_size = int(os.getenv("HTTP_POOL_SIZE", "32"))
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 409: "Conflict", 502: "Bad Gateway",
+                  503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, maybe_executed=False):
+        super().__init__(message)
+        # set when the request was sent before the failure, so the upstream may have processed it
+        self.maybe_executed = maybe_executed
+
+
+class StaleConnection(Exception):
+    """A reused connection that failed while the request was being written, the upstream never got the whole request.
+
+    A connection closed after the request was written proves nothing: an upstream that crashed after processing the
+    request looks the same, so that is not a StaleConnection.
+    """
+
+
+class AsyncUpstreamPool:
+    """Keep-alive HTTP/1.1 connections to one upstream, at most pool_size of them in use at a time."""
+
+    def __init__(self, name, host, port, pool_size):
+        self.name = name
+        self.host = host
+        self.port = int(port)
+        self.idle = []
+        self.slots = asyncio.Semaphore(pool_size)
+
+    async def request(self, method, path, body=None):
+        # sends a request and returns the status code and the decoded json body of the response, its latency is
+        # recorded in the upstream metrics like the calls of the threaded pools
+        call_span = tracing.span(f"{self.name} {method} {tracing.path_name(path)}")
+        start = time.perf_counter()
+        try:
+            return await self.send(method, path, body, call_span.headers())
+        except UpstreamError:
+            metrics.upstream_errors.labels(self.name, method).inc()
+            call_span.tag("error", True)
+            raise
+        finally:
+            metrics.upstream_duration.labels(self.name, method).observe(time.perf_counter() - start)
+            call_span.end()
+
+    async def send(self, method, path, body, extra_headers):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        async with self.slots:
+            # a reused idle connection may have been closed by the upstream in the meantime (a pooled server closes
+            # them after SERVER_IDLE_TIMEOUT). The closes the loop already saw are skipped, and a request that failed
+            # while it was being written is retried once on a fresh connection whatever its method. After a failure
+            # once the request was sent only a GET is retried, anything else may have been processed
+            attempts = 2 if self.idle else 1
+            for attempt in range(attempts):
+                reused = False
+                # the retry always goes out on a fresh connection, the other idle ones may be closed as well
+                while self.idle and attempt == 0:
+                    reader, writer = self.idle.pop()
+                    # the closes the loop already saw are dropped without trying them
+                    if not reader.at_eof():
+                        reused = True
+                        break
+                    writer.close()
+                if not reused:
+                    try:
+                        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                                connect_timeout)
+                    except (OSError, asyncio.TimeoutError) as error:
+                        raise UpstreamError(f"connecting to {self.host}:{self.port} failed: {error!r}") from error
+                try:
+                    status, response_body, keep_alive = await asyncio.wait_for(
+                        self.exchange(reader, writer, method, path, payload, extra_headers), read_timeout)
+                except (StaleConnection, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                        ValueError) as error:
+                    writer.close()
+                    if reused and attempt + 1 < attempts and (isinstance(error, StaleConnection) or method == "GET"):
+                        continue
+                    raise UpstreamError(f"{method} {self.host}:{self.port}{path} failed: {error!r}",
+                                        maybe_executed=not isinstance(error, StaleConnection)) from error
+                if keep_alive:
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, json.loads(response_body) if response_body else None
+
+    async def exchange(self, reader, writer, method, path, payload, extra_headers):
+        request_head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                        + "".join(f"{name}: {value}\r\n" for name, value in extra_headers.items()) + "\r\n")
+        try:
+            writer.write(request_head.encode("latin-1") + payload)
+            await writer.drain()
+        except (ConnectionResetError, BrokenPipeError) as error:
+            raise StaleConnection(repr(error)) from error
+        # from here on the upstream may have processed the request, whatever happens to the connection
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before the response")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers = await read_headers(reader)
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "content-length" in headers:
+            response_body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            response_body = await reader.read()
+            keep_alive = False
+        return int(status), response_body, keep_alive
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+pools = {}
+
+
+def get_pool(name, host, port):
+    # name labels the upstream in the metrics
+    key = (host, int(port))
+    if key not in pools:
+        pools[key] = AsyncUpstreamPool(name, host, port, default_pool_size)
+    return pools[key]
+
+
+class AsyncSingleFlight:
+    """Coroutine counterpart of front_end.SingleFlight: concurrent misses for a key await one upstream call."""
+
+    def __init__(self):
+        self.calls = {}
+        self.upstream_calls = 0
+        self.saved_calls = 0
+
+    async def do(self, key, coroutine_fn):
+        future = self.calls.get(key)
+        if future is not None:
+            self.saved_calls += 1
+            # shield keeps a cancelled waiter from cancelling the shared call
+            return await asyncio.shield(future)
+        self.upstream_calls += 1
+        future = self.calls[key] = asyncio.ensure_future(coroutine_fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.calls.pop(key, None)
+
+    def stats(self):
+        return {"upstream_lookups": self.upstream_calls, "coalesced_lookups": self.saved_calls}
+
+
+lookup_flights = AsyncSingleFlight()
+
+async def call_leader(method, path, body=None):
+    # sends a request to the order leader and fails over to the newly elected leader if it does not answer. The leader
+    # state and the elections are the ones of front_end.leader_monitor, whose probes run on their own thread
+    monitor = front_end.leader_monitor
+    deadline = time.monotonic() + front_end.failover_timeout
+    while True:
+        leader_id, host, port = monitor.leader()
+        if leader_id is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(front_end.probe_interval, remaining))
+            continue
+        try:
+            return await get_pool("order", host, port).request(method, path, body)
+        except UpstreamError as error:
+            # If the leader service does not reply back, it may have crashed, leader re-election is triggered once a
+            # probe confirms it
+            log.warning("Leader is unresponsive: %s", error)
+            leader_gone = await asyncio.get_running_loop().run_in_executor(None, monitor.leader_failed, leader_id)
+            # a trade that failed after it was sent may have been executed, it is not retried on the new leader
+            if method != "GET" and error.maybe_executed:
+                if isinstance(error.__cause__, asyncio.TimeoutError):
+                    return 504, {"error": {"code": 504, "message": "the order service did not answer in time"}}
+                return 502, {"error": {"code": 502, "message": "the order service failed to answer"}}
+            if not leader_gone:
+                return 502, {"error": {"code": 502, "message": "the order service failed to answer"}}
+        if time.monotonic() >= deadline:
+            break
+    return 503, {"error": {"code": 503, "message": "no order service is available"}}
+
+
+async def call_replica(path):
+    # coroutine counterpart of front_end.call_replica, sharing its round robin and its read counters
+    instance_num = front_end.leader_monitor.next_replica()
+    if instance_num is not None:
+        instance = front_end.order_service_instances[instance_num]
+        try:
+            status, body = await get_pool("order", instance["host"], instance["port"]).request("GET", path)
+        except UpstreamError:
+            log.warning("Order replica %s is unresponsive", instance)
+            front_end.leader_monitor.replica_failed(instance_num)
+        else:
+            if status != 409:
+                front_end.read_stats.record(instance["instance_id"])
+                return status, body
+            front_end.read_stats.record_forwarded()
+    status, body = await call_leader("GET", path)
+    if status != 503:
+        front_end.read_stats.record(front_end.leader_monitor.leader()[0])
+    return status, body
+
+
+async def query_order(order_no):
+    if front_end.read_routing == "replicas":
+        return await call_replica("/query/" + order_no)
+    status, body = await call_leader("GET", "/query/" + order_no)
+    if status != 503:
+        front_end.read_stats.record(front_end.leader_monitor.leader()[0])
+    return status, body
+
+
+async def fetch_stock_details(stock_name):
+    status, body = await get_pool("catalog", front_end.catalogHostName, front_end.catalogPort).request(
+        "GET", "/lookup/" + stock_name)
+    if status == 200:
+        if cache is not None:
+            cache.put(body["data"])
+        body = {"data": public_stock(body["data"])}
+    return status, body
+
+
+async def lookup_stock_details(stock_name):
+    entry = cache.get(stock_name) if cache is not None else None
+    if entry is not None:
+        return 200, {"data": {"name": stock_name, "price": entry[0], "quantity": entry[1]}}
+    flight_key = (stock_name, cache.invalidated_version(stock_name) if cache is not None else None)
+    return await lookup_flights.do(flight_key, lambda: fetch_stock_details(stock_name))
+
+
+async def lookup_stock_batch(names):
+    # coroutine counterpart of FrontEnd.lookup_stock_batch, the cache misses cost one catalog request
+    if len(names) > front_end.batch_max_items:
+        return 400, {"error": {"code": 400, "message": f"at most {front_end.batch_max_items} stocks per batch"}}
+    results = {}
+    for name in names:
+        entry = cache.get(name) if cache is not None else None
+        if entry is not None:
+            results[name] = {"name": name, "price": entry[0], "quantity": entry[1]}
+    missing = [name for name in names if name not in results]
+    if missing:
+        status, body = await get_pool("catalog", front_end.catalogHostName, front_end.catalogPort).request(
+            "GET", "/lookup?names=" + quote(",".join(missing), safe=","))
+        if status != 200:
+            return status, body
+        for item in body["data"]:
+            if "error" not in item and cache is not None:
+                cache.put(item)
+            results[item["name"]] = public_stock(item)
+    return 200, {"data": [results[name] for name in names]}
+
+
+async def route(method, path, body):
+    # dispatches a request to the same routes as FrontEnd and returns the status code and the json body
+    if method == "GET":
+        if path.startswith("/stocks?"):
+            names = [name for name in parse_qs(urlsplit(path).query).get("names", [""])[0].split(",") if name]
+            return await lookup_stock_batch(names)
+        if re.search("/stocks/.*", path):
+            return await lookup_stock_details(path.split("/stocks/")[1])
+        if path == "/metrics":
+            return 200, None
+        if path == "/cache_stats":
+            stats = cache.stats() if cache is not None else {"enabled": False}
+            stats.update(lookup_flights.stats())
+            return 200, {"data": stats}
+        if re.search("/test", path):
+            return 200, "OK"
+        if re.search("/orders/.*", path):
+            return await query_order(path.split("/orders/")[1])
+        if path == "/read_stats":
+            return 200, {"data": front_end.read_stats.stats()}
+        if path == "/order_health":
+            return 200, {"data": front_end.leader_monitor.stats()}
+
+    if method == "POST":
+        request = json.loads(body.decode("utf-8")) if body else {}
+        if path == "/orders/batch":
+            orders = request.get("orders") if isinstance(request, dict) else None
+            if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+                return 400, {"error": {"code": 400, "message": "orders must be a list of objects"}}
+            if len(orders) > front_end.batch_max_items:
+                return 400, {"error": {"code": 400, "message": f"at most {front_end.batch_max_items} orders per batch"}}
+            trades = [{"name": order.get("name"), "type": order.get("type"), "quantity": order.get("quantity")}
+                      for order in orders]
+            return await call_leader("POST", "/trade_batch", {"trades": trades})
+        if re.search("/orders", path):
+            trade_details = {"name": request["name"], "type": request["type"], "quantity": request["quantity"]}
+            return await call_leader("POST", "/trade", trade_details)
+        if path == "/invalidate_cache":
+            if cache is not None:
+                cache.invalidate(request["name"], request.get("version"))
+            return 200, {"message": "stock removed from cache"}
+        if path == "/invalidate_cache_batch":
+            if cache is not None:
+                for item in request["invalidations"]:
+                    cache.invalidate(item["name"], item.get("version"))
+            return 200, {"message": "stock removed from cache"}
+
+    return 404, {"error": {"code": 404, "message": "not found"}}
+
+
+async def handle_session(reader, writer):
+    # serves the requests of one persistent client connection until the client closes it
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, version = request_line.decode("latin-1").split()
+            # the request metrics are labelled with the routes of the threaded front-end
+            started = time.perf_counter()
+            metric_route = metrics.route_label(path, front_end.FrontEnd.metric_routes)
+            in_flight = metrics.http_in_flight.labels(metric_route)
+            in_flight.inc()
+            try:
+                headers = await read_headers(reader)
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                # the span of the request is the current one of this coroutine while it is routed
+                with tracing.server_span(f"{method} {metric_route}", headers,
+                                         metric_route in front_end.FrontEnd.trace_roots) as request_span:
+                    try:
+                        status, response_body = await route(method, path, body)
+                    except UpstreamError as error:
+                        log.warning("%s", error)
+                        status, response_body = 503, {"error": {"code": 503, "message": "upstream service is unavailable"}}
+                    except (KeyError, json.JSONDecodeError):
+                        status, response_body = 400, {"error": {"code": 400, "message": "malformed request"}}
+                    request_span.tag("status", status)
+            finally:
+                in_flight.dec()
+            metrics.http_duration.labels(metric_route, method).observe(time.perf_counter() - started)
+            metrics.http_requests.labels(metric_route, method, str(status)).inc()
+
+            if path == "/metrics":
+                content_type, payload = "text/plain; version=0.0.4", metrics.render().encode("utf-8")
+            elif isinstance(response_body, str):
+                content_type, payload = "application/text", response_body.encode("utf-8")
+            else:
+                content_type, payload = "application/json", json.dumps(response_body).encode("utf-8")
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            writer.write((f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}\r\n"
+                          f"Content-type: {content_type}\r\nContent-length: {len(payload)}\r\n"
+                          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve():
+    front_end.leader_monitor.start()
+
+    server = await asyncio.start_server(handle_session, hostName, PORT, backlog=4096)
+    log.info("Front end service (asyncio) started http://%s:%s", hostName, PORT)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    log.info("Server has stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,34 @@
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
+import itertools
 import re
-import requests
+import sys
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, quote, urlsplit
+
+import requests
+
+# the helpers shared by all the services live in the common package at the root of the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_pool import UpstreamPool, get_pool, is_connect_error
+from common.log import LoggingHandlerMixIn, get_logger
+from common import tracing
+from common.metrics import MetricsHandlerMixIn
+from common.tracing import TracingHandlerMixIn
+
+# threaded (one thread per session, the default) or asyncio (one event loop serving every session)
+server_mode = os.getenv("FRONTEND_SERVER_MODE", "threaded")
+
+if __name__ == "__main__" and server_mode == "asyncio":
+    # the event-loop server has its own entry point, which imports this file as the front_end module and shares its
+    # cache and leader state. It is started before this copy, running as __main__, builds any state of its own
+    import async_front_end
+    async_front_end.main()
+    sys.exit()
 
 # specifying the host and port number that front-end service will run on
 #hostName = "localhost"
@@ -12,124 +37,474 @@ hostName = os.getenv("FRONTEND_HOSTNAME")
 PORT = int(os.getenv("FRONTEND_PORT"))
 # print(f"From env, hostname:{hostName} and port: {PORT}")
 
+# the name of this service in the request traces
+tracing.service_name = "frontend"
+# the level of its messages is set with LOG_LEVEL or LOG_LEVELS=front_end=<level>
+log = get_logger("front_end")
+
 # checking if caching is enabled
 enable_cache = os.getenv("ENABLE_CACHE", "True") == "True"
 
+# upper bound on the number of cached stocks, the least recently used one is evicted beyond it
+cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+# seconds after which a cached stock is dropped even if no invalidation arrived for it, 0 disables the TTL
+cache_ttl = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+
+def public_stock(data):
+    # the stock as the clients see it, the catalog version only serves the cache bookkeeping
+    return {key : value for key, value in data.items() if key != "version"}
+
+class StockCache:
+    """Thread-safe LRU cache of catalog lookups with an optional TTL and hit/miss counters.
+
+    Entries hold the catalog version of the lookup. The highest invalidated version per stock is remembered
+    so that a lookup result older than an invalidation is never put back in the cache.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # stock name -> (price, quantity, version, time cached), kept in least to most recently used order
+        self.entries = OrderedDict()
+        self.invalidated_versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, name):
+        # returns the cached (price, quantity, version) of a stock or None on a miss
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and self.ttl and time.monotonic() - entry[3] > self.ttl:
+                # the TTL is only a safety net for invalidations that got lost on the way
+                del self.entries[name]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+            return entry[:3]
+
+    def put(self, data):
+        # caches a catalog lookup unless an invalidation newer than the looked up version already arrived
+        name = data["name"]
+        version = data.get("version", 0)
+        with self.lock:
+            if version < self.invalidated_versions.get(name, version):
+                return
+            self.entries[name] = (data["price"], data["quantity"], version, time.monotonic())
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidated_version(self, name):
+        # highest version the stock was invalidated at, used to tell lookups started before and after an invalidation apart
+        with self.lock:
+            return self.invalidated_versions.get(name)
+
+    def invalidate(self, name, version=None):
+        # removes a stock from the cache and remembers the version it was invalidated at
+        with self.lock:
+            if version is not None and version > self.invalidated_versions.get(name, -1):
+                self.invalidated_versions[name] = version
+            entry = self.entries.get(name)
+            if entry is not None and (version is None or entry[2] <= version):
+                del self.entries[name]
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries" : len(self.entries),
+                "max_entries" : self.max_entries,
+                "ttl_seconds" : self.ttl,
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "hit_rate" : self.hits / lookups if lookups else 0.0,
+                "evictions" : self.evictions,
+                "expirations" : self.expirations,
+                "invalidations" : self.invalidations,
+            }
+
+class SingleFlight:
+    """De-duplicates concurrent upstream calls: callers asking for a key that is already being fetched
+    wait for that fetch and share its result instead of sending their own request."""
+
+    class Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.upstream_calls = 0
+        self.saved_calls = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+                self.upstream_calls += 1
+            else:
+                self.saved_calls += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return {"upstream_lookups" : self.upstream_calls, "coalesced_lookups" : self.saved_calls}
+
+# concurrent cache misses for the same stock share one catalog lookup
+lookup_flights = SingleFlight()
+
 # if caching is enabled
 if enable_cache:
-    # in memory cache as a dictionary
-    cache = {}
+    # in memory cache of catalog lookups
+    cache = StockCache(cache_max_entries, cache_ttl)
 
 # if caching is off   
 else:
     # disable cache
     cache = None
 
-order_service_instances = {}
+# specifying the host and port number of catalog service
+catalogHostName = os.getenv("CATALOG_HOSTNAME")
+catalogPort = int(os.getenv("CATALOG_PORT"))
+
+# how often the order instances are probed, how long one probe may take and how many probes in a row the leader
+# may miss before it is replaced
+probe_interval = float(os.getenv("ORDER_PROBE_INTERVAL_MS", "250")) / 1000
+probe_timeout = float(os.getenv("ORDER_PROBE_TIMEOUT_MS", "200")) / 1000
+probe_failures = int(os.getenv("ORDER_PROBE_FAILURES", "2"))
+# longest time a request waits for an order leader, failovers included, before it is answered with a 503
+failover_timeout = float(os.getenv("FAILOVER_TIMEOUT_MS", "3000")) / 1000
+# most stocks or orders a client may send in one batch request
+batch_max_items = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+# where order queries go: leader (every query) or replicas (spread over all the healthy instances, followers included)
+read_routing = os.getenv("ORDER_READ_ROUTING", "leader")
+if read_routing not in ("leader", "replicas"):
+    raise ValueError(f"ORDER_READ_ROUTING must be leader or replicas, got {read_routing!r}")
+
+def load_order_instances():
+    # get details of all the order service instances in the network that is declared previously
+    instances = {}
+    for i in range(1, int(os.getenv("TOTAL_ORDER_INSTANCES")) + 1):
+        instances[i] = {
+            "host": os.getenv(f"ORDER_{str(i)}_HOSTNAME"),
+            "port": int(os.getenv(f"ORDER_{str(i)}_PORT")),
+            "instance_id": os.getenv(f"ORDER_{str(i)}_INSTANCE_ID")
+        }
+    return instances
+
+# the order instances are read from the environment once per process
+order_service_instances = load_order_instances()
 
 LEADER_ID = None
 LEADER_NUM = None
 tradeHostName = None
 tradePort = None
 
-class FrontEnd(BaseHTTPRequestHandler):
-    # http protocol version that supports persistent client connections
-    protocol_version = 'HTTP/1.1'
-    
-    def __init__(self, *args, **kwargs):
-        # declaring leader_id and its respective number in the list of order nodes as global
-        global LEADER_ID
-        global LEADER_NUM
-        # specifying the host and port number of catalog service
-        self.lookupHostName = os.getenv("CATALOG_HOSTNAME")
-        self.lookupPort = int(os.getenv("CATALOG_PORT"))
-        # print(f"From env, CATALOG hostname:{self.lookupHostName} and port: {self.lookupPort}")
-
-        # get details of ll the order service instances in the network that is declared previously
-        self.total_order_instances = int(os.getenv("TOTAL_ORDER_INSTANCES"))
-        for i in range(1, self.total_order_instances+1):
-            order_service_instances[i] = {
-                "host": os.getenv(f"ORDER_{str(i)}_HOSTNAME"),
-                "port": int(os.getenv(f"ORDER_{str(i)}_PORT")),
-                "instance_id": os.getenv(f"ORDER_{str(i)}_INSTANCE_ID")
-            }
-        
-        if not LEADER_ID:
-            # perform leader selection
-            LEADER_ID, LEADER_NUM = self.get_order_leader()
-            self.assign_order_leader()
-            self.announce_leader()
-
-        # invoking the base class constructor
-        super().__init__(*args, **kwargs)
-    
-    def get_order_leader(self):
-        # print("Inside get leader")
-        # iterate through the list in descending order
-        for instance_num in reversed(order_service_instances.keys()):
-            instance_host = order_service_instances[instance_num]["host"]
-            instance_port = order_service_instances[instance_num]["port"]
-            instance_id = order_service_instances[instance_num]["instance_id"]
+class LeaderMonitor:
+    """Keeps the order leader state of the process up to date.
+
+    A background thread probes every order instance with a short timeout and replaces the leader once it missed
+    probe_failures probes in a row. A request that fails on the leader reports it, the leader is then probed and
+    only replaced if it does not answer either. Only the first report for a leader runs an election, the requests
+    reporting it later find it already replaced and retry on the new one.
+    """
+
+    def __init__(self, instances):
+        self.instances = instances
+        # probes get their own connection per instance so that they never queue behind busy request connections
+        self.probe_pools = {num: UpstreamPool("probe", instance["host"], instance["port"], 1)
+                            for num, instance in instances.items()}
+        self.healthy = {num: False for num in instances}
+        # cycles through the instances for the reads routed to the replicas
+        self.read_cursor = itertools.count()
+        self.missed_probes = 0
+        self.elections = 0
+        self.election_lock = threading.Lock()
+        # notified whenever the leader changes
+        self.leader_changed = threading.Condition()
+
+    def start(self):
+        self.elect(None)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def leader(self):
+        # the leader id, host and port read together, so they always belong to the same instance
+        with self.leader_changed:
+            return LEADER_ID, tradeHostName, tradePort
+
+    def wait_for_leader(self, deadline):
+        # returns the current leader, waiting until the deadline if none is known. The id is None when there is none
+        with self.leader_changed:
+            while LEADER_ID is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.leader_changed.wait(remaining)
+            return LEADER_ID, tradeHostName, tradePort
+
+    def probe(self, instance_num):
+        try:
+            return self.probe_pools[instance_num].get("/isalive", timeout=probe_timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def run(self):
+        while True:
+            time.sleep(probe_interval)
+            # a failed round must not end the thread, failover would stop for the life of the process
             try:
-                # creating the url to invoke the REST API of the order service that checks if the order service is alive or crashed
-                order_url = "http://" + instance_host + ":" + str(instance_port) + "/isalive"
-                print("Sending to order url", order_url)
-                health_check = requests.get(order_url) # sending a GET request
-                
-                # if the order is alive, then its assigned as the leader
-                if(health_check.status_code == 200):
-                    healthy_order_service = health_check.json()
-                    print(f"Leader: {healthy_order_service}")
-                    
-                return instance_id, instance_num
-            except:
-                print(f"Order service {order_service_instances[instance_num]} is not alive")
-                continue
-        return
-    
-    def assign_order_leader(self):
-        # this function assigns the leader host and port to its respective global variables
-        global tradeHostName
-        global tradePort
-        # print("Assign leader")
-        if LEADER_ID:
-            print("Host and port of leader order service", order_service_instances[LEADER_NUM])
-            # specifying the host and port number of the leader order service
-            tradeHostName = order_service_instances[LEADER_NUM]["host"]
-            tradePort = order_service_instances[LEADER_NUM]["port"]
+                self.probe_round()
+            except Exception as error:
+                log.error("Probe round failed: %r", error)
+
+    def probe_round(self):
+        for instance_num in self.instances:
+            self.healthy[instance_num] = self.probe(instance_num)
+
+        # the leader is read as a whole, an election on a request thread may replace it at any time
+        with self.leader_changed:
+            leader_id, leader_num = LEADER_ID, LEADER_NUM
+        if leader_id is None:
+            # all the instances were down, an election is retried on every round until one comes back
+            self.elect(None)
+        elif self.healthy[leader_num]:
+            self.missed_probes = 0
         else:
-            # if the leader id is not assigned when this function is called, it means none of the services are alive
-            print("All the order service instances are down")
-            exit()
-    
-    def announce_leader(self):
-        # print("Inside announce leader")
-        for instance_num in reversed(order_service_instances.keys()):
-            instance_host = order_service_instances[instance_num]["host"]
-            instance_port = order_service_instances[instance_num]["port"]
+            self.missed_probes += 1
+            if self.missed_probes >= probe_failures:
+                log.warning("Leader missed %s probes", self.missed_probes)
+                self.elect(leader_id)
+
+    def next_replica(self):
+        # the next healthy instance, round robin, for a read. None when the probes found none
+        healthy = [num for num, healthy in self.healthy.items() if healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.read_cursor) % len(healthy)]
 
+    def replica_failed(self, instance_num):
+        # a failed read takes a replica out of the rotation until its next successful probe
+        self.healthy[instance_num] = False
+
+    def leader_failed(self, failed_leader_id):
+        # called when a request failed on the leader. A failed request alone does not prove the leader is gone (the
+        # request itself may have broken the handler), so the leader is probed first and only replaced if it does not
+        # answer. Returns whether the leader was found gone, the request can then be retried on the new one
+        with self.leader_changed:
+            if LEADER_ID != failed_leader_id:
+                return True
+            leader_num = LEADER_NUM
+        if leader_num is not None and self.probe(leader_num):
+            return False
+        self.elect(failed_leader_id)
+        return True
+
+    def elect(self, failed_leader_id):
+        # picks the alive order instance with the highest number as the leader and notifies every instance.
+        # If the failed leader was already replaced by another election, its result is kept
+        global LEADER_ID, LEADER_NUM, tradeHostName, tradePort
+        with self.election_lock:
+            if LEADER_ID is not None and LEADER_ID != failed_leader_id:
+                return
+            self.elections += 1
+            self.missed_probes = 0
+            # iterate through the list in descending order
+            for instance_num in reversed(self.instances.keys()):
+                self.healthy[instance_num] = self.probe(instance_num)
+                if self.healthy[instance_num]:
+                    break
+                log.warning("Order service %s is not alive", self.instances[instance_num])
+            else:
+                instance_num = None
+
+            if instance_num is not None:
+                # the instances learn about the leader before requests are sent to it
+                self.announce_leader(self.instances[instance_num]["instance_id"])
+                log.info("Host and port of leader order service %s", self.instances[instance_num])
+            elif LEADER_ID is not None or self.elections == 1:
+                # reported once per outage, the probes keep retrying the election quietly
+                log.error("All the order service instances are down")
+
+            with self.leader_changed:
+                if instance_num is None:
+                    LEADER_ID, LEADER_NUM, tradeHostName, tradePort = None, None, None, None
+                else:
+                    instance = self.instances[instance_num]
+                    LEADER_ID, LEADER_NUM = instance["instance_id"], instance_num
+                    tradeHostName, tradePort = instance["host"], instance["port"]
+                self.leader_changed.notify_all()
+
+    def announce_leader(self, leader_id):
+        for instance_num in reversed(self.instances.keys()):
             try:
-                # creating the url to invoke the REST API of the order service that notifies all nodes 
-                # with details of the nodes in the network and the leader id
-                order_url = "http://" + instance_host + ":" + str(instance_port) + "/notify"
-                response_body = {"leader": LEADER_ID, "all_order_nodes": order_service_instances}
-                response_body_bytes = json.dumps(response_body).encode(encoding='utf_8')
-                response_content_length = len(response_body_bytes)
-                headers = {
-                'Content-Length': str(response_content_length),
-                'Content-type': "application/json",
-                }
-                requests.post(order_url, json=response_body, headers=headers)
-            except:
-                print(f"Failed to notify {instance_host}/{instance_port}")
+                # notifies all nodes with details of the nodes in the network and the leader id
+                response_body = {"leader": leader_id, "all_order_nodes": self.instances}
+                self.probe_pools[instance_num].post("/notify", json=response_body, timeout=(probe_timeout, failover_timeout))
+            except requests.RequestException:
+                log.warning("Failed to notify %s/%s", self.instances[instance_num]['host'], self.instances[instance_num]['port'])
                 continue
 
+    def stats(self):
+        return {
+            "leader" : LEADER_ID,
+            "healthy" : {self.instances[num]["instance_id"] : healthy for num, healthy in self.healthy.items()},
+            "elections" : self.elections,
+        }
+
+# shared by every request handler of the process
+leader_monitor = LeaderMonitor(order_service_instances)
+
+# sends a request to the order leader and fails over to the newly elected leader when it does not answer.
+# It returns the status code and the json body, a 503 when no leader answered within the failover timeout and a 502 or
+# 504 when the request failed on a leader that is still alive, or after it may have been executed
+def call_leader(method, path, **kwargs):
+    deadline = time.monotonic() + failover_timeout
+    while True:
+        leader_id, host, port = leader_monitor.wait_for_leader(deadline)
+        if leader_id is None:
+            return 503, {"error" : {"code" : 503, "message" : "no order service is available"}}
+        try:
+            # invoking the REST API of the order service over the connection pool of the leader
+            response = get_pool("order", host, port).request(method, path, **kwargs)
+            return response.status_code, response.json()
+        except requests.RequestException as error:
+            # If the leader service does not reply back, it may have crashed, leader re-election is triggered once a
+            # probe confirms it
+            log.warning("Leader is unresponsive: %r", error)
+            leader_gone = leader_monitor.leader_failed(leader_id)
+            # a trade that failed after it was sent may have been executed, only trades that never reached the leader
+            # are retried on the new one
+            if method != "GET" and not is_connect_error(error):
+                if isinstance(error, requests.Timeout):
+                    return 504, {"error" : {"code" : 504, "message" : "the order service did not answer in time"}}
+                return 502, {"error" : {"code" : 502, "message" : "the order service failed to answer"}}
+            if not leader_gone:
+                return 502, {"error" : {"code" : 502, "message" : "the order service failed to answer"}}
+        if time.monotonic() >= deadline:
+            return 503, {"error" : {"code" : 503, "message" : "no order service is available"}}
+
+class ReadStats:
+    """Counts the order queries answered by every instance, and the ones a replica sent back because it was behind."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.served = {}
+        self.forwarded = 0
+
+    def record(self, instance_id):
+        with self.lock:
+            self.served[instance_id] = self.served.get(instance_id, 0) + 1
+
+    def record_forwarded(self):
+        with self.lock:
+            self.forwarded += 1
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "routing" : read_routing,
+                "seconds" : elapsed,
+                "served" : dict(self.served),
+                "reads_per_second" : {instance_id : count / elapsed for instance_id, count in self.served.items()},
+                "forwarded_to_leader" : self.forwarded,
+            }
+
+read_stats = ReadStats()
+
+# sends an order query to the next healthy replica. A replica that has not caught up with the order answers 409
+# and, like a replica that fails, has the query forwarded to the leader
+def call_replica(path):
+    instance_num = leader_monitor.next_replica()
+    if instance_num is not None:
+        instance = order_service_instances[instance_num]
+        try:
+            response = get_pool("order", instance["host"], instance["port"]).get(path)
+        except requests.RequestException:
+            log.warning("Order replica %s is unresponsive", instance)
+            leader_monitor.replica_failed(instance_num)
+        else:
+            if response.status_code != 409:
+                read_stats.record(instance["instance_id"])
+                return response.status_code, response.json()
+            read_stats.record_forwarded()
+    status, body = call_leader("GET", path)
+    if status != 503:
+        read_stats.record(leader_monitor.leader()[0])
+    return status, body
+
+class FrontEnd(LoggingHandlerMixIn, TracingHandlerMixIn, MetricsHandlerMixIn, BaseHTTPRequestHandler):
+    # http protocol version that supports persistent client connections
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without TCP_NODELAY a keep-alive response waits on the delayed ACK of the peer
+    disable_nagle_algorithm = True
+    # the routes the request metrics are labelled with
+    metric_routes = ("/stocks/*", "/stocks", "/orders/batch", "/orders/*", "/orders", "/cache_stats", "/read_stats",
+                     "/order_health", "/metrics", "/invalidate_cache_batch", "/invalidate_cache", "/test")
+    # the client requests, which start the request traces
+    trace_roots = ("/stocks/*", "/stocks", "/orders/batch", "/orders/*", "/orders")
+    # the line of every request is logged at debug level
+    logger = log
+
     # function to handle all GET requests
     def do_GET(self):
         # verifying whether the REST API path for a GET request is correct
+        # batch lookup of comma separated stock names, the misses are fetched from the catalog in one request
+        if self.path.startswith("/stocks?"):
+            names = [name for name in parse_qs(urlsplit(self.path).query).get("names", [""])[0].split(",") if name]
+            status, body = self.lookup_stock_batch(names)
+            self.send_json(status, body)
+            return
+
         if re.search("/stocks/.*", self.path):
-            stock_data = self.lookup_stock_details()
-            self.send_api_response(stock_data)
+            status, body = self.lookup_stock_details()
+            self.send_json(status, body)
+            return
+        
+        # request, upstream and cache metrics in the Prometheus text format
+        elif self.path == "/metrics":
+            self.send_metrics()
+            return
+
+        # exposes the cache counters so the cache can be sized from the observed hit rates
+        elif self.path == "/cache_stats":
+            stats = cache.stats() if cache is not None else {"enabled" : False}
+            stats.update(lookup_flights.stats())
+            self.send_json(200, {"data" : stats})
             return
         elif re.search("/test", self.path):
             self.send_response(200)
@@ -141,19 +516,35 @@ class FrontEnd(BaseHTTPRequestHandler):
         
         # if the user decides to query an order
         elif re.search("/orders/.*", self.path):
-            query_data = self.query_order_number()
-            self.send_api_response(query_data)
+            status, body = self.query_order_number()
+            self.send_json(status, body)
+            return
+
+        # exposes the order queries answered per instance, to compare the read throughput of the replicas
+        elif self.path == "/read_stats":
+            self.send_json(200, {"data" : read_stats.stats()})
             return
+
+        # exposes the probed health of the order instances and the number of elections run
+        elif self.path == "/order_health":
+            self.send_json(200, {"data" : leader_monitor.stats()})
+            return
+
+        # unknown paths get an explicit error so that persistent connections are not left waiting
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
     
     # function to handle all POST requests
     def do_POST(self):
-        global LEADER_NUM
-        global LEADER_ID
-        
         # verifying whether the REST API path for a POST request is correct
+        # a batch of trades is forwarded to the order leader in one request, every trade gets its own result
+        if self.path == "/orders/batch":
+            status, body = self.handle_stock_trade_batch()
+            self.send_json(status, body)
+            return
+
         if re.search("/orders", self.path):
-            stock_trade = self.handle_stock_trade()
-            self.send_api_response(stock_trade)
+            status, body = self.handle_stock_trade()
+            self.send_json(status, body)
             return
         
         # gets the invalidation request and removes the item from the cache
@@ -161,30 +552,45 @@ class FrontEnd(BaseHTTPRequestHandler):
             length = int(self.headers.get('Content-length'))
             body = self.rfile.read(length)
             req = json.loads(body.decode('utf-8'))
-            name = req["name"]
             
             # the removal part
-            if name in cache:
-                del cache[name]
-
-            response = {'message' : 'stock removed from cache'}
-            answer = json.dumps(response).encode('utf-8')
-            response_content_length = len(answer)    
-            # a successful response is sent back
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header("Content-length", response_content_length)
-            self.end_headers()
-            self.wfile.write(answer)
+            if cache is not None:
+                cache.invalidate(req["name"], req.get("version"))
+            self.send_invalidation_response()
+            return
+        
+        # gets a batch of invalidations coalesced by the catalog and removes all of them from the cache
+        elif self.path == '/invalidate_cache_batch':
+            length = int(self.headers.get('Content-length'))
+            body = self.rfile.read(length)
+            req = json.loads(body.decode('utf-8'))
+            
+            if cache is not None:
+                for item in req["invalidations"]:
+                    cache.invalidate(item["name"], item.get("version"))
+            self.send_invalidation_response()
             return
+
+        # unknown paths get an explicit error so that persistent connections are not left waiting, the body is read
+        # first or it would be taken for the next request on the connection
+        self.rfile.read(int(self.headers.get('Content-length', 0)))
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
+    
+    def send_invalidation_response(self):
+        response = {'message' : 'stock removed from cache'}
+        answer = json.dumps(response).encode('utf-8')
+        response_content_length = len(answer)    
+        # a successful response is sent back
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header("Content-length", response_content_length)
+        self.end_headers()
+        self.wfile.write(answer)
                       
     
-    # function to send responses from the respective GET/POST requests back to the caller
-    def send_api_response(self, api_data):
-        response_code = api_data.status_code
-        response_body = api_data.json()
+    # function to send a json body back to the caller
+    def send_json(self, response_code, response_body, response_content_type="application/json"):
         response_body_bytes = json.dumps(response_body).encode(encoding='utf_8')
-        response_content_type = api_data.headers['Content-type']
         response_content_length = len(response_body_bytes) # to enable the implementation of a thread-per-session model
         self.send_response(response_code)
         self.send_header("Content-type", response_content_type)
@@ -193,106 +599,118 @@ class FrontEnd(BaseHTTPRequestHandler):
         # write the body of the response back to the client using an output stream
         self.wfile.write(response_body_bytes)
 
-    # function to implement the API that forwards requests to the catalog service to look up the details of a stock
+    # function to implement the API that forwards requests to the catalog service to look up the details of a stock,
+    # it returns the status code and the body of the response
     def lookup_stock_details(self):
         stock_name = self.path.split("/stocks/")[1] # get stock name from the url
         
         # checks if its already in cache and returns if it is
-        if stock_name in cache:
+        entry = cache.get(stock_name) if cache is not None else None
+        if entry is not None:
             answer = {
                 "name" : stock_name,
-                "price" : cache[stock_name][0],
-                "quantity" : cache[stock_name][1],
+                "price" : entry[0],
+                "quantity" : entry[1],
             }
-            
-            print(cache)
-            response = json.dumps({"data" : answer})
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(response.encode("utf-8"))
-            return
+            return 200, {"data" : answer}
         
-        elif cache is not None:
-            # creating the url to invoke the REST API of the catalog service
-            catalog_url = "http://" + self.lookupHostName + ":" + str(self.lookupPort) + "/lookup/" + stock_name
-            stock_data = requests.get(catalog_url) # sending a GET request
-            
-            # the details are added to the cache with the stock name as key and a list of price and quantity as value 
-            if(stock_data.status_code == 200):
-                answer = stock_data.json()
-                name = answer["data"]["name"]
-                cache[name] = []
-                price = answer["data"]["price"]
-                quantity = answer["data"]["quantity"]
-                cache[name].append(price)
-                cache[name].append(quantity)
-                
-            print(cache)
-            return stock_data
+        # concurrent misses share one catalog lookup. The last invalidated version is part of the key, so a request
+        # arriving after an invalidation never joins a lookup that started before it
+        flight_key = (stock_name, cache.invalidated_version(stock_name) if cache is not None else None)
+        return lookup_flights.do(flight_key, lambda: self.fetch_stock_details(stock_name))
+
+    # function to implement the batch lookup of stocks, the cached ones are answered from the cache and the others
+    # are looked up in one request to the catalog. The result of every name is reported in the order of the names
+    def lookup_stock_batch(self, names):
+        if len(names) > batch_max_items:
+            return 400, {"error" : {"code" : 400, "message" : f"at most {batch_max_items} stocks per batch"}}
+        results = {}
+        for name in names:
+            entry = cache.get(name) if cache is not None else None
+            if entry is not None:
+                results[name] = {"name" : name, "price" : entry[0], "quantity" : entry[1]}
+        missing = [name for name in names if name not in results]
+        if missing:
+            catalog_pool = get_pool("catalog", catalogHostName, catalogPort)
+            response = catalog_pool.get("/lookup?names=" + quote(",".join(missing), safe=","))
+            if response.status_code != 200:
+                return response.status_code, response.json()
+            for item in response.json()["data"]:
+                if "error" not in item and cache is not None:
+                    cache.put(item)
+                results[item["name"]] = public_stock(item)
+        return 200, {"data" : [results[name] for name in names]}
+
+    # function that sends the lookup to the catalog service and caches a successful result
+    def fetch_stock_details(self, stock_name):
+        # invoking the REST API of the catalog service over its connection pool
+        catalog_pool = get_pool("catalog", catalogHostName, catalogPort)
+        stock_data = catalog_pool.get("/lookup/" + stock_name) # sending a GET request
+        
+        # the details are added to the cache with the stock name as key
+        body = stock_data.json()
+        if stock_data.status_code == 200:
+            if cache is not None:
+                cache.put(body["data"])
+            body = {"data" : public_stock(body["data"])}
+        return stock_data.status_code, body
         
     
-    # function to implement the API that forwards requests to the order service to query a particular order's details
+    # function to implement the API that forwards requests to the order service to query a particular order's details,
+    # it returns the status code and the body of the response
     def query_order_number(self):
-        global LEADER_NUM
-        global LEADER_ID
         order_no = self.path.split("/orders/")[1] # get the order number from the url
-
-        while True:
-            try:
-                # creating the url to invoke the query API
-                order_url = "http://" + tradeHostName + ":" + str(tradePort) + "/query/" + order_no
-                order_data = requests.get(order_url) # sending a GET request
-                return order_data
-            except:
-                # If the leader service does not reply back, it means the leader has crashed and leader re-election is triggered
-                print("Leader is unresponsive")
-                LEADER_ID, LEADER_NUM = self.get_order_leader()
-                self.assign_order_leader() 
-                self.announce_leader()
+        # invoking the query API of a replica or of the leader
+        if read_routing == "replicas":
+            return call_replica("/query/" + order_no)
+        status, body = call_leader("GET", "/query/" + order_no)
+        if status != 503:
+            read_stats.record(leader_monitor.leader()[0])
+        return status, body
 
     # function to implement the API that forwards requests to the order service to place an order for a certain stock
     def handle_stock_trade(self):
-        global LEADER_NUM
-        global LEADER_ID
         # reading the request body (json object) of the POST API
         content_length = int(self.headers.get('Content-Length'))
         # read the body of the request from the client using an input stream
         post_body = self.rfile.read(content_length)
         request = json.loads(post_body.decode('utf-8'))
-        name = request["name"]
-        trade = request["type"]
-        quantity = request["quantity"]
-        trade_details = {
-            "name": name,
-            "type": trade,
-            "quantity": quantity,
-        }
-        headers = {
-            'Content-Length': str(content_length),
-            'Content-type': "application/json",
-        }
-        while True:
-            try:
-                # creating the url to invoke the REST API of the order service
-                order_url = "http://" + tradeHostName + ":" + str(tradePort) + "/trade"
-                # order_url = "https://df010cd7-2553-430e-972b-493f1a57b268.mock.pstmn.io" + "/trade"
-                order_data = requests.post(order_url, json=trade_details, headers=headers) # sending a POST request
-                return order_data
-            except:
-                # If the leader service does not reply back, it means the leader has crashed and leader re-election is triggered
-                print("Leader is unresponsive")
-                LEADER_ID, LEADER_NUM = self.get_order_leader()
-                self.assign_order_leader()
-                self.announce_leader()
+        # a request without the trade fields gets a 400 like in the asyncio front-end, not a dropped connection
+        try:
+            trade_details = {
+                "name": request["name"],
+                "type": request["type"],
+                "quantity": request["quantity"],
+            }
+        except (KeyError, TypeError):
+            return 400, {"error" : {"code" : 400, "message" : "malformed request"}}
+        # sending a POST request to the leader
+        return call_leader("POST", "/trade", json=trade_details)
+
+    # function to implement the batch trade API, the trades are forwarded to the order leader in one request
+    def handle_stock_trade_batch(self):
+        content_length = int(self.headers.get('Content-Length'))
+        request = json.loads(self.rfile.read(content_length).decode('utf-8'))
+        orders = request.get("orders") if isinstance(request, dict) else None
+        if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+            return 400, {"error" : {"code" : 400, "message" : "orders must be a list of objects"}}
+        if len(orders) > batch_max_items:
+            return 400, {"error" : {"code" : 400, "message" : f"at most {batch_max_items} orders per batch"}}
+        trades = [{"name" : order.get("name"), "type" : order.get("type"), "quantity" : order.get("quantity")}
+                  for order in orders]
+        return call_leader("POST", "/trade_batch", json={"trades" : trades})
 
 class FrontendThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Implements multithreading into the HTTP server enabling it to spawn a new thread for each session"""
+    # the default listen backlog of 5 drops connection bursts, which then wait for SYN retransmits
+    request_queue_size = 1024
 
 if __name__ == "__main__":
     # Instantiating the FrontendThreadedHTTPServer class that allows multithreading in an HTTP server
     frontendServer = FrontendThreadedHTTPServer((hostName, PORT), FrontEnd)
-    print("Front end service started http://%s:%s" % (hostName, PORT))
+    # perform leader selection before the first request arrives, the probes keep it current afterwards
+    leader_monitor.start()
+    log.info("Front end service started http://%s:%s", hostName, PORT)
 
     try:
         # starts the http server to handle requests
@@ -302,4 +720,4 @@ if __name__ == "__main__":
     
     # stop the server after execution is completed or due to keyboard interrupt
     frontendServer.server_close()
-    print("Server has stopped.")
\ No newline at end of file
+    log.info("Server has stopped.")
\ No newline at end of file
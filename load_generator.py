@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import resource
+
+from benchmarks.topology import STOCK_NAMES
+
+# Load generator for the front-end service: thousands of concurrent client sessions from one process, each a coroutine
+# with its own keep-alive connection, sending a configurable mix of lookups, buys, sells and order queries.
+#
+# In closed-loop mode (the way client.py works) every session sends its next request once the previous one was
+# answered, optionally after a think time, so the offered load drops as the service slows down. In open-loop mode
+# requests arrive at a fixed rate whatever the service does (Poisson or evenly spaced arrivals), which is what shows
+# saturation: once the rate exceeds what the service can take, the queueing delay and the latencies keep growing.
+# The latency of an open-loop request is measured from its scheduled arrival, so the time it waited for a free
+# connection counts too. The requests still waiting or in flight once the run is over are cut off after the request
+# timeout and count as failed at the latency they had reached, so a saturated service does not look faster than it is.
+#
+# Every request's latency is recorded. A summary per operation (count, outcomes, throughput, mean and percentiles)
+# is printed and can be written as json, and the single requests can be written to a csv file.
+
+frontendHostName = os.getenv("FRONTEND_HOSTNAME", "localhost")
+frontendPORT = int(os.getenv("FRONTEND_PORT", "8516"))
+
+OPERATIONS = ("lookup", "buy", "sell", "query")
+# orders remembered for the queries, the oldest are forgotten beyond that
+MAX_KNOWN_ORDERS = 100000
+# status of an open-loop request cut off at the end of the run, unlike a connection failure (status 0) it did wait
+CUT_OFF = -1
+
+
+def parse_mix(value):
+    # "lookup=0.5,buy=0.2,sell=0.2,query=0.1" -> weights in OPERATIONS order
+    weights = dict.fromkeys(OPERATIONS, 0.0)
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in weights:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs at least one operation with a positive weight")
+    return [weights[name] for name in OPERATIONS]
+
+
+class ConnectionFailed(Exception):
+    pass
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection to the front-end, opened on first use and again after a failure."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        # returns the status code and the decoded json body of the response
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        # a reused connection may have been closed by the server meanwhile, a GET is then retried once
+        attempts = 2 if method == "GET" and self.writer is not None else 1
+        for attempt in range(attempts):
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), self.timeout)
+                status, response_body = await asyncio.wait_for(self.exchange(method, path, payload), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as error:
+                self.close()
+                if attempt + 1 < attempts:
+                    continue
+                raise ConnectionFailed(repr(error)) from error
+            try:
+                return status, json.loads(response_body) if response_body else None
+            except ValueError:
+                return status, None
+
+    async def exchange(self, method, path, payload):
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+                          .encode("latin-1") + payload)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        length = None
+        keep_alive = version == "HTTP/1.1"
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                keep_alive = False
+        if length is None:
+            response_body = await self.reader.read()
+            keep_alive = False
+        else:
+            response_body = await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(status), response_body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.weights = args.mix
+        # transaction number -> (name, type, quantity) of the orders placed, for the queries and their verification
+        self.known_orders = {}
+        self.known_txns = []
+        self.orders_placed = 0
+        # (operation, status, scheduled start, latency, wait) of every request, times in seconds from the start
+        self.records = []
+        self.mismatches = 0
+        # open-loop requests still waiting for a connection or for their answer when the run ended
+        self.unfinished = 0
+        self.started = None
+
+    def next_request(self):
+        # the operation and the (method, path, body) of a request drawn from the mix. A query needs a placed order,
+        # until there is one it is sent as a lookup
+        operation = self.random.choices(OPERATIONS, self.weights)[0]
+        if operation == "query" and self.known_txns:
+            txn = self.random.choice(self.known_txns)
+            return operation, ("GET", f"/orders/{txn}", None), txn
+        name = self.random.choice(self.args.stocks)
+        if operation in ("buy", "sell"):
+            body = {"name": name, "type": operation, "quantity": self.random.randint(1, self.args.max_quantity)}
+            return operation, ("POST", "/orders", body), body
+        return "lookup", ("GET", f"/stocks/{name}", None), None
+
+    def remember(self, operation, status, response, detail):
+        if status != 200 or not isinstance(response, dict):
+            return
+        data = response.get("data") or {}
+        if operation in ("buy", "sell") and "transaction number" in data:
+            txn = data["transaction number"]
+            self.known_orders[txn] = (detail["name"], detail["type"], detail["quantity"])
+            if len(self.known_txns) < MAX_KNOWN_ORDERS:
+                self.known_txns.append(txn)
+            else:
+                # a full list is used as a ring, the new order replaces the oldest one
+                slot = self.orders_placed % MAX_KNOWN_ORDERS
+                del self.known_orders[self.known_txns[slot]]
+                self.known_txns[slot] = txn
+            self.orders_placed += 1
+        elif operation == "query" and detail in self.known_orders:
+            if (data.get("name"), data.get("type"), data.get("quantity")) != self.known_orders[detail]:
+                self.mismatches += 1
+
+    async def send(self, connection, scheduled, request=None):
+        # sends one request (drawn from the mix unless given) and records it, scheduled is the loop time it was due at
+        operation, (method, path, body), detail = request or self.next_request()
+        sent = asyncio.get_running_loop().time()
+        try:
+            status, response = await connection.request(method, path, body)
+        except ConnectionFailed:
+            status, response = 0, None
+        except asyncio.CancelledError:
+            self.cut_off(operation, scheduled, sent)
+            raise
+        done = asyncio.get_running_loop().time()
+        self.records.append((operation, status, scheduled - self.started, done - scheduled, sent - scheduled))
+        self.remember(operation, status, response, detail)
+
+    async def closed_session(self, index, deadline):
+        loop = asyncio.get_running_loop()
+        # the sessions start spread over the ramp-up so that their connections don't arrive in one burst
+        if self.args.ramp_up:
+            await asyncio.sleep(self.args.ramp_up * index / self.args.sessions)
+        connection = Connection(self.args.host, self.args.port, self.args.timeout)
+        try:
+            while loop.time() < deadline:
+                await self.send(connection, loop.time())
+                if self.args.think_time:
+                    await asyncio.sleep(self.random.expovariate(1000 / self.args.think_time))
+        finally:
+            connection.close()
+
+    def cut_off(self, operation, scheduled, sent=None):
+        # records a request cancelled at the end of the open loop with the latency it had reached
+        now = asyncio.get_running_loop().time()
+        wait = (sent if sent is not None else now) - scheduled
+        self.records.append((operation, CUT_OFF, scheduled - self.started, now - scheduled, wait))
+
+    async def open_request(self, idle, slots, scheduled):
+        # a request of the open loop: it waits for one of the connections, the wait counting in its latency
+        request = self.next_request()
+        try:
+            await slots.acquire()
+        except asyncio.CancelledError:
+            self.cut_off(request[0], scheduled)
+            raise
+        try:
+            connection = idle.pop() if idle else Connection(self.args.host, self.args.port, self.args.timeout)
+            try:
+                await self.send(connection, scheduled, request)
+            finally:
+                idle.append(connection)
+        finally:
+            slots.release()
+
+    async def open_loop(self, deadline):
+        loop = asyncio.get_running_loop()
+        idle = []
+        slots = asyncio.Semaphore(self.args.sessions)
+        tasks = set()
+        next_arrival = self.started
+        while next_arrival < deadline:
+            now = loop.time()
+            if next_arrival > now:
+                await asyncio.sleep(next_arrival - now)
+            # at high rates several arrivals fall due between two wake ups, they start together at their own times
+            while next_arrival <= loop.time() and next_arrival < deadline:
+                task = asyncio.create_task(self.open_request(idle, slots, next_arrival))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if self.args.arrivals == "poisson":
+                    next_arrival += self.random.expovariate(self.args.rate)
+                else:
+                    next_arrival += 1 / self.args.rate
+        # the requests still in flight are waited for, up to the request timeout, then cut off
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.args.timeout)
+            self.unfinished = len(pending)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for connection in idle:
+            connection.close()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.started = loop.time()
+        deadline = self.started + self.args.warmup + self.args.duration
+        if self.args.mode == "open":
+            await self.open_loop(deadline)
+        else:
+            await asyncio.gather(*(self.closed_session(i, deadline) for i in range(self.args.sessions)))
+        return self.records
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return math.nan
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(records, warmup, duration):
+    # per operation and in total: the outcomes, the throughput and the latencies (in ms) of the requests that started
+    # after the warm-up. Connection failures count as failed and are left out of the latencies, the requests cut off at
+    # the end count as failed with the latency they had reached
+    measured = [record for record in records if record[2] >= warmup]
+    summary = {}
+    for operation in OPERATIONS + ("total",):
+        selected = [record for record in measured if operation in ("total", record[0])]
+        if not selected:
+            continue
+        latencies = sorted(record[3] * 1000 for record in selected if record[1] != 0)
+        summary[operation] = {
+            "count": len(selected),
+            "ok": sum(1 for record in selected if 200 <= record[1] < 300),
+            "rejected": sum(1 for record in selected if 400 <= record[1] < 500),
+            "failed": sum(1 for record in selected if record[1] <= 0 or record[1] >= 500),
+            "throughput": len(selected) / duration,
+            "mean_ms": sum(latencies) / len(latencies) if latencies else math.nan,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1] if latencies else math.nan,
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'operation':<10} {'count':>8} {'ok':>8} {'4xx':>6} {'failed':>7} {'req/s':>9} "
+          f"{'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for operation, stats in summary.items():
+        print(f"{operation:<10} {stats['count']:>8} {stats['ok']:>8} {stats['rejected']:>6} {stats['failed']:>7} "
+              f"{stats['throughput']:>9.1f} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+def raise_open_files_limit(sessions):
+    # every session holds a socket, the soft limit on open files is raised up to the hard one if it is too low
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = sessions + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drives the front-end with concurrent client sessions")
+    parser.add_argument("--host", default=frontendHostName, help="Front-end host (FRONTEND_HOSTNAME)")
+    parser.add_argument("--port", type=int, default=frontendPORT, help="Front-end port (FRONTEND_PORT)")
+    parser.add_argument("-m", "--mode", choices=("closed", "open"), default="closed",
+                        help="closed: every session waits for its answer before the next request, "
+                             "open: requests arrive at --rate whatever the latency")
+    parser.add_argument("-s", "--sessions", type=int, default=100,
+                        help="Concurrent sessions (closed) or most connections in use at a time (open)")
+    parser.add_argument("-r", "--rate", type=float, default=100, help="Requests per second in open-loop mode")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson",
+                        help="Spacing of the open-loop arrivals")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("lookup=0.5,buy=0.2,sell=0.2,query=0.1"),
+                        help="Weights of the operations, e.g. lookup=0.5,buy=0.2,sell=0.2,query=0.1")
+    parser.add_argument("-d", "--duration", type=float, default=30, help="Seconds measured after the warm-up")
+    parser.add_argument("-w", "--warmup", type=float, default=2, help="Seconds of load before the measurement")
+    parser.add_argument("--ramp-up", type=float, default=1, help="Seconds over which the closed-loop sessions start")
+    parser.add_argument("--think-time", type=float, default=0,
+                        help="Mean pause in ms between the requests of a closed-loop session")
+    parser.add_argument("--max-quantity", type=int, default=10, help="Largest quantity of a trade")
+    parser.add_argument("--stocks", type=lambda value: value.split(","), default=STOCK_NAMES,
+                        help="Comma separated stock names the requests pick from")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds before a request counts as failed")
+    parser.add_argument("--seed", type=int, help="Seed of the request mix, for repeatable runs")
+    parser.add_argument("--latencies", help="Write every request to this csv file")
+    parser.add_argument("--summary", help="Write the summary to this json file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    raise_open_files_limit(args.sessions)
+    generator = LoadGenerator(args)
+    records = asyncio.run(generator.run())
+    summary = summarize(records, args.warmup, args.duration)
+    print_summary(summary)
+    if generator.unfinished:
+        print(f"{generator.unfinished} requests were still waiting or in flight at the end, they count as failed")
+    if generator.mismatches:
+        print(f"{generator.mismatches} queried orders did not match the placed ones")
+
+    if args.latencies:
+        with open(args.latencies, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["operation", "status", "start_s", "latency_ms", "wait_ms"])
+            for operation, status, start, latency, wait in records:
+                writer.writerow([operation, status, f"{start:.6f}", f"{latency * 1000:.3f}", f"{wait * 1000:.3f}"])
+    if args.summary:
+        config = {key: value for key, value in vars(args).items() if key not in ("latencies", "summary")}
+        with open(args.summary, "w") as file:
+            json.dump({"config": config, "unfinished": generator.unfinished, "mismatches": generator.mismatches,
+                       "operations": summary}, file, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
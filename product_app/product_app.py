@@ -4,8 +4,24 @@ import socketserver
 import json
 import threading
 import os
+import shutil
+import sys
+import itertools
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
 import requests
 
+# the helpers shared by all the services live in the common package at the root of the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.group_commit import GroupCommitter, policy_from_env
+from common.http_pool import get_pool
+from common.log import LoggingHandlerMixIn, get_logger
+from common import tracing
+from common.metrics import MetricsHandlerMixIn, TimedLock
+from common.tracing import TracingHandlerMixIn
+from common.pooled_server import PooledRequestHandlerMixIn, WorkerPoolMixIn, server_mode
+
 #hostName = "localhost"
 hostName = os.getenv("CATALOG_HOSTNAME")
 
@@ -23,34 +39,263 @@ front_port = int(os.getenv("FRONTEND_PORT"))
 
 enable_cache = os.getenv("ENABLE_CACHE", "True") == "True"
 
+# the name of this service in the request traces
+tracing.service_name = "catalog"
+# the level of its messages is set with LOG_LEVEL or LOG_LEVELS=product_app=<level>
+log = get_logger("product_app")
+
+# maximum number of stock names sent to the front-end in one batched invalidation request
+invalidation_batch_size = int(os.getenv("INVALIDATION_BATCH_SIZE", "256"))
+
 disk_file = os.path.join(os.getcwd(), "product_app", "resources", "catalog.csv")
-class Service(BaseHTTPRequestHandler):
-    # RLock is used for synchronization, multiple readers can acquire at the same time but for writing only one can.
-    lock = threading.RLock()
-    
-    #memory_data is the in memory storage for catalog details obtained from the csv file
-    memory_data = []   
-    with open(disk_file, 'r', encoding = 'utf-8-sig') as file:
+
+# append-only change log holding one "name,quantity" record per successful trade since the last snapshot
+change_log_file = os.path.join(os.getcwd(), "product_app", "resources", "catalog_changes.log")
+
+# the change log being folded into the snapshot by a compaction. It is only left behind by a crash in the middle of
+# one and is then replayed before the current change log
+old_change_log_file = change_log_file + ".old"
+
+# number of change log records after which the log is compacted back into the snapshot csv
+compact_every = int(os.getenv("CATALOG_COMPACT_EVERY", "1000"))
+
+# largest quantity of a trade, the order services keep their orders as 64-bit integers
+max_quantity = 2 ** 63 - 1
+
+# number of locks the stocks are spread over, trades on stocks of different stripes run in parallel
+lock_stripes = int(os.getenv("CATALOG_LOCK_STRIPES", "64"))
+
+# stock versions come from one counter seeded with the start time, so they keep increasing across restarts
+next_version = itertools.count(time.time_ns()).__next__
+
+# compact in-memory record for a single stock, the quantity is kept as an int so trades don't re-parse csv strings.
+# The version is bumped on every trade, the front-end uses it to never re-cache a value older than an invalidation
+class Stock:
+    __slots__ = ("name", "price", "quantity", "version")
+
+    def __init__(self, name, price, quantity, version=0):
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.version = version
+
+def load_catalog(filepath):
+    # reads the catalog csv into a dictionary keyed by the stock name so lookups and trades don't scan the whole catalog
+    catalog = {}
+    with open(filepath, 'r', encoding = 'utf-8-sig') as file:
         read = csv.DictReader(file)
-        
-        # the data from read is appended to the memory_data initialized above
         for data in read:
-            memory_data.append(data)
+            catalog[data["name"]] = Stock(data["name"], float(data["price"]), int(data["quantity"]), next_version())
+    return catalog
+
+def replay_change_log(catalog, filepath):
+    # applies the records of the change log on top of the snapshot and returns how many were replayed.
+    # Every record holds the absolute quantity after the trade, so replaying a record twice is harmless.
+    replayed = 0
+    valid_length = 0
+    if not os.path.exists(filepath):
+        return replayed
+    with open(filepath, 'rb') as file:
+        for line in file:
+            # a record without the trailing newline was torn by a crash in the middle of the write, only the last
+            # record can be torn
+            if not line.endswith(b"\n"):
+                break
+            # a complete record that does not parse is real corruption, truncating there would drop every later trade
+            try:
+                name, quantity = line.decode("utf-8").rstrip("\n").rsplit(",", 1)
+                quantity = int(quantity)
+            except ValueError:
+                raise ValueError(f"corrupt record at byte {valid_length} of {filepath}: {line!r}") from None
+            if name in catalog:
+                catalog[name].quantity = quantity
+            replayed += 1
+            valid_length += len(line)
+    # drop the torn tail so that new records are not glued to it
+    if os.path.getsize(filepath) != valid_length:
+        log.warning("Truncating torn tail of %s at byte %s", filepath, valid_length)
+        with open(filepath, 'r+b') as file:
+            file.truncate(valid_length)
+    return replayed
+
+# Sends cache invalidations to the front-end from a background thread so trades never wait on that round trip.
+# Invalidations queued while a request is in flight are coalesced per stock name, keeping the highest version,
+# and sent together over the pooled keep-alive connections to the front-end.
+class InvalidationDispatcher:
+    def __init__(self, pool, batch_size):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.pending = {}
+        self.cond = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    # queues the invalidation of a stock at the given version, a newer pending version for the same name wins
+    def invalidate(self, name, version):
+        with self.cond:
+            if version > self.pending.get(name, -1):
+                self.pending[name] = version
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                names = list(itertools.islice(self.pending, self.batch_size))
+                batch = [{"name" : name, "version" : self.pending.pop(name)} for name in names]
+            try:
+                self.pool.post("/invalidate_cache_batch", json={"invalidations" : batch})
+            except requests.RequestException:
+                # the front-end is unreachable, the batch is queued again and retried after a short pause
+                log.warning("Failed to send cache invalidations for %s", names)
+                for item in batch:
+                    self.invalidate(item["name"], item["version"])
+                time.sleep(0.5)
+
+# A fixed set of locks, a stock is guarded by the lock its name hashes to. Several stocks are locked in stripe order,
+# so callers locking overlapping sets of stocks never deadlock
+class StripedLock:
+    def __init__(self, stripes):
+        # the waits for all the stripes are recorded together as the catalog lock
+        self.locks = [TimedLock("catalog") for _ in range(stripes)]
+
+    def stripe(self, name):
+        return self.locks[hash(name) % len(self.locks)]
+
+    # holds the stripes of all the given stock names, every stripe once
+    def hold(self, names):
+        return self.hold_stripes({hash(name) % len(self.locks) for name in names})
+
+    # holds every stripe, nothing in the catalog changes meanwhile
+    def hold_all(self):
+        return self.hold_stripes(range(len(self.locks)))
+
+    @contextmanager
+    def hold_stripes(self, stripes):
+        stripes = sorted(stripes)
+        for stripe in stripes:
+            self.locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.locks[stripe].release()
+
+class Service(LoggingHandlerMixIn, TracingHandlerMixIn, MetricsHandlerMixIn, PooledRequestHandlerMixIn,
+              BaseHTTPRequestHandler):
+    # http protocol version that supports persistent connections, so the pooled connections of the callers are reused
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without TCP_NODELAY a keep-alive response waits on the delayed ACK of the peer
+    disable_nagle_algorithm = True
+    # the routes the request metrics are labelled with
+    metric_routes = ("/lookup/*", "/lookup", "/trade_batch", "/trade", "/pool_stats", "/metrics")
+    # the line of every request is logged at debug level
+    logger = log
+    
+    # every stock is guarded by its stripe, trades and lookups of stocks in different stripes don't wait on each other
+    locks = StripedLock(lock_stripes)
+    
+    #catalog is the in memory storage for catalog details obtained from the csv file, indexed by the stock name
+    catalog = load_catalog(disk_file)
+    
+    # trades since the last snapshot are replayed from the change logs, the current one is then kept open for appending
+    change_log_records = replay_change_log(catalog, old_change_log_file) + replay_change_log(catalog, change_log_file)
+    change_log = open(change_log_file, 'ab')
+    # guards the change log file, which a compaction swaps for a new one, and its record count
+    change_log_lock = threading.Lock()
+    # only one compaction runs at a time
+    compaction_lock = threading.Lock()
                
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    # This function queues the new quantities of traded stocks for the change log as one record, the cost is the same whatever the catalog size.
+    # It is called under the stripe locks of the stocks so the log order of a stock matches its memory order, the returned ticket
+    # is waited on after releasing them
+    @classmethod
+    def log_changes(cls, stocks):
+        ticket = cls.committer.submit("".join(f"{stock.name},{stock.quantity}\n" for stock in stocks).encode("utf-8"))
+        with cls.change_log_lock:
+            cls.change_log_records += len(stocks)
+        return ticket
+
+    # called by the group committer to write a batch of change log records
+    @classmethod
+    def write_changes(cls, records):
+        with cls.change_log_lock:
+            cls.change_log.write(b"".join(records))
+            cls.change_log.flush()
+
+    # called by the group committer to make the written records durable
+    @classmethod
+    def sync_changes(cls):
+        # the fsync runs on a duplicate of the descriptor outside change_log_lock, so the writes go on meanwhile and a
+        # compaction swapping the log does not close it under the fsync
+        with cls.change_log_lock:
+            fd = os.dup(cls.change_log.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # called after releasing the stripe locks: once enough records piled up they are folded back into the snapshot csv.
+    # A trade arriving while another one compacts does not wait for it
+    @classmethod
+    def maybe_compact(cls):
+        if cls.change_log_records >= compact_every and not cls.compaction_lock.locked():
+            cls.save_to_file()
+                
+    # This function is used to write a snapshot of the catalog to the csv file and empty the change log.
+    # Only copying the quantities and swapping the change log for an empty one happen under the stripe locks,
+    # the snapshot is written while the trades carry on
+    @classmethod
+    def save_to_file(cls):
+        with cls.compaction_lock:
+            with cls.locks.hold_all():
+                # the records still waiting for their group commit have to reach the log before it is swapped
+                cls.committer.flush()
+                rows = [(stock.name, stock.price, stock.quantity) for stock in cls.catalog.values()]
                 
-    # This function is used to write the updated data to the csv file as mentioned in the description
-    def save_to_file(self):
-        with self.lock:           
-            # the data in the csv is overwritten with the latest changes in the memory_data
-            with open(disk_file, 'w', newline = '') as file:
-                write = csv.DictWriter(file, fieldnames = ['name', 'price', 'quantity'])
-                write.writeheader()
+                # the old log holds every change of the copied rows, new changes go to an empty log
+                with cls.change_log_lock:
+                    cls.change_log.close()
+                    if os.path.exists(old_change_log_file):
+                        # left behind by an interrupted compaction, it is still needed until the snapshot is written,
+                        # so the current log is appended to it
+                        with open(old_change_log_file, 'ab') as old_log, open(change_log_file, 'rb') as current_log:
+                            shutil.copyfileobj(current_log, old_log)
+                            old_log.flush()
+                            os.fsync(old_log.fileno())
+                        cls.change_log = open(change_log_file, 'wb')
+                    else:
+                        os.replace(change_log_file, old_change_log_file)
+                        cls.change_log = open(change_log_file, 'ab')
+                    cls.change_log_records = 0
             
-                for stock in self.memory_data:
-                    write.writerow(stock)
+            # the snapshot is written to a temporary file first and renamed over the csv, so a crash never leaves a half written catalog
+            temp_file = disk_file + ".tmp"
+            with open(temp_file, 'w', newline = '') as file:
+                write = csv.writer(file)
+                write.writerow(['name', 'price', 'quantity'])
+            
+                for row in rows:
+                    write.writerow(row)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, disk_file)
+            
+            # every change of the old log is now part of the snapshot. Had a crash left it behind, replaying it on top
+            # of the new snapshot would be harmless as its last record of every stock is the quantity in the snapshot
+            os.remove(old_change_log_file)
+
+    # function to send a json response back to the caller
+    def send_json(self, status, body):
+        answer = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-length", len(answer))
+        self.end_headers()
+        self.wfile.write(answer)
                 
     # this function is for the LookUp requests from the front-end service
     def do_GET(self):
@@ -58,27 +303,24 @@ class Service(BaseHTTPRequestHandler):
         # verifies that the path of the front-end service is correct
         if self.path.startswith("/lookup/"):
             stock_name = self.path.split("/lookup/")[1]
+            request_response = None
+            
+            # the stripe of the stock is held only for copying the values out of the index, the response is written after releasing it
+            with self.locks.stripe(stock_name):
+                stock = self.catalog.get(stock_name)
+                if stock is not None:
+                    request_response = {
+                        "name" : stock.name,
+                        "price" : stock.price,
+                        "quantity" : stock.quantity,
+                        "version" : stock.version
+                    }
             
-            # a read lock for every read request
-            with self.lock:            
-                for data in self.memory_data:
-                                       
-                    # checks if the name in the request is valid and returns the response if it is 
-                    if data["name"] == stock_name:
-                        request_response = {
-                            "name" : data["name"],
-                            "price" : data["price"],
-                            "quantity" : data["quantity"]
-                        }
-                        
-                        # successful response sent back to front-end service
-                        
-                        final_response = json.dumps({"data" : request_response})
-                        self.send_response(200)
-                        self.send_header("Content-type", "application/json")
-                        self.end_headers()
-                        self.wfile.write(final_response.encode("utf-8"))
-                        return
+            # checks if the name in the request is valid and returns the response if it is 
+            if request_response is not None:
+                # successful response sent back to front-end service
+                self.send_json(200, {"data" : request_response})
+                return
                    
             # error message for invalid stock name 
             fail_response = {
@@ -87,15 +329,60 @@ class Service(BaseHTTPRequestHandler):
             }
             
             # error message sent to the front-end service
-            final_message = json.dumps({"error" : fail_response})
-            self.send_response(404)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(final_message.encode("utf-8"))
+            self.send_json(404, {"error" : fail_response})
+            return
+        
+        # batch lookup of the comma separated stock names, all of them are copied out under one acquisition of their stripes
+        if self.path.startswith("/lookup?"):
+            names = [name for name in parse_qs(urlsplit(self.path).query).get("names", [""])[0].split(",") if name]
+            results = []
+            with self.locks.hold(names):
+                for name in names:
+                    stock = self.catalog.get(name)
+                    if stock is None:
+                        results.append({"name" : name, "error" : {"code" : 404, "message" : "stock not found"}})
+                    else:
+                        results.append({"name" : stock.name, "price" : stock.price, "quantity" : stock.quantity,
+                                        "version" : stock.version})
+            self.send_json(200, {"data" : results})
+            return
+
+        # request, lock and persistence metrics in the Prometheus text format
+        if self.path == "/metrics":
+            self.send_metrics()
+            return
+        
+        # queue depth and wait times of the worker pool, when the service runs with SERVER_MODE=pool
+        if self.path == "/pool_stats" and hasattr(self.server, "pool_stats"):
+            self.send_json(200, {"data" : self.server.pool_stats()})
+            return
+        
+        # unknown paths get an explicit error so that persistent connections are not left waiting
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
              
     # this function is for the trade requests from the order service
     def do_POST(self):
         
+        # a batch of trades is applied under one acquisition of the lock and logged as one change log record,
+        # every trade gets its own status in the response
+        if self.path == "/trade_batch":
+            length = int(self.headers.get('Content-Length'))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict) or not isinstance(request.get("trades"), list):
+                self.send_json(400, {"error" : {"code" : 400, "message" : "trades must be a list"}})
+                return
+            
+            results, ticket = self.apply_trades(request["trades"])
+            self.maybe_compact()
+            
+            # the trades are only acknowledged once their change log record is durable
+            if ticket is not None:
+                with tracing.span("persist"):
+                    self.committer.wait(ticket)
+            
+            self.send_json(200, {"data" : results})
+            return
+        
         # checks the path to the order service
         if self.path.startswith("/trade"):
             
@@ -105,104 +392,137 @@ class Service(BaseHTTPRequestHandler):
             request = json.loads(post_body.decode('utf-8'))
             
             # the 3 components of the trade request are mentioned
-            name = request["name"]
-            trade = request["type"]
-            quantity = request["quantity"]
+            try:
+                name = request["name"]
+                trade = request["type"]
+                quantity = request["quantity"]
+            except (KeyError, TypeError):
+                self.send_json(400, {"error" : {"code" : 400, "message" : "malformed trade"}})
+                return
             
-            # a write lock that only happens with a single writer
-            with self.lock:                      
-                for data in self.memory_data:
-                    
-                    # only works if the stock name is valid
-                    if data["name"] == name:
-                        current_volume = int(data["quantity"])
-                    
-                        # if the request is to sell, then the quantity is incremented and the response is sent along with with an empty json object
-                        if trade == "sell":
-                            new_volume = current_volume + quantity
-                            data["quantity"] = str(new_volume)
-                            self.save_to_file()
-                            right_response = {
-                                "message" : "successfully sold",
-                            }
-                            
-                            if enable_cache:
-                                # invalidation request sent to front end
-                                requests.post(f"http://{front_host}:{front_port}/invalidate_cache", json={"name": name})
-                             
-                            answer = json.dumps({"data" : right_response}).encode("utf-8")
-                            response_content_length = len(answer)
-                            self.send_response(200)
-                            self.send_header("Content-type", "application/json")
-                            self.send_header("Content-length", response_content_length)
-                            self.end_headers()
-                            self.wfile.write(answer)
-                            return
-                        
-                        # This is for a buy trade
-                        elif trade == "buy":
-                            
-                            # if the current quantity is lesser than the quantity requested to be bought. An error response is sent 
-                            if current_volume < quantity:
-                                incorrect_response = {
-                                    "code" : 400,
-                                    "message" : "Insufficient quantity",
-                                }
-                                                           
-                                final = json.dumps({"error" : incorrect_response})
-                                self.send_response(400)
-                                self.send_header("Content-type", "application/json")
-                                self.end_headers()
-                                self.wfile.write(final.encode("utf-8"))
-                                return
-                        
-                           # otherwise the trade is successful and the quantity sold is decremented and the right response is sent. An empty json object is sent
-                            else:
-                                new_volume = current_volume - quantity
-                                data["quantity"] = str(new_volume)
-                                self.save_to_file()
-                                right_response = {
-                                    "message" : "successfully bought",
-                                }
-                                
-                                if enable_cache:
-                                    # invalidation request sent to front end
-                                    requests.post(f"http://{front_host}:{front_port}/invalidate_cache", json={"name": name})
-                                    
-                                answer = json.dumps({"data" : right_response})
-                                self.send_response(200)
-                                self.send_header("Content-type", "application/json")
-                                self.end_headers()
-                                self.wfile.write(answer.encode("utf-8"))
-                                return
-                                          
-            # this is sent if an incorrect stock name is specified
-            invalid_response = {
-                "code" : 404,
-                "message" : "stock not found",
-            }
+            status, body, ticket = self.apply_trade(name, trade, quantity)
+            self.maybe_compact()
             
-            result = json.dumps({"error" : invalid_response})
+            # the trade is only acknowledged once its change log record is durable
+            with tracing.span("persist"):
+                self.committer.wait(ticket)
             
-            self.send_response(404)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(result.encode("utf-8"))
+            self.send_json(status, body)
             return
+        
+        # unknown paths get an explicit error so that persistent connections are not left waiting
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
+
+    # called under the stripe locks after stocks changed: bumps their versions, queues their change log record and the
+    # front-end invalidations, and returns the change log ticket
+    def record_changes(self, stocks):
+        for stock in stocks:
+            stock.version = next_version()
+            if enable_cache:
+                invalidation_dispatcher.invalidate(stock.name, stock.version)
+        return self.log_changes(stocks)
+
+    # applies a single buy or sell to the catalog and returns the status code, the response body and the change log ticket
+    def apply_trade(self, name, trade, quantity):
+        # only trades on stocks of the same stripe wait for each other
+        with self.locks.stripe(name):
+            status, body, stock = self.trade_stock(name, trade, quantity)
+            ticket = self.record_changes([stock]) if stock is not None else None
+        return status, body, ticket
+
+    # applies a list of trades under one acquisition of the stripes of their stocks and returns the result of every trade,
+    # as a dictionary with its status code, and the change log ticket of the successful ones
+    def apply_trades(self, trades):
+        results = []
+        changed = []
+        # an item that is not a trade object gets its own 400 below, it has no stripe to lock
+        names = [trade["name"] for trade in trades if isinstance(trade, dict) and isinstance(trade.get("name"), str)]
+        with self.locks.hold(names):
+            for trade in trades:
+                try:
+                    if not isinstance(trade, dict):
+                        raise TypeError("trade is not an object")
+                    status, body, stock = self.trade_stock(trade["name"], trade["type"], trade["quantity"])
+                except (KeyError, TypeError, ValueError):
+                    status, body, stock = 400, {"error" : {"code" : 400, "message" : "malformed trade"}}, None
+                body["status"] = status
+                results.append(body)
+                if stock is not None:
+                    changed.append(stock)
+            ticket = self.record_changes(changed) if changed else None
+        return results, ticket
+
+    # applies a buy or sell to the in-memory catalog, the caller holds the stripe of the stock. Returns the status code,
+    # the response body and the changed stock, None when the trade failed
+    def trade_stock(self, name, trade, quantity):
+        # the quantity ends up in the change log, anything but a positive integer is rejected before the stock changes
+        # (bool is an int subclass, true is not a quantity either). The order services keep 64-bit quantities
+        if type(quantity) is not int or not 0 < quantity <= max_quantity:
+            return 400, {"error" : {"code" : 400, "message" : "quantity must be a positive integer"}}, None
+        
+        stock = self.catalog.get(name)
+        
+        # only works if the stock name is valid
+        if stock is not None:
+            # if the request is to sell, then the quantity is incremented
+            if trade == "sell":
+                stock.quantity += quantity
+                return 200, {"data" : {"message" : "successfully sold"}}, stock
+                
+            # This is for a buy trade
+            elif trade == "buy":
+                
+                # if the current quantity is lesser than the quantity requested to be bought. An error response is sent 
+                if stock.quantity < quantity:
+                    incorrect_response = {
+                        "code" : 400,
+                        "message" : "Insufficient quantity",
+                    }
+                    return 400, {"error" : incorrect_response}, None
+                
+                # otherwise the trade is successful and the quantity sold is decremented
+                stock.quantity -= quantity
+                return 200, {"data" : {"message" : "successfully bought"}}, stock
+                                          
+        # this is sent if an incorrect stock name is specified
+        invalid_response = {
+            "code" : 404,
+            "message" : "stock not found",
+        }
+        return 404, {"error" : invalid_response}, None
+
+# the change log writes are group committed according to the FSYNC_POLICY environment variables
+Service.committer = GroupCommitter(Service.write_changes, Service.sync_changes, name="catalog_changes", **policy_from_env())
+
+# invalidations are only sent when the front-end caches lookups
+invalidation_dispatcher = None
+if enable_cache:
+    invalidation_dispatcher = InvalidationDispatcher(get_pool("frontend", front_host, front_port), invalidation_batch_size)
                     
 # this class is created for employing threads to handle multiple requests. ThreadingMinIn creates a thread for every request
 class Server_with_threads(socketserver.ThreadingMixIn, HTTPServer):
     daemon_threads = True
 
+# this class serves the requests with a fixed number of worker threads and a bounded queue, overloads get a 503
+class Server_with_pool(WorkerPoolMixIn, HTTPServer):
+    pass
+
 if __name__ == "__main__":
     
+    # the changes replayed at startup are folded into the snapshot before serving requests
+    if Service.change_log_records:
+        Service.save_to_file()
+    
     # the server is started and the message is printed to acknowledge
-    server = Server_with_threads((hostName, PORT), Service)
-    print("Catalog service started http://%s:%s" % (hostName, PORT))
+    # SERVER_MODE selects between a thread per connection and the bounded worker pool
+    server_class = Server_with_pool if server_mode == "pool" else Server_with_threads
+    server = server_class((hostName, PORT), Service)
+    log.info("Catalog service started http://%s:%s", hostName, PORT)
     
     try:
         server.serve_forever()
         
     # the server is stopped by pressing any key
     except KeyboardInterrupt:
+        Service.save_to_file()
         server.shutdown()
\ No newline at end of file
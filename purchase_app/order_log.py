@@ -0,0 +1,593 @@
+import bisect
+import csv
+import os
+import struct
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+
+from common.log import get_logger
+
+log = get_logger("order_log")
+
+# The order log of an order service instance is a directory of append-only segment files. Every segment holds up to
+# segment_records orders, one per line as "transaction number,name,order type,quantity", and is named after the
+# transaction number of its first order, so the segments sort in log order. New orders are only ever appended to
+# the last (active) segment, a full segment is fsynced, closed and never written again.
+#
+# Every segment has a sparse index: the transaction number and byte offset of every index_stride-th order, so an
+# order is found by reading a single block of index_stride lines. A sealed segment keeps its index in an .idx file
+# next to it, so the service does not have to read the whole log at startup.
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+# index_stride, number of orders, length in bytes and last transaction number of a segment
+INDEX_HEADER = struct.Struct("<qqqq")
+
+# A snapshot holds the orders of a log up to a transaction number in a compact binary file: a header with the last
+# transaction number and the number of orders, one fixed size record per order with the names and order types
+# replaced by their position in a string table, the string table and a crc32 of everything after the header.
+SNAPSHOT_MAGIC = b"ORDSNAP3"
+SNAPSHOT_HEADER = struct.Struct("<8sqq")
+SNAPSHOT_RECORD = struct.Struct("<qHHq")
+SNAPSHOT_STRING_LENGTH = struct.Struct("<H")
+SNAPSHOT_TRAILER = struct.Struct("<I")
+# orders read or written per chunk of a snapshot
+SNAPSHOT_CHUNK = 4096
+
+
+# the largest transaction number and quantity the snapshots and the in-memory orders hold (64-bit signed integers),
+# and the number of distinct names and order types they can tell apart (16-bit ids)
+MAX_QUANTITY = 2 ** 63 - 1
+MAX_STRINGS = 1 << 16
+
+
+def encode_order(order):
+    # the line written to a segment for an order
+    return (f"{order['Transaction number']},{order['name']},{order['order type']},{order['quantity']}\n").encode("utf-8")
+
+
+def decode_order(line):
+    # the order stored in a segment line, raises ValueError for a malformed line.
+    # The name is in the middle so it is split off from both ends
+    txn, rest = line.decode("utf-8").rstrip("\n").split(",", 1)
+    name, order_type, quantity = rest.rsplit(",", 2)
+    return {
+        'Transaction number' : int(txn),
+        'name' : name,
+        'order type' : order_type,
+        'quantity' : int(quantity),
+    }
+
+
+def segment_name(first_txn):
+    return f"{first_txn:020d}{SEGMENT_SUFFIX}"
+
+
+class CompactOrders:
+    """Orders kept in memory as parallel arrays instead of a dict per order.
+
+    Names and order types are interned in a string table, so an order takes about 20 bytes instead of several
+    hundred. Indexing returns the order as a dict, like the rows of the csv the service used to keep.
+    """
+
+    def __init__(self):
+        self.txns = array('q')
+        self.names = array('H')
+        self.types = array('H')
+        self.quantities = array('q')
+        self.strings = []
+        self.string_ids = {}
+
+    def intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            if len(self.strings) >= MAX_STRINGS:
+                raise ValueError(f"more than {MAX_STRINGS} distinct names and order types")
+            string_id = self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def append(self, order):
+        # every column is checked before the first one is appended, an order that does not fit must not leave the
+        # arrays out of step
+        txn = order['Transaction number']
+        quantity = order['quantity']
+        if not -MAX_QUANTITY <= txn <= MAX_QUANTITY or not -MAX_QUANTITY <= quantity <= MAX_QUANTITY:
+            raise ValueError(f"order {txn} does not fit in 64 bits")
+        name_id = self.intern(order['name'])
+        type_id = self.intern(order['order type'])
+        self.txns.append(txn)
+        self.names.append(name_id)
+        self.types.append(type_id)
+        self.quantities.append(quantity)
+
+    def extend(self, orders):
+        for order in orders:
+            self.append(order)
+
+    def __len__(self):
+        return len(self.txns)
+
+    def __getitem__(self, position):
+        return {
+            'Transaction number' : self.txns[position],
+            'name' : self.strings[self.names[position]],
+            'order type' : self.strings[self.types[position]],
+            'quantity' : self.quantities[position],
+        }
+
+    def slice(self, start, end=None):
+        return [self[position] for position in range(*slice(start, end).indices(len(self.txns)))]
+
+    def first_txn(self):
+        return self.txns[0] if self.txns else None
+
+    def first_after(self, txn):
+        # the position of the first order after the given transaction number, 0 for None
+        return 0 if txn is None else bisect.bisect_right(self.txns, txn)
+
+    def last_txn(self):
+        return self.txns[-1] if self.txns else None
+
+    def position(self, txn):
+        # Transaction numbers are dense and increasing, so the position of an order is its offset from the first one.
+        # The offset is verified and a binary search covers a window that has gaps
+        if not self.txns:
+            return None
+        position = txn - self.txns[0]
+        if 0 <= position < len(self.txns) and self.txns[position] == txn:
+            return position
+        position = bisect.bisect_left(self.txns, txn)
+        if position < len(self.txns) and self.txns[position] == txn:
+            return position
+        return None
+
+    def drop_oldest(self, count):
+        del self.txns[:count]
+        del self.names[:count]
+        del self.types[:count]
+        del self.quantities[:count]
+
+
+class Segment:
+    """One segment file and its sparse index."""
+
+    def __init__(self, path, first_txn):
+        self.path = path
+        self.first_txn = first_txn
+        self.last_txn = None
+        self.records = 0
+        self.size = 0
+        # transaction number and byte offset of every index_stride-th order
+        self.txns = array('q')
+        self.offsets = array('q')
+
+    @property
+    def index_path(self):
+        return self.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+    def add(self, txn, length, index_stride):
+        if self.records % index_stride == 0:
+            self.txns.append(txn)
+            self.offsets.append(self.size)
+        self.records += 1
+        self.size += length
+        self.last_txn = txn
+
+    def save_index(self, index_stride):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(INDEX_HEADER.pack(index_stride, self.records, self.size, self.last_txn))
+            file.write(self.txns.tobytes())
+            file.write(self.offsets.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.index_path)
+
+    def load_index(self, index_stride):
+        # reads the index file of a sealed segment, False when it is missing, stale or built with another stride
+        try:
+            with open(self.index_path, 'rb') as file:
+                data = file.read()
+            stride, records, size, last_txn = INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return False
+        entries = (records + index_stride - 1) // index_stride
+        if (stride != index_stride or size != os.path.getsize(self.path)
+                or len(data) != INDEX_HEADER.size + entries * 16):
+            return False
+        self.txns = array('q', data[INDEX_HEADER.size:INDEX_HEADER.size + entries * 8])
+        self.offsets = array('q', data[INDEX_HEADER.size + entries * 8:])
+        self.records, self.size, self.last_txn = records, size, last_txn
+        return True
+
+
+class OrderLog:
+    """Append-only segmented order log with indexed reads.
+
+    recover() loads the segment indexes at startup, cuts off a torn record left at the end of the active segment
+    by a crash in the middle of a write and returns the newest orders. append() and sync() are called by the
+    group committer, which serializes them. read() and iter_orders() serve the orders that are no longer kept
+    in memory, read() through a small LRU cache of blocks.
+    """
+
+    def __init__(self, directory, segment_records, index_stride=256, cache_blocks=64):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.index_stride = index_stride
+        self.cache_blocks = cache_blocks
+        self.active = None
+        self.segment_list = []
+        self.first_txns = []
+        # guards the segment list and indexes for the readers, the writes themselves are serialized by the committer
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def active_segment(self):
+        return self.segment_list[-1] if self.segment_list else None
+
+    @property
+    def first_txn(self):
+        with self.lock:
+            return self.first_txns[0] if self.first_txns else None
+
+    @property
+    def last_txn(self):
+        # the last transaction number written to the log
+        segment = self.active_segment
+        return segment.last_txn if segment is not None else None
+
+    @property
+    def records(self):
+        return sum(segment.records for segment in self.segment_list)
+
+    def segments(self):
+        # the paths of the segment files in log order
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def recover(self, hot_orders):
+        # indexes every segment, opens the last one for appending and returns an iterator over the newest hot_orders
+        # orders (all of them for 0)
+        paths = self.segments()
+        for position, path in enumerate(paths):
+            segment = Segment(path, int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)]))
+            is_active = position == len(paths) - 1
+            if is_active or not segment.load_index(self.index_stride):
+                self.scan_segment(segment, is_active)
+                if is_active:
+                    # drop the torn tail so that new records are not glued to it
+                    if os.path.getsize(path) != segment.size:
+                        log.warning("Truncating torn tail of %s at byte %s", path, segment.size)
+                        with open(path, 'r+b') as file:
+                            file.truncate(segment.size)
+                            os.fsync(file.fileno())
+                elif segment.records:
+                    segment.save_index(self.index_stride)
+            if segment.records or is_active:
+                self.segment_list.append(segment)
+                self.first_txns.append(segment.first_txn)
+        if self.segment_list:
+            self.active = open(self.active_segment.path, 'ab')
+
+        # only the segments that hold the newest orders are read
+        start = len(self.segment_list)
+        remaining = hot_orders or self.records
+        while start > 0 and remaining > 0:
+            start -= 1
+            remaining -= self.segment_list[start].records
+        return self.replay(self.segment_list[start:], skip=-remaining)
+
+    def replay(self, segments, skip):
+        # yields the orders of the segments after skipping the first skip of them, one segment in memory at a time
+        last_txn = None
+        for segment in segments:
+            for order in self.read_range(segment, 0, segment.size):
+                # an order replayed twice (a resync that raced a crash) is only kept once
+                if last_txn is not None and order['Transaction number'] <= last_txn:
+                    continue
+                last_txn = order['Transaction number']
+                if skip > 0:
+                    skip -= 1
+                    continue
+                yield order
+
+    def scan_segment(self, segment, is_active):
+        # reads a segment line by line to build its index, stopping at the first torn or malformed record
+        with open(segment.path, 'rb') as file:
+            for line in file:
+                try:
+                    # a record without the trailing newline was torn by a crash in the middle of the write
+                    if not line.endswith(b"\n"):
+                        raise ValueError("record without a newline")
+                    order = decode_order(line)
+                except ValueError:
+                    if is_active:
+                        break
+                    # only the active segment is ever written to, a bad record in a sealed one is real corruption
+                    raise ValueError(f"corrupt record at byte {segment.size} of sealed segment {segment.path}")
+                if segment.last_txn is None or order['Transaction number'] > segment.last_txn:
+                    segment.add(order['Transaction number'], len(line), self.index_stride)
+                else:
+                    # a duplicate is skipped by the readers but its bytes still belong to the segment
+                    segment.size += len(line)
+
+    def import_csv(self, filepath):
+        # one time migration of an order log csv written by earlier versions of the service
+        with open(filepath, 'r', encoding = 'utf-8-sig') as file:
+            orders = [
+                {
+                    'Transaction number' : int(row['Transaction number']),
+                    'name' : row['name'],
+                    'order type' : row['order type'],
+                    'quantity' : int(row['quantity']),
+                }
+                for row in csv.DictReader(file)
+            ]
+        if orders:
+            log.info("Importing %s orders from %s", len(orders), filepath)
+            self.append(orders)
+            self.close()
+            # recover() indexes the written segments again
+            self.segment_list = []
+            self.first_txns = []
+        return len(orders)
+
+    def append(self, orders):
+        # writes the orders to the active segment, starting a new segment whenever the active one is full.
+        # The index only takes the orders once they are flushed, so a reader never sees an order it cannot read
+        start = 0
+        while start < len(orders):
+            segment = self.active_segment
+            if self.active is None or segment.records >= self.segment_records:
+                self.roll(orders[start]['Transaction number'])
+                segment = self.active_segment
+            end = min(len(orders), start + self.segment_records - segment.records)
+            lines = [encode_order(order) for order in orders[start:end]]
+            self.active.write(b"".join(lines))
+            self.active.flush()
+            with self.lock:
+                for order, line in zip(orders[start:end], lines):
+                    segment.add(order['Transaction number'], len(line), self.index_stride)
+            start = end
+
+    def roll(self, first_txn):
+        # seals the active segment and opens a new one that starts at first_txn
+        if self.active is not None:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            with self.lock:
+                self.active.close()
+                self.active = None
+            if self.active_segment.records:
+                self.active_segment.save_index(self.index_stride)
+        path = os.path.join(self.directory, segment_name(first_txn))
+        active = open(path, 'ab')
+        with self.lock:
+            self.active = active
+            self.segment_list.append(Segment(path, first_txn))
+            self.first_txns.append(first_txn)
+        # the directory entry of the new segment has to be durable as well
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def sync(self):
+        # makes the appended orders durable. It may run while orders are appended: the fsync is done on a duplicate of
+        # the descriptor, so a roll closing the segment meanwhile (after fsyncing it) does not break it
+        with self.lock:
+            if self.active is None:
+                return
+            fd = os.dup(self.active.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self.active is not None:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            with self.lock:
+                self.active.close()
+                self.active = None
+
+    def locate(self, txn):
+        # the segment and block that hold an order, or None when the log has no such transaction number
+        with self.lock:
+            position = bisect.bisect_right(self.first_txns, txn) - 1
+            if position < 0:
+                return None
+            segment = self.segment_list[position]
+            if segment.last_txn is None or txn > segment.last_txn:
+                return None
+            return segment, bisect.bisect_right(segment.txns, txn) - 1
+
+    def block_bounds(self, segment, block):
+        # byte range of a block and whether it is complete, the last block of the active segment may still grow
+        with self.lock:
+            start = segment.offsets[block]
+            if block + 1 < len(segment.offsets):
+                return start, segment.offsets[block + 1], True
+            return start, segment.size, segment is not self.active_segment
+
+    def read_range(self, segment, start, end):
+        with open(segment.path, 'rb') as file:
+            file.seek(start)
+            data = file.read(end - start)
+        return [decode_order(line) for line in data.splitlines(keepends=True)]
+
+    def read_block(self, segment, block, use_cache=True):
+        key = (segment.first_txn, block)
+        if use_cache:
+            with self.cache_lock:
+                orders = self.cache.get(key)
+                if orders is not None:
+                    self.cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return orders
+                self.cache_misses += 1
+        start, end, complete = self.block_bounds(segment, block)
+        orders = self.read_range(segment, start, end)
+        if use_cache and complete:
+            with self.cache_lock:
+                self.cache[key] = orders
+                while len(self.cache) > self.cache_blocks:
+                    self.cache.popitem(last=False)
+        return orders
+
+    def read(self, txn):
+        # the order with the given transaction number read from disk, or None
+        located = self.locate(txn)
+        if located is None:
+            return None
+        for order in self.read_block(*located):
+            if order['Transaction number'] == txn:
+                return order
+        return None
+
+    def iter_orders(self, start_txn=None, upto_txn=None):
+        # yields the orders from start_txn (the first one when None) up to upto_txn (the last written one when None).
+        # Bulk reads bypass the cache so they do not evict the blocks that the queries keep hitting
+        if upto_txn is None:
+            upto_txn = self.last_txn
+        if upto_txn is None:
+            return
+        with self.lock:
+            if start_txn is None:
+                start_txn = self.first_txns[0]
+            segments = list(self.segment_list)
+        position = max(0, bisect.bisect_right([segment.first_txn for segment in segments], start_txn) - 1)
+        for segment in segments[position:]:
+            with self.lock:
+                blocks = len(segment.offsets)
+            first_block = max(0, bisect.bisect_right(segment.txns, start_txn) - 1) if segment.txns else 0
+            previous_txn = None
+            for block in range(first_block, blocks):
+                for order in self.read_block(segment, block, use_cache=False):
+                    txn = order['Transaction number']
+                    if txn > upto_txn:
+                        return
+                    if txn >= start_txn and (previous_txn is None or txn > previous_txn):
+                        previous_txn = txn
+                        yield order
+
+    def cache_stats(self):
+        with self.cache_lock:
+            return {"blocks" : len(self.cache), "capacity" : self.cache_blocks,
+                    "hits" : self.cache_hits, "misses" : self.cache_misses}
+
+
+def write_snapshot(path, orders):
+    # writes the orders of an iterable as a snapshot and returns the last transaction number and the number of orders
+    # in it. The file is written next to the old snapshot and renamed over it once it is complete
+    strings = {}
+    last_txn = None
+    count = 0
+    crc = 0
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            # the header is filled in once the orders are counted
+            file.write(bytes(SNAPSHOT_HEADER.size))
+            batch = bytearray()
+            for order in orders:
+                name_id = strings.setdefault(order['name'], len(strings))
+                type_id = strings.setdefault(order['order type'], len(strings))
+                last_txn = order['Transaction number']
+                batch += SNAPSHOT_RECORD.pack(last_txn, name_id, type_id, order['quantity'])
+                count += 1
+                if count % SNAPSHOT_CHUNK == 0:
+                    file.write(batch)
+                    crc = zlib.crc32(batch, crc)
+                    batch = bytearray()
+            batch += SNAPSHOT_STRING_LENGTH.pack(len(strings))
+            for string in strings:
+                encoded = string.encode("utf-8")
+                batch += SNAPSHOT_STRING_LENGTH.pack(len(encoded)) + encoded
+            file.write(batch)
+            crc = zlib.crc32(batch, crc)
+            file.write(SNAPSHOT_TRAILER.pack(crc))
+            file.seek(0)
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, last_txn if last_txn is not None else -1, count))
+            file.flush()
+            os.fsync(file.fileno())
+    except struct.error as error:
+        # an order that does not fit in its record, the old snapshot stays in place
+        os.remove(temp_path)
+        raise ValueError(f"order {last_txn} cannot be written to a snapshot: {error}") from error
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+    return last_txn, count
+
+
+def read_snapshot(path):
+    # checks a snapshot and returns its last transaction number, its number of orders and an iterator over the orders,
+    # which are read from the file a chunk at a time. Raises ValueError for a damaged file
+    file = open(path, 'rb')
+    try:
+        magic, last_txn, count = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an order snapshot")
+        size = os.fstat(file.fileno()).st_size
+        records_end = SNAPSHOT_HEADER.size + count * SNAPSHOT_RECORD.size
+        if size < records_end + SNAPSHOT_STRING_LENGTH.size + SNAPSHOT_TRAILER.size:
+            raise ValueError(f"snapshot {path} is truncated")
+        crc = 0
+        remaining = size - SNAPSHOT_HEADER.size - SNAPSHOT_TRAILER.size
+        while remaining:
+            data = file.read(min(remaining, 1 << 20))
+            crc = zlib.crc32(data, crc)
+            remaining -= len(data)
+        if SNAPSHOT_TRAILER.unpack(file.read(SNAPSHOT_TRAILER.size))[0] != crc:
+            raise ValueError(f"snapshot {path} fails its checksum")
+
+        file.seek(records_end)
+        (string_count,) = SNAPSHOT_STRING_LENGTH.unpack(file.read(SNAPSHOT_STRING_LENGTH.size))
+        strings = []
+        for _ in range(string_count):
+            (length,) = SNAPSHOT_STRING_LENGTH.unpack(file.read(SNAPSHOT_STRING_LENGTH.size))
+            strings.append(file.read(length).decode("utf-8"))
+    except (OSError, struct.error) as error:
+        file.close()
+        raise ValueError(f"snapshot {path} cannot be read: {error}") from error
+    except ValueError:
+        file.close()
+        raise
+
+    def orders():
+        with file:
+            file.seek(SNAPSHOT_HEADER.size)
+            for start in range(0, count, SNAPSHOT_CHUNK):
+                data = file.read(min(SNAPSHOT_CHUNK, count - start) * SNAPSHOT_RECORD.size)
+                for txn, name_id, type_id, quantity in SNAPSHOT_RECORD.iter_unpack(data):
+                    yield {
+                        'Transaction number' : txn,
+                        'name' : strings[name_id],
+                        'order type' : strings[type_id],
+                        'quantity' : quantity,
+                    }
+
+    return (last_txn if count else None), count, orders()
+
+
+def snapshot_last_txn(path):
+    # the last transaction number of an existing snapshot, None when there is no readable snapshot
+    try:
+        with open(path, 'rb') as file:
+            magic, last_txn, count = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return last_txn if magic == SNAPSHOT_MAGIC and count else None
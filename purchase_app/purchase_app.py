@@ -1,14 +1,32 @@
-import csv
 import http.server
 import socketserver
 import json
 import threading
 import os
-import requests
 import argparse
 import re
+import sys
+import itertools
+import shutil
+import time
 from threading import Lock
-from queue import Queue
+from queue import Queue, Empty
+
+import requests
+
+# the helpers shared by all the services live in the common package at the root of the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.group_commit import GroupCommitter, policy_from_env
+from common.log import LoggingHandlerMixIn, get_logger
+from common.http_pool import get_pool, connect_timeout
+from common import tracing
+from common.metrics import MetricsHandlerMixIn, TimedLock
+from common.tracing import TracingHandlerMixIn
+from common.pooled_server import PooledRequestHandlerMixIn, WorkerPoolMixIn, server_mode
+from order_log import CompactOrders, OrderLog, MAX_QUANTITY, write_snapshot, read_snapshot, snapshot_last_txn
+
+# the level of its messages is set with LOG_LEVEL or LOG_LEVELS=purchase_app=<level>
+log = get_logger("purchase_app")
 
 
 hostName = None
@@ -25,97 +43,518 @@ LEADER_PORT = None
 
 # initialize transaction number counter to 0
 txn_num = 0
-# list of order logs
-memory_data = []
-lock = Lock()
+# the hot window of the order log: the newest orders, kept in memory in a compact form
+memory_data = CompactOrders()
+# the wait for it is recorded as the order lock in the metrics
+lock = TimedLock("order")
+
+# the append-only order log of this instance, its writes are group committed according to FSYNC_POLICY
+order_log = None
+order_log_committer = None
+# number of orders per order log segment
+order_log_segment_records = int(os.getenv("ORDER_LOG_SEGMENT_RECORDS", "100000"))
+# number of newest orders kept in memory (0 keeps all of them), older ones are read from the order log segments
+hot_window_orders = int(os.getenv("HOT_WINDOW_ORDERS", "100000"))
+# every ORDER_INDEX_STRIDE-th order of a segment is indexed, a query for an older order reads one block of that many orders
+order_index_stride = int(os.getenv("ORDER_INDEX_STRIDE", "256"))
+# number of blocks of older orders kept in the read cache
+order_read_cache_blocks = int(os.getenv("ORDER_READ_CACHE_BLOCKS", "64"))
+
+# when the leader replies to a trade: async (without waiting for the followers), quorum (once a majority of all
+# the instances, the leader included, has the order) or all (once every follower acknowledged or failed)
+REPLICATION_ACK_POLICIES = ("async", "quorum", "all")
+replication_ack = os.getenv("REPLICATION_ACK", "all")
+if replication_ack not in REPLICATION_ACK_POLICIES:
+    raise ValueError(f"REPLICATION_ACK must be one of {REPLICATION_ACK_POLICIES}, got {replication_ack!r}")
+# seconds a follower gets to acknowledge an order before it counts as failed
+replication_timeout = float(os.getenv("REPLICATION_TIMEOUT_MS", "1000")) / 1000
+# most orders a replicator sends to a follower in one /updateOrderLogBatch request, 1 sends every order on its own
+# to /updateOrderLog
+replication_batch_max = int(os.getenv("REPLICATION_BATCH_MAX", "64"))
+# the followers apply the replicated orders one at a time
+replication_lock = Lock()
+# most orders the leader sends in one /syncOrderData chunk to a follower that is catching up
+sync_chunk_size = int(os.getenv("SYNC_CHUNK_SIZE", "1000"))
+# the leader snapshots its order log in the background after every SNAPSHOT_EVERY orders (0 only snapshots on demand)
+snapshot_every = int(os.getenv("SNAPSHOT_EVERY", "100000"))
+# a follower at least this many orders behind the leader bootstraps from the leader's snapshot before it fetches the tail
+snapshot_bootstrap_gap = int(os.getenv("SNAPSHOT_BOOTSTRAP_GAP", "10000"))
+# seconds a follower waits for the snapshot download, the leader may have to build the snapshot first
+snapshot_timeout = float(os.getenv("SNAPSHOT_TIMEOUT", "300"))
+order_snapshotter = None
+# orders a follower appends at a time while it bootstraps from a snapshot
+bootstrap_chunk_size = 10000
+
+# number of queries this instance answered and, as a follower, sent back because it had not caught up with the order yet
+query_stats_lock = Lock()
+queries_served = 0
+queries_behind = 0
 
 def append_to_memory_data(data):
-    # This appends the order details to the memory data in a thread safe manner
+    # This appends the order details to the memory data and queues them for the order log in a thread safe manner.
+    # Both happen under the same lock so the log order always matches the memory order. The returned ticket
+    # is waited for before the order is acknowledged
     global memory_data
-    print("Acquire lock")
-    lock.acquire()
-    memory_data.append(data)
-    lock.release()
+    log.debug("Acquire lock")
+    with lock:
+        memory_data.append(data)
+        ticket = order_log_committer.submit([data])
+        trim_memory_data()
+        return ticket
 
 def extend_memory_data(data_li):
-    # This extends the order details to the memory data in a thread safe manner
+    # This extends the order details to the memory data and queues them for the order log in a thread safe manner
     global memory_data
-    print("Acquire lock")
-    lock.acquire()
-    memory_data.extend(data_li)
-    lock.release()
-
-def search_txn_mem_data(txn_num_to_search):
-    # This returns the index of the transaction number to be searched in the memory data in a thread safe manner
-    follower_last_txn_index = None
-    lock.acquire()
-    print(f"Searching for transaction number {txn_num_to_search} in memory data")
-    for i in range(len(memory_data)):
-        mem_data_num = int(memory_data[i]["Transaction number"])
-        print(f"Comparing with txn number from mem data {mem_data_num}")
-        if int(txn_num_to_search) == int(mem_data_num):
-            follower_last_txn_index = i
-            break
-    lock.release()
-    return follower_last_txn_index
+    log.debug("Acquire lock")
+    with lock:
+        memory_data.extend(data_li)
+        ticket = order_log_committer.submit(data_li)
+        trim_memory_data()
+        return ticket
+
+def trim_memory_data():
+    # This drops the oldest orders from the memory data once it outgrows the hot window by a tenth. Only orders that
+    # were already written to the order log are dropped, the queries read them from there. The caller holds the lock
+    excess = len(memory_data) - hot_window_orders
+    if not hot_window_orders or excess < max(1, hot_window_orders // 10):
+        return
+    written = memory_data.first_after(order_log.last_txn)
+    if written:
+        memory_data.drop_oldest(min(excess, written))
+
+def add_new_order(name, order_type, quantity):
+    # This assigns the next transaction number to a new order and records it in one step, so that concurrent trades
+    # reach the memory data and the order log in transaction number order.
+    # Returns the order, the transaction number before it, the ticket of its log write and its replication round
+    global txn_num
+    with lock:
+        previous_transaction_num = memory_data.last_txn()
+        txn_num += 1
+        new_detail = {
+            'Transaction number' : txn_num,
+            'name' : name,
+            'order type' : order_type,
+            'quantity' : int(quantity)
+        }
+        memory_data.append(new_detail)
+        ticket = order_log_committer.submit([new_detail])
+        trim_memory_data()
+        # queued for the followers under the same lock, so every follower receives the orders in transaction order
+        replication_round = replicate(new_detail, previous_transaction_num)
+    log.debug("Transaction number: %s", new_detail['Transaction number'])
+    if snapshot_every and new_detail['Transaction number'] % snapshot_every == 0:
+        order_snapshotter.request()
+    return new_detail, previous_transaction_num, ticket, replication_round
+
+def add_new_orders(trades):
+    # Like add_new_order for a list of (name, order type, quantity) trades: they get consecutive transaction numbers and
+    # are recorded with one acquisition of the lock and one log write.
+    # Returns the orders, the ticket of their log write and their replication rounds
+    global txn_num
+    new_details = []
+    replication_rounds = []
+    with lock:
+        for name, order_type, quantity in trades:
+            previous_transaction_num = memory_data.last_txn()
+            txn_num += 1
+            new_detail = {
+                'Transaction number' : txn_num,
+                'name' : name,
+                'order type' : order_type,
+                'quantity' : int(quantity)
+            }
+            memory_data.append(new_detail)
+            new_details.append(new_detail)
+            replication_rounds.append(replicate(new_detail, previous_transaction_num))
+        ticket = order_log_committer.submit(new_details)
+        trim_memory_data()
+    if new_details:
+        log.debug("Transaction numbers: %s-%s", new_details[0]['Transaction number'], new_details[-1]['Transaction number'])
+        # a snapshot is due if the batch crossed a multiple of SNAPSHOT_EVERY
+        if snapshot_every and new_details[-1]['Transaction number'] // snapshot_every != \
+                (new_details[0]['Transaction number'] - 1) // snapshot_every:
+            order_snapshotter.request()
+    return new_details, ticket, replication_rounds
+
+def normalize_order(data):
+    # Orders are kept with integer transaction numbers and quantities, whether they come from the order log, a trade or the leader
+    return {
+        'Transaction number' : int(data['Transaction number']),
+        'name' : data['name'],
+        'order type' : data['order type'],
+        'quantity' : int(data['quantity']),
+    }
+
+def get_order(txn_num_to_search):
+    # This returns the order with the given transaction number, or None, in a thread safe manner.
+    # An order outside the hot window is read from the order log, outside the lock
+    with lock:
+        position = memory_data.position(txn_num_to_search)
+        if position is not None:
+            return memory_data[position]
+    return order_log.read(txn_num_to_search)
+
+def get_orders_after(last_txn, limit=None):
+    # This returns the orders (at most limit of them) that come after the given transaction number. A last_txn of None
+    # returns the orders from the start of the log, None is returned for an unknown transaction number.
+    # The orders that already left the hot window are read from the order log, outside the lock
+    orders = []
+    with lock:
+        if last_txn is None:
+            in_memory = memory_data.first_txn() == order_log.first_txn
+        else:
+            in_memory = memory_data.position(last_txn) is not None
+    if not in_memory:
+        if last_txn is not None and order_log.locate(last_txn) is None:
+            return None
+        orders = list(itertools.islice(order_log.iter_orders(None if last_txn is None else last_txn + 1), limit))
+        if limit is not None and len(orders) >= limit:
+            return orders
+    # the rest comes from the hot window, which also holds the orders that did not reach the log yet
+    after_txn = orders[-1]['Transaction number'] if orders else last_txn
+    with lock:
+        start = memory_data.first_after(after_txn)
+        orders.extend(memory_data.slice(start, None if limit is None else start + limit - len(orders)))
+    return orders
 
 
 def get_last_txn_number():
     # This gets the most recent transaction number from the memory data in a thread safe manner
-    global memory_data
-    lock.acquire()
-    if memory_data:
-        val = memory_data[-1]['Transaction number']
-        lock.release()
-        return val
-    else:
-        lock.release()
-        return None
+    with lock:
+        return memory_data.last_txn()
 
 def update_txn_number(updated_txn_num_val):
     # This updates the value of the transaction number counter in a thread safe manner
     global txn_num
-    print(f"Txn num is {txn_num}, updating it to {updated_txn_num_val}")
+    log.debug("Txn num is %s, updating it to %s", txn_num, updated_txn_num_val)
     lock.acquire()
     txn_num = int(updated_txn_num_val)
     lock.release()
     return
 
-def get_next_txn_number():
-    # This returns the transaction number to be assigned to the next incoming order in a thread safe manner 
-    global txn_num
-    lock.acquire()
-    txn_num += 1
-    lock.release()
-    return txn_num
-
-def write_mem_data_to_file(filepath):
-    # This writes the entire memory data to the order log file in a thread safe manner
-    if memory_data:
-        # a write lock is implemented which only one request can access at a time
-        lock.acquire()
-        with open(filepath, 'w', newline = '') as file:
-            write = csv.DictWriter(file, fieldnames=['Transaction number', 'name', 'order type', 'quantity'])
-            write.writeheader()
-            for detail in memory_data:
-                write.writerow(detail)
-        lock.release()
-
+def write_orders(records):
+    # This appends the orders of a batch to the order log, called by the group committer.
+    # Every record is the list of orders of one submit, so only the new orders are written
+    order_log.append([order for orders in records for order in orders])
+
+def sync_order_log():
+    # This makes the appended orders durable, called by the group committer
+    order_log.sync()
+
+def persist_orders(ticket):
+    # This returns once the orders behind the ticket are durable
+    with tracing.span("persist"):
+        order_log_committer.wait(ticket)
+
+
+def apply_replicated_orders(orders, leader_previous_txn_num, current_leader_details):
+    # This appends a range of consecutive orders of the leader to this follower. Continuity with the last order of the
+    # follower is checked once for the whole range, which is then persisted in one step. On a gap the follower
+    # catches up through /syncOrderData instead
+    with replication_lock:
+        last_txn = get_last_txn_number()
+        if last_txn is not None:
+            # the orders the follower already has, resent after a timeout or fetched by a resync, are applied only once
+            held = 0
+            while held < len(orders) and orders[held]['Transaction number'] <= last_txn:
+                held += 1
+            if held:
+                leader_previous_txn_num = orders[held - 1]['Transaction number']
+                orders = orders[held:]
+        if not orders:
+            return
+        consecutive = all(later['Transaction number'] == earlier['Transaction number'] + 1
+                          for earlier, later in zip(orders, orders[1:]))
+        # if there's no prev txn number then the range starts with the first txn
+        if consecutive and last_txn == leader_previous_txn_num:
+            persist_orders(extend_memory_data(orders))
+            update_txn_number(orders[-1]['Transaction number'])
+        else:
+            # If the last transaction number of the follower node and the leader node's previous transaction number
+            # do not match then it means the follower node had crashed and now its back alive and looking to sync its data.
+            log.info("Calling syncdata %s", INSTANCE_ID)
+            sync_with_leader(current_leader_details)
+
+def sync_with_leader(current_leader_details):
+    # This fetches every order after the last one of this follower from the leader and appends them to its order logs.
+    # The orders come in chunks of at most SYNC_CHUNK_SIZE that are persisted one by one, so memory stays bounded
+    # on both sides and an interrupted catch-up resumes from the last persisted order on the next attempt
+    global LEADER_ID
+    global LEADER_HOST
+    global LEADER_PORT
+    LEADER_HOST = current_leader_details["host"]
+    LEADER_PORT = current_leader_details["port"]
+    LEADER_ID = current_leader_details["instance_id"]
+    leader_pool = get_pool("order", LEADER_HOST, LEADER_PORT)
+    fetched = 0
+    tried_snapshot = False
+    while True:
+        # an empty log asks for the orders from the very first one
+        last_txn = {"last_txn": get_last_txn_number(), "limit": sync_chunk_size}
+        try:
+            resp = leader_pool.post("/syncOrderData", json=last_txn)
+        except requests.RequestException:
+            log.warning("Catch-up interrupted after %s orders, it resumes with the next replicated order", fetched)
+            return
+        if resp.status_code != 200:
+            log.warning("Catch-up failed after %s orders: %s %s", fetched, resp.status_code, resp.text)
+            return
+        missed = resp.json()
+        # a follower far behind the leader installs its snapshot first and then continues with the orders after it
+        leader_last_txn = missed.get("leader_last_txn")
+        if (not tried_snapshot and snapshot_bootstrap_gap and leader_last_txn is not None
+                and leader_last_txn - (last_txn["last_txn"] or 0) >= snapshot_bootstrap_gap):
+            tried_snapshot = True
+            if bootstrap_from_snapshot(leader_pool):
+                continue
+        all_missed_txns = [normalize_order(order) for order in missed["all_missed_txns"]]
+        # now append all the transactions that the follower node missed, into its order logs
+        if all_missed_txns:
+            persist_orders(extend_memory_data(all_missed_txns))
+            update_txn_number(all_missed_txns[-1]['Transaction number'])
+            fetched += len(all_missed_txns)
+        if not missed.get("more") or not all_missed_txns:
+            log.info("Caught up with the leader, %s orders fetched", fetched)
+            return
 
-class Order(http.server.BaseHTTPRequestHandler):
+def bootstrap_from_snapshot(leader_pool):
+    # This downloads the latest snapshot of the leader and appends the orders of it that this follower is missing,
+    # in large chunks read straight from the file. The snapshot is kept as the follower's own. Returns whether it was installed
+    download_path = order_snapshotter.path + ".download"
+    start = time.monotonic()
+    try:
+        with leader_pool.get("/snapshot", stream=True, timeout=(connect_timeout, snapshot_timeout)) as resp:
+            if resp.status_code != 200:
+                log.warning("No snapshot from the leader: %s", resp.status_code)
+                return False
+            with open(download_path, 'wb') as file:
+                for chunk in resp.iter_content(1 << 16):
+                    file.write(chunk)
+        snapshot_txn, _, orders = read_snapshot(download_path)
+    except (requests.RequestException, ValueError) as error:
+        log.warning("Snapshot bootstrap failed: %s", error)
+        return False
+
+    last_txn = get_last_txn_number()
+    appended = 0
+    chunk = []
+    for order in orders:
+        if last_txn is not None and order['Transaction number'] <= last_txn:
+            continue
+        # the orders of the snapshot have to continue the log of this follower
+        if last_txn is not None and not appended and not chunk and order['Transaction number'] != last_txn + 1:
+            log.warning("Snapshot up to %s does not continue the log after %s", snapshot_txn, last_txn)
+            return False
+        chunk.append(order)
+        if len(chunk) >= bootstrap_chunk_size:
+            persist_orders(extend_memory_data(chunk))
+            appended += len(chunk)
+            chunk = []
+    if chunk:
+        persist_orders(extend_memory_data(chunk))
+        appended += len(chunk)
+    if appended:
+        update_txn_number(snapshot_txn)
+    os.replace(download_path, order_snapshotter.path)
+    order_snapshotter.installed(snapshot_txn)
+    log.info("Bootstrapped %s orders up to %s from the leader's snapshot in %.2fs", appended, snapshot_txn,
+             time.monotonic() - start)
+    return True
+
+# Writes snapshots of the order log from a background thread. A snapshot covers the orders written to the log when
+# it starts. They are read back from the segments without holding the lock, so trades go on while it is written.
+class OrderSnapshotter:
+    def __init__(self, path):
+        self.path = path
+        self.last_txn = snapshot_last_txn(path)
+        self.requested = False
+        self.builds = 0
+        self.cond = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def request(self):
+        with self.cond:
+            self.requested = True
+            self.cond.notify_all()
+
+    def installed(self, last_txn):
+        # a snapshot downloaded from the leader took the place of this instance's snapshot
+        with self.cond:
+            self.last_txn = last_txn
+
+    def latest(self, max_lag):
+        # returns the last transaction number of a snapshot at most max_lag orders behind the log, building a new
+        # one first if needed. None means there is no snapshot
+        target = get_last_txn_number()
+        with self.cond:
+            if target is not None and (self.last_txn is None or target - self.last_txn > max_lag):
+                builds = self.builds
+                self.requested = True
+                self.cond.notify_all()
+                while self.builds == builds:
+                    self.cond.wait()
+            return self.last_txn
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.requested:
+                    self.cond.wait()
+                self.requested = False
+            # a failed build must neither end the thread nor leave the callers of latest() waiting forever
+            try:
+                self.build()
+            except Exception as error:
+                log.error("Snapshot failed: %r", error)
+            finally:
+                with self.cond:
+                    self.builds += 1
+                    self.cond.notify_all()
+
+    def build(self):
+        # the snapshot covers the orders written to the order log when it starts, read back from the segments
+        upto_txn = order_log.last_txn
+        if upto_txn is None or upto_txn == self.last_txn:
+            return
+        start = time.monotonic()
+        try:
+            last_txn, count = write_snapshot(self.path, order_log.iter_orders(upto_txn=upto_txn))
+        except (OSError, ValueError) as error:
+            log.error("Snapshot failed: %s", error)
+            return
+        with self.cond:
+            self.last_txn = last_txn
+        log.info("Snapshot of %s orders up to %s written in %.2fs", count, last_txn, time.monotonic() - start)
+
+class ReplicationRound:
+    """Counts the acknowledgements of the followers for one replicated order."""
+
+    def __init__(self, followers):
+        self.followers = followers
+        self.acked = 0
+        self.failed = 0
+        self.cond = threading.Condition()
+        # the span of the trade, the replicators send the order in its trace
+        self.trace_span = tracing.current_span.get()
+
+    def done(self, success):
+        with self.cond:
+            if success:
+                self.acked += 1
+            else:
+                self.failed += 1
+            self.cond.notify_all()
+
+    def wait(self, policy, timeout):
+        # blocks until the acknowledgement policy is met, every follower answered or the timeout passed,
+        # and returns whether the policy was met
+        if policy == "async":
+            return True
+        # a majority of the followers plus the leader, which already has the order
+        needed = self.followers if policy == "all" else (self.followers + 1) // 2
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.acked < needed and self.acked + self.failed < self.followers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.acked >= needed
+
+# Sends the replicated orders to one follower from a background thread, in the order they were queued, over the
+# pooled keep-alive connections to it. The followers are served in parallel by their own replicators, so a slow
+# follower only delays its own queue and each call is bounded by the replication timeout.
+# The orders that queue up while a request is in flight go out together as one range of consecutive orders.
+class FollowerReplicator:
+    def __init__(self, node):
+        self.instance_id = node["instance_id"]
+        self.pool = get_pool("order", node["host"], node["port"])
+        self.queue = Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def enqueue(self, message, replication_round):
+        self.queue.put((message, replication_round))
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < replication_batch_max:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            # a batch is sent in the trace of its first order
+            token = tracing.current_span.set(batch[0][1].trace_span)
+            try:
+                success = self.send(batch)
+            finally:
+                tracing.current_span.reset(token)
+            for _, replication_round in batch:
+                replication_round.done(success)
+
+    def send(self, batch):
+        # posts a batch of queued orders and returns whether the follower acknowledged all of them
+        if replication_batch_max == 1:
+            path, message = "/updateOrderLog", batch[0][0]
+        else:
+            path = "/updateOrderLogBatch"
+            message = {
+                "orders": [queued["successful_order_data"] for queued, _ in batch],
+                "previous_txn_num": batch[0][0]["previous_txn_num"],
+                "current_leader_details": batch[-1][0]["current_leader_details"],
+            }
+        try:
+            response = self.pool.post(path, json=message, timeout=(connect_timeout, replication_timeout))
+            return response.status_code == 200
+        except requests.RequestException:
+            log.warning("Failed to send %s orders to %s", len(batch), self.instance_id)
+            return False
+
+replicators = {}
+
+def replicate(new_detail, previous_transaction_num):
+    # This queues a new order for every follower and returns the round that collects their acknowledgements.
+    # Only the leader replicates, it knows the followers from the last leader notification
+    followers = []
+    if INSTANCE_ID == LEADER_ID and ALL_ORDER_NODES:
+        followers = [node for node in ALL_ORDER_NODES.values() if node["instance_id"] != INSTANCE_ID]
+    replication_round = ReplicationRound(len(followers))
+    message = {
+        "successful_order_data": new_detail,
+        "previous_txn_num": previous_transaction_num,
+        "current_leader_details": {
+            "host": LEADER_HOST,
+            "port": LEADER_PORT,
+            "instance_id": LEADER_ID
+        }
+    }
+    for node in followers:
+        replicator = replicators.get(node["instance_id"])
+        if replicator is None or replicator.pool.base_url != f"http://{node['host']}:{node['port']}":
+            replicator = replicators[node["instance_id"]] = FollowerReplicator(node)
+        replicator.enqueue(message, replication_round)
+    return replication_round
+
+
+class Order(LoggingHandlerMixIn, TracingHandlerMixIn, MetricsHandlerMixIn, PooledRequestHandlerMixIn,
+            http.server.BaseHTTPRequestHandler):
+    # http protocol version that supports persistent connections, so the pooled connections of the callers are reused
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without TCP_NODELAY a keep-alive response waits on the delayed ACK of the peer
+    disable_nagle_algorithm = True
+    # the routes the request metrics are labelled with
+    metric_routes = ("/query/*", "/isalive", "/order_log_stats", "/snapshot", "/metrics", "/pool_stats", "/trade_batch",
+                     "/trade", "/notify", "/updateOrderLogBatch", "/updateOrderLog", "/syncOrderData")
+    # the line of every request is logged at debug level
+    logger = log
 
-    # Like in catalog, an RLock is used in order service
     def __init__(self, *args, **kwargs):
-        self.lock = threading.RLock()
         global LEADER_ID
         global ALL_ORDER_NODES
         global LEADER_HOST
         global LEADER_PORT
         global memory_data
 
-        # Creating the path to the order service for the particular Instance ID
-        self.order_log = os.path.join(os.getcwd(), "purchase_app", "resources", f"order_log_{INSTANCE_ID}.csv")
-
         # the in memory data structure useful for updating the log
 
         # defines the port and host name for the catalog service
@@ -124,40 +563,51 @@ class Order(http.server.BaseHTTPRequestHandler):
 
         super().__init__(*args, **kwargs)
 
-    def calculate_txn_number(self):
-        # This calls the global function that returns the transaction number to be assigned to the next incoming order
-        transaction_number = get_next_txn_number()
-        print(f"Transaction number: {transaction_number}")
-        return transaction_number
-
+    # function to send a json response back to the caller
+    def send_json(self, status, body):
+        answer = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-length", len(answer))
+        self.end_headers()
+        self.wfile.write(answer)
 
     def do_GET(self):
         global memory_data
+        global queries_served
+        global queries_behind
         # verifies that the path of the front-end service is correct
         if self.path.startswith("/query/"):
             # Queries the orders
             order_no = self.path.split("/query/")[1]
 
-            # a read lock for every read request
-            with self.lock:
-                for data in memory_data:
-
-                    # check if the number received is valid
-                    if str(data["Transaction number"]) == order_no:
-                        request_response = {
-                            "number" : data["Transaction number"],
-                            "name" : data["name"],
-                            "type" : data["order type"],
-                            "quantity" : data["quantity"]
-                        }
-
-                        # successful response sent back
-                        final_response = json.dumps({"data" : request_response})
-                        self.send_response(200)
-                        self.send_header("Content-type", "application/json")
-                        self.end_headers()
-                        self.wfile.write(final_response.encode("utf-8"))
-                        return
+            # a follower may not have received a recent order yet. Rather than answering 404 for it, a follower that
+            # has not caught up with the order answers 409 so that the front-end forwards the query to the leader
+            if INSTANCE_ID != LEADER_ID and order_no.isdigit():
+                last_txn = get_last_txn_number()
+                if last_txn is None or int(order_no) > last_txn:
+                    with query_stats_lock:
+                        queries_behind += 1
+                    self.send_json(409, {"error" : {"code" : 409, "message" : "replica is behind", "last_txn" : last_txn}})
+                    return
+            with query_stats_lock:
+                queries_served += 1
+
+            # the order is found through the transaction number index
+            data = get_order(int(order_no)) if order_no.isdigit() else None
+
+            # check if the number received is valid
+            if data is not None:
+                request_response = {
+                    "number" : data["Transaction number"],
+                    "name" : data["name"],
+                    "type" : data["order type"],
+                    "quantity" : data["quantity"]
+                }
+
+                # successful response sent back
+                self.send_json(200, {"data" : request_response})
+                return
 
             # error message for invalid number
             fail_response = {
@@ -166,22 +616,54 @@ class Order(http.server.BaseHTTPRequestHandler):
             }
 
             # error message sent back
-            final_message = json.dumps({"error" : fail_response})
-            self.send_response(404)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(final_message.encode("utf-8"))
+            self.send_json(404, {"error" : fail_response})
+            return
 
         if re.search("/isalive", self.path):
             # This accepts the health check request from the frontend and returns 200 status code if the service is up
             # print("Inside isalive")
-            final_message = json.dumps({"instance_id": INSTANCE_ID, "status": "OK"} )
-            self.send_response(200)
-            self.send_header("Content-type", 'application/json')
-            self.end_headers()
-            self.wfile.write(final_message.encode("utf-8"))
+            self.send_json(200, {"instance_id": INSTANCE_ID, "status": "OK"} )
             return
 
+        if self.path == "/order_log_stats":
+            # size of the hot window and the read cache of the older orders
+            with lock:
+                hot_orders = len(memory_data)
+                first_hot_txn = memory_data.first_txn()
+            stats = {"orders" : order_log.records, "hot_orders" : hot_orders, "first_hot_txn" : first_hot_txn,
+                     "segments" : len(order_log.segment_list), "read_cache" : order_log.cache_stats(),
+                     "queries_served" : queries_served, "queries_behind" : queries_behind}
+            self.send_json(200, {"data" : stats})
+            return
+
+        if self.path == "/snapshot":
+            # serves a recent snapshot of the order log to a follower that bootstraps from it
+            snapshot_txn = order_snapshotter.latest(snapshot_bootstrap_gap)
+            if snapshot_txn is None:
+                self.send_json(404, {"error" : {"code" : 404, "message" : "no snapshot"}})
+                return
+            # the open file stays readable even if a newer snapshot is renamed over it meanwhile
+            with open(order_snapshotter.path, 'rb') as snapshot:
+                self.send_response(200)
+                self.send_header("Content-type", "application/octet-stream")
+                self.send_header("Content-length", os.fstat(snapshot.fileno()).st_size)
+                self.end_headers()
+                shutil.copyfileobj(snapshot, self.wfile)
+            return
+
+        if self.path == "/metrics":
+            # request, lock and persistence metrics in the Prometheus text format
+            self.send_metrics()
+            return
+
+        if self.path == "/pool_stats" and hasattr(self.server, "pool_stats"):
+            # queue depth and wait times of the worker pool, when the service runs with SERVER_MODE=pool
+            self.send_json(200, {"data" : self.server.pool_stats()})
+            return
+
+        # unknown paths get an explicit error so that persistent connections are not left waiting
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
+
     def do_POST(self):
         global LEADER_ID
         global ALL_ORDER_NODES
@@ -189,19 +671,58 @@ class Order(http.server.BaseHTTPRequestHandler):
         global LEADER_PORT
         global memory_data
 
+        if self.path == "/trade_batch":
+            # a batch of trades costs one catalog round trip, the successful ones are then recorded together
+            length = int(self.headers.get('Content-Length', 0))
+            trades = json.loads(self.rfile.read(length))["trades"]
+
+            catalog_pool = get_pool("catalog", self.catalog_name, self.catalog_port)
+            try:
+                response = catalog_pool.post("/trade_batch", json = {"trades" : trades})
+            except requests.RequestException as error:
+                log.warning("Catalog trade batch failed: %r", error)
+                self.send_json(502, {"error" : {"code" : 502, "message" : "the catalog service failed to answer"}})
+                return
+            if response.status_code != 200:
+                self.send_json(response.status_code, response.json())
+                return
+            results = response.json()["data"]
+
+            # the catalog answers with one result per trade, in order
+            successful = [(trade, result) for trade, result in zip(trades, results) if result["status"] == 200]
+            new_details, ticket, replication_rounds = add_new_orders(
+                [(trade["name"], trade["type"], trade["quantity"]) for trade, _ in successful])
+            persist_orders(ticket)
+            for replication_round in replication_rounds:
+                self.broadcast_successful_trade(replication_round)
+
+            for (_, result), new_detail in zip(successful, new_details):
+                result["data"] = {'transaction number' : new_detail['Transaction number']}
+            self.send_json(200, {"data" : results})
+            return
+
         if re.search("/trade", self.path):
             # reads the request which is in form of a json object
             length = int(self.headers.get('Content-Length', 0))
             request_body = self.rfile.read(length)
             request_data = json.loads(request_body)
 
-            # the components are extracted from the request
-            name = request_data["name"]
-            quantity = request_data["quantity"]
-            type = request_data["type"]
+            # the components are extracted from the request, a malformed trade is answered with a 400 rather than
+            # breaking the connection, which the front-end would take for a crashed leader
+            try:
+                name = request_data["name"]
+                quantity = request_data["quantity"]
+                type = request_data["type"]
+            except (KeyError, TypeError):
+                self.send_json(400, {"error" : {"code" : 400, "message" : "malformed trade"}})
+                return
+            # bool is an int subclass, true is not a quantity. The order log holds 64-bit quantities
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or not 0 < quantity <= MAX_QUANTITY:
+                self.send_json(400, {"error" : {"code" : 400, "message" : "quantity must be a positive integer"}})
+                return
 
-            # the url used to connect with the catalog service
-            catalog_url = "http://" + self.catalog_name + ":" + str(self.catalog_port) + "/trade"
+            # the pooled connections used to reach the catalog service
+            catalog_pool = get_pool("catalog", self.catalog_name, self.catalog_port)
 
 
             # the details are sent as a JSON object to the catalog service
@@ -217,7 +738,12 @@ class Order(http.server.BaseHTTPRequestHandler):
             }
 
             # the response received back
-            response = requests.post(catalog_url, json = details, headers = headers)
+            try:
+                response = catalog_pool.post("/trade", json = details, headers = headers)
+            except requests.RequestException as error:
+                log.warning("Catalog trade failed: %r", error)
+                self.send_json(502, {"error" : {"code" : 502, "message" : "the catalog service failed to answer"}})
+                return
 
             # if the response has the status 404 then the error response is sent to the front-end
             if response.status_code == 404:
@@ -225,13 +751,8 @@ class Order(http.server.BaseHTTPRequestHandler):
                     "code" : 404,
                     "message" : "stock not found",
                 }
-                print(f"Error: {invalid_name}")
-                invalid_response = json.dumps({"error" : invalid_name})
-
-                self.send_response(404)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(invalid_response.encode("utf-8"))
+                log.debug("Error: %s", invalid_name)
+                self.send_json(404, {"error" : invalid_name})
                 return
 
             # if the response has the status 400 which means the amount of quantity to be bought is less than what is available
@@ -240,51 +761,33 @@ class Order(http.server.BaseHTTPRequestHandler):
                     "code" : 400,
                     "message" : "insufficient quantity",
                 }
-                print(f"Error: {insufficient_quantity}")
-                answer = json.dumps({"error" : insufficient_quantity})
-
-                self.send_response(400)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(answer.encode("utf-8"))
+                log.debug("Error: %s", insufficient_quantity)
+                self.send_json(400, {"error" : insufficient_quantity})
                 return
 
             # if the response has status 200 it means that the trade was successful and the transaction number of the trade is sent back
             if response.status_code == 200:
-                print(f"Calculating txn number")
-                # First calculate the transaction num to be assigned
-                transaction_number = self.calculate_txn_number()
-                new_detail = {
-                    'Transaction number' : transaction_number,
-                    'name' : name,
-                    'order type' : type,
-                    'quantity' : quantity
-                }
-
-                print(f"Before assigning previous txn num {memory_data}")
-                previous_transaction_num = None
-                if memory_data:
-                    # If there were any previous transactions in the memory data, then get the number of the latest one in it
-                    previous_transaction_num = get_last_txn_number()
-                append_to_memory_data(new_detail)
+                log.debug("Calculating txn number")
+                # The transaction number is assigned and the order recorded along with the number of the latest previous one
+                new_detail, previous_transaction_num, ticket, replication_round = add_new_order(name, type, quantity)
+                transaction_number = new_detail['Transaction number']
 
-                write_mem_data_to_file(self.order_log)
+                persist_orders(ticket)
 
                 right_answer = {
                     'transaction number' : transaction_number,
                 }
-                print(f"Broadcasting successful trade")
                 # Once a successful trade request is made, call the broadcast_successful_trade function to maintain data consistency
-                self.broadcast_successful_trade(new_detail, previous_transaction_num)
+                self.broadcast_successful_trade(replication_round)
 
-                final = json.dumps({"data" : right_answer})
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(final.encode("utf-8"))
+                self.send_json(200, {"data" : right_answer})
 
                 return
 
+            # any other error of the catalog service is passed back as it is
+            self.send_json(response.status_code, response.json())
+            return
+
         if re.search("/notify", self.path):
             # API that notifies the current instance of the leader and details all other nodes in the network
             # print("Inside notify")
@@ -293,7 +796,7 @@ class Order(http.server.BaseHTTPRequestHandler):
             request_body = self.rfile.read(length)
             request_data = json.loads(request_body)
             LEADER_ID = request_data["leader"]
-            print(f"The leader is: {LEADER_ID}")
+            log.info("The leader is: %s", LEADER_ID)
             ALL_ORDER_NODES = request_data["all_order_nodes"]
             # print(f"ALL_ORDER_NODES: {ALL_ORDER_NODES}")
             for k,v in ALL_ORDER_NODES.items():
@@ -307,6 +810,20 @@ class Order(http.server.BaseHTTPRequestHandler):
             self.wfile.write(b"OK")
             return
 
+        if self.path == "/updateOrderLogBatch":
+            # API that is called by the leader with a range of consecutive orders for a follower node,
+            # which appends them to its order logs in one step
+            if INSTANCE_ID != LEADER_ID:
+                length = int(self.headers.get('Content-Length'))
+                request_data = json.loads(self.rfile.read(length))
+                orders = [normalize_order(order) for order in request_data["orders"]]
+                apply_replicated_orders(orders, request_data["previous_txn_num"], request_data["current_leader_details"])
+                self.send_json(200, {"appended" : len(orders)})
+            else:
+                # only the followers apply the orders replicated by the leader
+                self.send_json(409, {"error" : {"code" : 409, "message" : "not a follower"}})
+            return
+
         if re.search("/updateOrderLog", self.path):
             # API that is called by the leader to maintain data consistency among all the follower nodes 
             # and is executed only if the receiver is a follower node. 
@@ -316,72 +833,48 @@ class Order(http.server.BaseHTTPRequestHandler):
                 request_body = self.rfile.read(length)
                 request_data = json.loads(request_body)
                 # print(f"For updating order log, data received: {request_data}")
-                successful_order_data = request_data["successful_order_data"]
+                successful_order_data = normalize_order(request_data["successful_order_data"])
                 leader_previous_txn_num = request_data["previous_txn_num"]
                 current_leader_details = request_data["current_leader_details"]
-                print("leader_previous_txn_num", leader_previous_txn_num)
+                log.debug("leader_previous_txn_num %s", leader_previous_txn_num)
                 # print("Memory data", memory_data)
-                print("Last txn no of current instance", get_last_txn_number())
-                if leader_previous_txn_num: # if there's no prev txn number then this is the first txn
-                    # Checks if the data in the follower node log files is in sync with the leader node logs
-                    if memory_data and get_last_txn_number() == leader_previous_txn_num:
-                        append_to_memory_data(successful_order_data)
-                        write_mem_data_to_file(self.order_log)
-                        update_txn_number(successful_order_data['Transaction number'])
-                    else:
-                        # If the last transaction number of the follower node and the leader node's previous transaction number 
-                        # do not match then it means the follower node had crashed and now its back alive and looking to sync its data.
-                        print("Calling syncdata", INSTANCE_ID)
-                        LEADER_HOST = current_leader_details["host"]
-                        LEADER_PORT = current_leader_details["port"]
-                        LEADER_ID = current_leader_details["instance_id"]
-                        order_url = "http://" + LEADER_HOST + ":" + str(LEADER_PORT) + "/syncOrderData"
-                        last_txn = {"last_txn": memory_data[-1]['Transaction number']}
-                        response_body_bytes = json.dumps(last_txn).encode(encoding='utf_8')
-                        response_content_length = len(response_body_bytes)
-                        headers = {
-                        'Content-Length': str(response_content_length),
-                        'Content-type': "application/json",
-                        }
-                        resp = requests.post(order_url, json=last_txn, headers=headers)
-                        all_missed_txns = resp.json()["all_missed_txns"]
-                        # now append all the transactions that the follower node missed, into its order logs
-                        extend_memory_data(all_missed_txns)
-                        write_mem_data_to_file(self.order_log)
-                        update_txn_number(all_missed_txns[-1]['Transaction number'])
-                else:
-                    # For initial transaction
-                    append_to_memory_data(successful_order_data)
-                    write_mem_data_to_file(self.order_log)
-                    update_txn_number(successful_order_data['Transaction number'])
+                if log.debug_enabled:
+                    log.debug("Last txn no of current instance %s", get_last_txn_number())
+                apply_replicated_orders([successful_order_data], leader_previous_txn_num, current_leader_details)
                 self.send_response(200)
                 self.send_header("Content-type", 'application/text')
                 self.send_header("Content-length", len(b"OK"))
                 self.end_headers()
                 self.wfile.write(b"OK")
+            else:
+                # only the followers apply the orders replicated by the leader
+                self.send_json(409, {"error" : {"code" : 409, "message" : "not a follower"}})
             return
 
         if re.search("/syncOrderData", self.path):
             # API to make sure that when a crashed replica is back online, it can synchronize with the other replicas 
             # to retrieve the order information that it has missed during the offline time.
             if INSTANCE_ID == LEADER_ID:
-                follower_last_txn_index = None
-                print("Inside syncdata")
+                log.debug("Inside syncdata")
                 length = int(self.headers.get('Content-Length', 0))
                 request_body = self.rfile.read(length)
                 request_data = json.loads(request_body)
-                # retreive the last transaction that was updated in the follower log file before it crashed
+                # retreive the last transaction that was updated in the follower log file before it crashed,
+                # None when the follower has no orders at all
                 follower_last_txn = request_data["last_txn"]
-                print("Last txn", follower_last_txn)
-                follower_last_txn_index = search_txn_mem_data(follower_last_txn)
-                if not follower_last_txn_index:
-                    print(f"Txn number {follower_last_txn} was not found, inconsistent state detected, stopping....")
-                    exit()
-                print("follower_last_txn_index", follower_last_txn_index)
-                # retreive all the transactions from the leader node's log file memory data
-                all_missed_transactions = memory_data[follower_last_txn_index+1:]
-                print("All missed", all_missed_transactions)
-                missed = {"all_missed_txns" : all_missed_transactions}
+                limit = int(request_data.get("limit") or sync_chunk_size)
+                log.debug("Last txn %s", follower_last_txn)
+                # retreive the next chunk of transactions from the leader node's memory data, sliced straight from the follower's last one
+                all_missed_transactions = get_orders_after(follower_last_txn, limit)
+                if all_missed_transactions is None:
+                    log.warning("Txn number %s was not found, inconsistent state detected", follower_last_txn)
+                    self.send_json(409, {"error" : {"code" : 409, "message" : "unknown transaction number"}})
+                    return
+                log.debug("Sending %s missed transactions", len(all_missed_transactions))
+                # the follower asks for the next chunk as long as more orders follow this one
+                leader_last_txn = get_last_txn_number()
+                more = bool(all_missed_transactions) and all_missed_transactions[-1]['Transaction number'] != leader_last_txn
+                missed = {"all_missed_txns" : all_missed_transactions, "more" : more, "leader_last_txn" : leader_last_txn}
                 resp = json.dumps(missed).encode(encoding='utf_8')
                 response_content_length = len(resp)
                 self.send_response(200)
@@ -389,45 +882,33 @@ class Order(http.server.BaseHTTPRequestHandler):
                 self.send_header("Content-length", response_content_length)
                 self.end_headers()
                 self.wfile.write(resp)
+            else:
+                # only the leader serves the missed orders
+                self.send_json(409, {"error" : {"code" : 409, "message" : "not the leader"}})
             return
 
+        # unknown paths get an explicit error so that persistent connections are not left waiting
+        self.send_json(404, {"error" : {"code" : 404, "message" : "not found"}})
+
 
-    def broadcast_successful_trade(self, new_detail, previous_transaction_num):
-        # This sends the successful trade details along with the leader's previous transaction 
-        # number and the current order details to all the other nodes in the network
-        if INSTANCE_ID == LEADER_ID:
-            for node_num in list(ALL_ORDER_NODES.keys()):
-                node_host = ALL_ORDER_NODES[node_num]["host"]
-                node_port = ALL_ORDER_NODES[node_num]["port"]
-                node_id = ALL_ORDER_NODES[node_num]["instance_id"]
-                if node_id != INSTANCE_ID:
-                    order_url = "http://" + node_host + ":" + str(node_port) + "/updateOrderLog"
-                    content_length = int(self.headers.get('Content-Length'))
-                    headers = {
-                    'Content-Length': str(content_length),
-                    'Content-type': "application/json",
-                    }
-                    try:
-                        success_data = {
-                            "successful_order_data": new_detail, 
-                            "previous_txn_num": previous_transaction_num,
-                            "current_leader_details": {
-                                "host": LEADER_HOST,
-                                "port": LEADER_PORT,
-                                "instance_id": LEADER_ID
-                            }
-                        }
-                        print(f"Broadcasting trade to {order_url}")
-                        requests.post(order_url, json=success_data, headers=headers)
-                    except:
-                        print(f"Failed to send successful order data to {node_id}")
-                        continue
+    def broadcast_successful_trade(self, replication_round):
+        # The order was already queued for every follower, the replicators send it in parallel.
+        # This waits for their acknowledgements as required by the REPLICATION_ACK policy
+        with tracing.span("replication wait"):
+            met = replication_round.wait(replication_ack, replication_timeout)
+        if not met:
+            log.warning("Replication policy %s not met: %s of %s followers acknowledged", replication_ack,
+                        replication_round.acked, replication_round.followers)
         return
 
 # just like in catalog service, thread-per-request model is used for the order service
 class Order_with_Threads(socketserver.ThreadingMixIn, http.server.HTTPServer):
     daemon_threads = True
 
+# a fixed number of worker threads behind a bounded queue, overloads get a 503 with Retry-After
+class Order_with_Pool(WorkerPoolMixIn, http.server.HTTPServer):
+    pass
+
 if __name__ == "__main__":
 
     # Accept instance id via command line argument
@@ -437,32 +918,36 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--port", help="Port no of each replica", required=True)
     args = parser.parse_args()
     INSTANCE_ID = str(args.instanceid)
-    print(f"Instance ID: {INSTANCE_ID}")
+    tracing.service_name = f"order-{INSTANCE_ID}"
+    log.info("Instance ID: %s", INSTANCE_ID)
     hostName = str(args.host)
     PORT = int(args.port)
-    order_log_2 = os.path.join(os.getcwd(), "purchase_app", "resources", f"order_log_{INSTANCE_ID}.csv")
-    try:
-        # create file
-        with open(order_log_2, 'x') as fp:
-            print(f"File created at: {order_log_2}")
-    except:
-        # print('File already exists')
-        pass
-    # the data from the order log is read into the memory_data
-    with open(order_log_2, 'r', encoding = 'utf-8-sig') as file:
-        read = csv.DictReader(file)
-        for data in read:
-            append_to_memory_data(data)
-    # if the file already has data in it, get the last transaction number
+    order_log_dir = os.path.join(os.getcwd(), "purchase_app", "resources", f"order_log_{INSTANCE_ID}")
+    order_log = OrderLog(order_log_dir, order_log_segment_records, order_index_stride, order_read_cache_blocks)
+    # an order log csv of an earlier version of the service is imported into the segments once
+    legacy_order_log = order_log_dir + ".csv"
+    if not order_log.segments() and os.path.exists(legacy_order_log):
+        order_log.import_csv(legacy_order_log)
+    # the memory_data is rebuilt from the newest orders of the order log, recovery also cuts off a torn tail left by a crash
+    memory_data.extend(order_log.recover(hot_window_orders))
+    log.info("Replayed %s orders from %s, %s kept in memory", order_log.records, order_log_dir, len(memory_data))
+    # if the log already has data in it, get the last transaction number
     get_last = get_last_txn_number()
     if get_last:
         update_txn_number(get_last)
-    server = Order_with_Threads((hostName, PORT), Order)
-    print("Order service started http://%s:%s" % (hostName, PORT))
+    order_log_committer = GroupCommitter(write_orders, sync_order_log, name="order_log", **policy_from_env())
+    order_snapshotter = OrderSnapshotter(os.path.join(order_log_dir, "snapshot.bin"))
+    # SERVER_MODE selects between a thread per connection and the bounded worker pool
+    server_class = Order_with_Pool if server_mode == "pool" else Order_with_Threads
+    server = server_class((hostName, PORT), Order)
+    log.info("Order service started http://%s:%s", hostName, PORT)
 
     # the server stops only at a keyboard interruption
     try:
         server.serve_forever()
 
     except KeyboardInterrupt:
+        # the orders still waiting for their group commit are written before the log is closed
+        order_log_committer.flush()
+        order_log.close()
         server.shutdown()
\ No newline at end of file